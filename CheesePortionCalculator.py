@@ -1,56 +1,190 @@
+import logging
 import os
 import tkinter as tk
 from tkinter import ttk
 from tkinter.messagebox import showinfo
-import random
+import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
+
+from background_tasks import BackgroundRunner
+from density_maps import open_density_map
+from image_export import ImageExporter
+from instrumentation import NULL_RUN, Instrumentation
+from loaf_generator import generate_dimensions
+from optimal_cuts import compare_with_greedy
+from portion_engine import forward_portions
+from portion_pipeline import compare_targets, make_params
+from portion_renderer import PortionRenderer
+from result_cache import ResultCache, cache_key
+from scan_io import open_scan
+from stats_panel import StatsPanel
+from target_panel import TargetComparisonPanel
+from three_packers import ComplianceTracker, get_tne
+from virtual_views import VirtualListView
+from volume_integration import INTEGRATION_METHODS, density_and_slice_weights
 
 def calculate():
+    # Read the inputs on the Tk thread, then hand the heavy work to the background runner.
+    # Clicking again while a run is in progress restarts it with the latest inputs.
+    try:
+        inputs = {
+            "total_weight": float(total_weight_var.get()),
+            "slice_thickness": float(slice_thickness_var.get()),
+            "target_portion_weight": float(target_portion_weight_var.get()),
+            "average_width": float(average_width_var.get()),
+            "average_height": float(average_height_var.get()),
+            "number_of_slices": int(number_of_slices_var.get()),
+            "include_waste": include_waste_var.get(),
+            "optimal": use_optimal_cuts.get(),
+            "integration_method": integration_method_var.get(),
+            "tolerance": tolerance_var.get() / 100,
+            "seed": int(seed_var.get()) if seed_var.get().strip() else None,
+            "scan_file": scan_file_var.get().strip(),
+            "scan_loaf": int(scan_loaf_var.get()) if scan_loaf_var.get().strip() else 0,
+            "density_map": density_map_var.get().strip(),
+            "compare_targets": [float(value) for value in compare_targets_var.get().replace(",", " ").split()],
+        }
+    except ValueError:
+        showinfo("Error", "Please enter valid numbers!")
+        return
+
+    progress_var.set(0)
+    progress_status_var.set("Calculating...")
+    cancel_button.state(["!disabled"])
+    calculation_runner.submit(compute_loaf, inputs)
+
+
+def compute_loaf(task, inputs):
+    # Runs on a worker thread: no Tk calls here, only task.progress().
+    # Stage timings go to the instrumentation, a no-op unless switched on (see instrumentation.py).
+    run = instrumentation.start_run("calculate")
+    slice_thickness = inputs["slice_thickness"]
+    target_portion_weight = inputs["target_portion_weight"]
+    tolerance = inputs["tolerance"]
+
+    # Recorded scanner profiles replace the synthetic loaf (see scan_io.py).
+    scan_loaf = None
+    if inputs["scan_file"]:
+        scan_loaf = open_scan(inputs["scan_file"]).loaf(inputs["scan_loaf"])
+        slice_thickness = scan_loaf.slice_thickness or slice_thickness
+        inputs = dict(inputs, slice_thickness=slice_thickness)
+
+    # An X-ray density map (eyes, rind) replaces the uniform density (see density_maps.py).
+    density_map = None
+    if inputs["density_map"]:
+        density_map = open_density_map(inputs["density_map"])
+
+    # A seeded loaf or a scan is reproducible, so its result can come from the cache (see result_cache.py).
+    # Scans and density maps are keyed on their data, not their file names.
+    key = None
+    if inputs["seed"] is not None or scan_loaf is not None:
+        key_inputs = {name: value for name, value in inputs.items()
+                      if name not in ("scan_file", "scan_loaf", "density_map")}
+        key_arrays = []
+        if scan_loaf is not None:
+            key_arrays += [scan_loaf.dims, scan_loaf.slice_positions()]
+            if scan_loaf.contours is not None:
+                key_arrays.append(scan_loaf.contours)
+        if density_map is not None:
+            key_inputs["voxel_size"] = density_map.voxel_size
+            key_arrays.append(density_map.plane_masses())
+        key = cache_key(key_inputs, *key_arrays)
+    if key is not None:
+        run.lap("cache")
+        cached = result_cache.get(key)
+        if cached is not None:
+            task.progress(80, "Loaded from cache...")
+            run.end_stage()
+            run.count(cached=True)
+            return dict(cached, metrics=run)
+
+    if scan_loaf is not None:
+        task.progress(5, "Reading scan...")
+        run.lap("scan")
+        dims = scan_loaf.dims
+        positions = scan_loaf.slice_positions()
+        cross_sectional_areas = scan_loaf.areas  # polygon areas when the scan has contours
+    else:
+        # Generate cross-sectional areas (blank seed = new random loaf each time)
+        task.progress(5, "Generating loaf...")
+        run.lap("generate")
+        dims = generate_dimensions(inputs["number_of_slices"], inputs["average_width"], inputs["average_height"],
+                                   seed=inputs["seed"])
+        positions = None
+        cross_sectional_areas = dims[:, 0] * dims[:, 1]
+
+    if density_map is not None:
+        # Measured mass per mm along the loaf stands in for area x uniform density.
+        task.progress(20, "Reducing density map...")
+        run.lap("density")
+        cross_sectional_areas = density_map.slice_profile(len(cross_sectional_areas), slice_thickness, positions)
+
+    # Calculate density and slice weights
+    task.progress(35, "Integrating volume...")
+    run.lap("integrate")
+    total_volume, density, slice_weights = density_and_slice_weights(
+        cross_sectional_areas, inputs["total_weight"], slice_thickness, inputs["integration_method"],
+        positions=positions,
+    )
+
+    # Portion calculation (vectorized, see portion_engine.py)
+    task.progress(55, "Cutting portions...")
+    run.lap("portion")
+    optimal_report = None
+    if inputs["optimal"]:
+        # Place all cuts together instead of greedily (see optimal_cuts.py)
+        portions, remainder, optimal_report = compare_with_greedy(
+            slice_weights, slice_thickness, target_portion_weight, tolerance
+        )
+    else:
+        portions, remainder, _ = forward_portions(
+            slice_weights, slice_thickness, target_portion_weight * tolerance  # Allow % tolerance
+        )
+
+    # Every comparison target cut from this same loaf (see portion_pipeline.compare_targets).
+    comparison = None
+    if inputs["compare_targets"]:
+        task.progress(70, "Comparing targets...")
+        run.lap("compare")
+        params = make_params(slice_thickness=slice_thickness, tolerance=tolerance, optimal=inputs["optimal"],
+                             reverse=False)
+        comparison = compare_targets(slice_weights, params, inputs["compare_targets"])
+    task.progress(80, "Displaying results...")
+    run.end_stage()
+    result = {
+        "inputs": inputs,
+        "slice_weights": slice_weights,
+        "portions": portions,
+        "remainder": remainder,
+        "optimal_report": optimal_report,
+        "comparison": comparison,
+    }
+    if key is not None:
+        result_cache.put(key, result)
+    return dict(result, metrics=run)
+
+
+def show_results(result):
+    # Back on the Tk thread: compliance, output views and the visualization.
+    run = result.get("metrics", NULL_RUN)
+    run.lap("results")
     try:
-        # Get inputs
         global target_portion_weight
         global include_waste
         global current_weight
 
-        total_weight = float(total_weight_var.get())
-        slice_thickness = float(slice_thickness_var.get())
-        target_portion_weight = float(target_portion_weight_var.get())
-        average_width = float(average_width_var.get())
-        average_height = float(average_height_var.get())
-        number_of_length_cross_sections = int(number_of_slices_var.get())
-        include_waste = include_waste_var.get()
-        tolerance = tolerance_var.get() / 100
-
-        # Generate cross-sectional areas
-        cross_sectional_areas = [
-            (random.gauss(average_width, 2)) * (random.gauss(average_height, 2))
-            for _ in range(number_of_length_cross_sections)
-        ]
+        inputs = result["inputs"]
+        slice_thickness = inputs["slice_thickness"]
+        target_portion_weight = inputs["target_portion_weight"]
+        average_width = inputs["average_width"]
+        average_height = inputs["average_height"]
+        include_waste = inputs["include_waste"]
+        slice_weights = result["slice_weights"]
+        portions = result["portions"]
+        remainder = result["remainder"]
+        optimal_report = result["optimal_report"]
+        current_weight = remainder[3]
 
-        # Calculate density
-        total_volume = sum(area * slice_thickness for area in cross_sectional_areas)
-        density = total_weight / total_volume
-
-        # Portion calculation
-        portions = []
-        current_weight = 0
-        current_length = 0
-        start_index = 0
-        slice_weights = []
-
-        for i, area in enumerate(cross_sectional_areas):
-            slice_weight = area * slice_thickness * density
-            slice_weights.append(slice_weight)
-            current_weight += slice_weight
-            current_length += slice_thickness
-
-            if current_weight >= target_portion_weight * tolerance:  # Allow % tolerance
-                portions.append((start_index, i, current_length, current_weight))
-                current_weight = 0
-                current_length = 0
-                start_index = i + 1
-        
         global waste
         waste = current_weight
 
@@ -58,7 +192,7 @@ def calculate():
         waste_portion = None
         if waste > 0:
             waste_hypothetical = waste
-            waste_portion = (start_index, len(cross_sectional_areas) - 1, current_length, waste)
+            waste_portion = remainder
 
             if include_waste:
                 # Distribute waste evenly across all portions if enabled
@@ -69,66 +203,57 @@ def calculate():
                 ]
                 waste = 0  # Waste is now redistributed, so there's no leftover waste
 
-        # UK three packers rule - https://www.stevenstraceability.com/average-weight-explained/
-        # TNE Calculation Based on TNE Table
-        def get_tne(nominal_weight):
-            if 5 <= nominal_weight <= 50:
-                return nominal_weight * 0.09  # 9% of nominal weight
-            elif 50 < nominal_weight <= 100:
-                return 4.5  # Fixed 4.5 g
-            elif 100 < nominal_weight <= 200:
-                return nominal_weight * 0.045  # 4.5%
-            elif 200 < nominal_weight <= 300:
-                return 9  # Fixed 9 g
-            elif 300 < nominal_weight <= 500:
-                return nominal_weight * 0.03  # 3%
-            elif 500 < nominal_weight <= 1000:
-                return 15  # Fixed 15 g
-            elif 1000 < nominal_weight <= 10000:
-                return nominal_weight * 0.015  # 1.5%
-            elif 10000 < nominal_weight <= 15000:
-                return 150  # Fixed 150 g
-            elif nominal_weight > 15000:
-                return nominal_weight * 0.01  # 1%
-            else:
-                return 0
-
-        tne = get_tne(target_portion_weight)
+        # UK three packers rule - see three_packers.py for the TNE table
         global t1_tolerance
         global t2_tolerance
+        global shift_compliance
+        tne = get_tne(target_portion_weight)
         t1_tolerance = tne  # T1 = 1x TNE
         t2_tolerance = 2 * tne  # T2 = 2x TNE
 
-        # Rule 1: Average weight must meet or exceed nominal weight
         valid_portions = portions[:-1] if waste_portion and not include_waste else portions
-        total_portion_weight = sum(weight for _, _, _, weight in valid_portions)
-        average_portion_weight = total_portion_weight / len(valid_portions)
-        rule1_pass = average_portion_weight >= target_portion_weight
-
+        portion_weights = [weight for _, _, _, weight in valid_portions]
+        compliance = ComplianceTracker(target_portion_weight)
+        compliance.add_many(portion_weights)
+        # Rule 1: Average weight must meet or exceed nominal weight
+        average_portion_weight = compliance.average_weight
+        rule1_pass = compliance.rule1_pass
         # Rule 2: No more than 2.5% of portions can fall below T1 tolerance
-        t1_violations = [weight for _, _, _, weight in valid_portions if weight < target_portion_weight - t1_tolerance]
-        rule2_pass = len(t1_violations) <= len(valid_portions) * 0.025
-
+        rule2_pass = compliance.rule2_pass
         # Rule 3: No portions can fall below T2 tolerance
-        t2_violations = [weight for _, _, _, weight in valid_portions if weight < target_portion_weight - t2_tolerance]
-        rule3_pass = len(t2_violations) == 0
+        rule3_pass = compliance.rule3_pass
+
+        # Accumulate into the shift batch (a new batch starts when the target changes)
+        if shift_compliance is None or shift_compliance.nominal_weight != target_portion_weight:
+            shift_compliance = ComplianceTracker(target_portion_weight)
+        shift_compliance.merge(compliance)
 
-        # Display Slice Weights in the first output box
-        slice_output.delete("1.0", tk.END)
-        for idx, weight in enumerate(slice_weights):
-            slice_output.insert(tk.END, f"Slice {idx + 1}: Weight = {weight:.2f} g\n")
+        # Display Slice Weights in the first output box (only the visible rows are formatted)
+        slice_output.set_rows(len(slice_weights), lambda idx: f"Slice {idx + 1}: Weight = {slice_weights[idx]:.2f} g")
 
         # Display T1 and T2 results in the second output box
-        cut_solution_output.delete("1.0", tk.END)
-        cut_solution_output.insert(tk.END, "--- Three Packers Rule Compliance ---\n")
-        cut_solution_output.insert(tk.END, f"Rule 1 (Average Weight >= Nominal): {'PASS' if rule1_pass else 'FAIL'}\n")
-        cut_solution_output.insert(tk.END, f"  - Average Weight: {average_portion_weight:.2f} g\n")
-        cut_solution_output.insert(tk.END, f"Rule 2 (T1 Violations ≤ 2.5%): {'PASS' if rule2_pass else 'FAIL'}\n")
+        header = [
+            "--- Three Packers Rule Compliance ---",
+            f"Rule 1 (Average Weight >= Nominal): {'PASS' if rule1_pass else 'FAIL'}",
+            f"  - Average Weight: {average_portion_weight:.2f} g",
+            f"Rule 2 (T1 Violations ≤ 2.5%): {'PASS' if rule2_pass else 'FAIL'}",
+        ]
         if not rule2_pass:
-            cut_solution_output.insert(tk.END, f"  - T1 Violations: {len(t1_violations)} / {len(valid_portions)}\n")
-        cut_solution_output.insert(tk.END, f"Rule 3 (No T2 Violations): {'PASS' if rule3_pass else 'FAIL'}\n")
+            header.append(f"  - T1 Violations: {compliance.t1_count} / {len(valid_portions)}")
+        header.append(f"Rule 3 (No T2 Violations): {'PASS' if rule3_pass else 'FAIL'}")
         if not rule3_pass:
-            cut_solution_output.insert(tk.END, f"  - T2 Violations: {len(t2_violations)}\n")
+            header.append(f"  - T2 Violations: {compliance.t2_count}")
+
+        # Running batch status for the whole shift (the rules legally apply per batch)
+        shift = shift_compliance.status()
+        header += [
+            "",
+            f"--- Shift Batch: {shift['count']} Portions ---",
+            f"Rule 1: {shift['rule1']}  (Average {shift['average_weight']:.2f} g, "
+            f"total headroom {shift['rule1_headroom']:.1f} g)",
+            f"Rule 2: {shift['rule2']}  (T1 {shift['t1_count']}, {shift['rule2_headroom']} more allowed)",
+            f"Rule 3: {shift['rule3']}  (T2 {shift['t2_count']})",
+        ]
 
         # Calculate the total loaf length
         global total_loaf_length
@@ -137,34 +262,55 @@ def calculate():
             total_loaf_length += waste_portion[2]  # Add waste length if waste is not included
 
         # Display total loaf length
-        cut_solution_output.insert(tk.END, f"\nTotal Loaf Length: {total_loaf_length:.2f} mm\n")
-
-        # Display portion details
-        for idx, (start, end, length, weight) in enumerate(portions):
-            cut_solution_output.insert(tk.END,
-                f"\nPortion {idx + 1}:\n"
-                f"  Start Slice = {start}\n"
-                f"  End Slice = {end}\n"
-                f"  Length = {length:.2f} mm\n"
-                f"  Weight = {weight:.2f} g\n\n"
-            )
+        header += ["", f"Total Loaf Length: {total_loaf_length:.2f} mm", ""]
+
+        # Portion details, one row per portion, formatted when scrolled into view
+        def portion_row(idx):
+            start, end, length, weight = portions[idx]
+            return (f"Portion {idx + 1}: Slices {start}-{end}, "
+                    f"Length = {length:.2f} mm, Weight = {weight:.2f} g")
+
+        # Filters only look at the portions the compliance check counted
+        portion_weight_array = np.array([weight for _, _, _, weight in portions])
+        checked = np.zeros(len(portions), dtype=bool)
+        checked[:len(valid_portions)] = True
+        portion_filters = {
+            "Below T1": lambda: np.flatnonzero(checked & (portion_weight_array < compliance.t1_limit)),
+            "Below T2": lambda: np.flatnonzero(checked & (portion_weight_array < compliance.t2_limit)),
+            "Below Target": lambda: np.flatnonzero(checked & (portion_weight_array < target_portion_weight)),
+        }
 
         # Display waste details (if applicable)
+        footer = [""]
         if waste_portion and not include_waste:
-            cut_solution_output.insert(tk.END,
-                f"Waste (discarded):\n"
-                f"  Start Slice = {waste_portion[0]}\n"
-                f"  End Slice = {waste_portion[1]}\n"
-                f"  Length = {waste_portion[2]:.2f} mm\n"
-                f"  Weight = {waste_portion[3]:.2f} g\n\n"
-            )
+            footer += [
+                "Waste (discarded):",
+                f"  Start Slice = {waste_portion[0]}",
+                f"  End Slice = {waste_portion[1]}",
+                f"  Length = {waste_portion[2]:.2f} mm",
+                f"  Weight = {waste_portion[3]:.2f} g",
+                "",
+            ]
 
         if include_waste and waste_portion:
-            cut_solution_output.insert(tk.END, f"\nHypothetical Waste (if not included): {waste_hypothetical:.2f} g\n")
+            footer.append(f"Hypothetical Waste (if not included): {waste_hypothetical:.2f} g")
         else:
-            cut_solution_output.insert(tk.END, f"\nTotal Waste: {waste:.2f} g\n")
+            footer.append(f"Total Waste: {waste:.2f} g")
+
+        if optimal_report:
+            footer += [
+                "",
+                f"Optimal Cuts vs Greedy: {optimal_report['portions_gained']} extra portions, "
+                f"{optimal_report['giveaway_saved']:.2f} g less giveaway",
+            ]
+
+        cut_solution_output.set_rows(len(portions), portion_row, header, footer, portion_filters)
+
+        if result.get("comparison"):
+            show_target_comparison(result["comparison"])
 
         # Generate image for portions
+        run.lap("plot")
         generate_portion_image(portions, average_width, average_height, slice_thickness)
 
         # Show the "View Graph" button
@@ -172,71 +318,83 @@ def calculate():
         
     except ValueError:
         showinfo("Error", "Please enter valid numbers!")
+    finally:
+        run.finish(slices=len(result["slice_weights"]), portions=len(result["portions"]))
+        finish_progress("Done")
 
 
-def generate_portion_image(portions, width, height, slice_thickness):
-    fig, ax = plt.subplots(figsize=(12, 8))
+def show_target_comparison(rows):
+    # One comparison window, refreshed by every Calculate that has comparison targets.
+    global target_panel
+    if target_panel is None or not target_panel.winfo_exists():
+        target_panel = TargetComparisonPanel(app)
+    target_panel.show(rows)
 
-    # Draw the loaf
-    loaf_length = sum([p[2] for p in portions])
-    ax.add_patch(Rectangle((0, 0), loaf_length, height, edgecolor="black", facecolor="lightblue"))
 
-    # Draw the portions
-    current_x = 0
-    for idx, (_, _, length, weight) in enumerate(portions):
-        ax.add_patch(Rectangle((current_x, 0), length, height, edgecolor="black", facecolor="orange", alpha=0.7))
-        
-        # Center the weight label
-        ax.text(
-            current_x + length / 2, height / 2, f"{weight:.2f} g\n" f"{length:.2f} mm",
-            ha="center", va="center", fontsize=8, color="black", rotation=90
-        )
-        current_x += length
+def show_progress(percent, text):
+    progress_var.set(percent)
+    progress_status_var.set(text)
 
-    # Highlight waste
-    if waste_portion and not include_waste:
-        ax.add_patch(Rectangle((current_x, 0), waste_portion[2], height, edgecolor="black", facecolor="red", alpha=0.5))
-        ax.text(
-            current_x + waste_portion[2] / 2, height / 2, "Waste",
-            ha="center", va="center", fontsize=8, color="white", rotation=90
-        )
-        ax.text(
-            current_x + waste_portion[2] / 2 + 18, height / 2, f"{waste:.2f} g\n" f"{waste_portion[2]:.2f} mm",
-            ha="center", va="center", fontsize=8, color="black", rotation=90
-        )
 
-    # Add gridlines and target weight bands
-    for idx, (_, _, length, _) in enumerate(portions):
-        ax.axvline(current_x, color="gray", linestyle="--", linewidth=0.5)
-        current_x += length
-
-    ax.axhline(y=target_portion_weight - t1_tolerance, color="blue", linestyle="--", label="T1 Tolerance")
-    ax.axhline(y=target_portion_weight - t2_tolerance, color="red", linestyle="--", label="T2 Tolerance")
-    ax.axhline(y=target_portion_weight, color="green", linestyle="-", label="Target Weight")
-
-    # Add titles, labels, and legends
-    ax.set_title("Cheese Loaf Portioning Visualization", fontsize=14)
-    ax.set_xlabel("Length (mm)", fontsize=12)
-    ax.set_ylabel("Height (mm)", fontsize=12)
-    ax.legend(loc="upper left")
-    ax.grid(True)
-    ax.set_aspect("equal", adjustable="box")
-
-    # Add total loaf length to the graph
-    ax.text(
-    loaf_length / 2, +120,  # Place it below the loaf
-    f"Total Loaf Length: {total_loaf_length:.2f} mm",
-    ha="center", va="top", fontsize=12, color="black"
-    )
+def finish_progress(text):
+    progress_var.set(0)
+    progress_status_var.set(text)
+    cancel_button.state(["disabled"])
+
 
-    # Save the image
-    plt.savefig("loaf_visualization.png")
-    #plt.show()
+def show_calculation_error(error):
+    finish_progress("Failed")
+    showinfo("Error", f"Calculation failed: {error}")
+
+
+def generate_portion_image(portions, width, height, slice_thickness):
+    # One persistent figure updated in place (see portion_renderer.py).
+    global portion_renderer
+    if portion_renderer is None:
+        portion_renderer = PortionRenderer(**VISUALIZATION_OPTIONS)
+
+    # Draw the portions, then the waste at the end of the loaf
+    lengths = [length for _, _, length, _ in portions]
+    labels = [f"{weight:.2f} g\n" f"{length:.2f} mm" for _, _, length, weight in portions]
+    colors = ["orange"] * len(portions)
+    if waste_portion and not include_waste:
+        lengths.append(waste_portion[2])
+        labels.append(f"Waste\n{waste:.2f} g\n" f"{waste_portion[2]:.2f} mm")
+        colors.append("red")
+
+    plot = {
+        "lengths": lengths,
+        "heights": [height] * len(lengths),
+        "colors": colors,
+        "labels": labels,
+        "loaf_height": height,
+        "reference_lines": [
+            (target_portion_weight - t1_tolerance, "blue", "--", "T1 Tolerance"),
+            (target_portion_weight - t2_tolerance, "red", "--", "T2 Tolerance"),
+            (target_portion_weight, "green", "-", "Target Weight"),
+        ],
+        "footer": f"Total Loaf Length: {total_loaf_length:.2f} mm",
+        "footer_y": +120,
+    }
+    portion_renderer.update(**plot)
+
+    # Save the image in the background (see image_export.py); the file is named after a hash
+    # of the plan, so recalculating an identical loaf reuses the cached PNG.
+    app.after(100, poll_image_export, image_exporter.submit({**plot, **VISUALIZATION_OPTIONS}))
+
+
+def poll_image_export(future):
+    if future.done():
+        if future.exception() is None:
+            progress_status_var.set("Image saved")
+        return
+    app.after(100, poll_image_export, future)
 
 
 # Function to open the generated graph
 def open_graph():
-    plt.show()
+    # Non-blocking, so the calculator stays responsive while the graph is open.
+    plt.show(block=False)
 
 # Function to show help dialog
 def show_help():
@@ -255,8 +413,22 @@ def show_help():
         "Total number of slices along the loaf.\n"
         "\nCross Sections Slice Thickness:\n" 
         "Thickness of each slice in mm.\n"
+        "\nRandom Seed:\n"
+        "Optional whole number. The same seed always generates the same loaf; leave blank for a new loaf each time. Seeded results are cached on disk, so repeating a calculation is instant.\n"
+        "\nScan File / Scan Loaf Index:\n"
+        "Optional path to a recorded scanner file (.scan, see scan_io.py) and which loaf in it to portion. Widths, heights and positions come from the scan instead of the inputs above.\n"
+        "\nDensity Map:\n"
+        "Optional path to a voxel density map of the loaf (.dmap, see density_maps.py), e.g. from an X-ray scan. Eyes and rind then change the slice weights instead of one density for the whole loaf; the loaf still weighs the Total Weight.\n"
+        "\nCompare Targets:\n"
+        "Optional list of target weights, e.g. 150, 200, 250. Each Calculate also cuts the same loaf at every one of them and opens a table of portions, giveaway, waste and Three Packers results per target.\n"
+        "\nRun Statistics:\n"
+        "Records wall time, CPU time and peak memory of each calculation stage when switched on, and writes them to the log and portion_metrics.prom.\n"
         "\nTolerance:\n"
         "- Allowed percentage under target weight. This will be useful if the next cross-section takes the portion weight over.\n\n"
+        "Volume Integration:\n"
+        "- Rule used to integrate the cross-sectional areas into the loaf volume (rectangle, trapezoid or Simpson).\n\n"
+        "Optimal Cut Placement:\n"
+        "- Chooses all cuts on the loaf together to get the most portions with the least giveaway, keeping every portion above T1. Tolerance and interpolation are not used in this mode.\n\n"
         "Outputs:\n"
         "\nSlice Weights:\n" 
         "Displays the calculated weight of each individual slice.\n"
@@ -305,6 +477,12 @@ def show_three_packers_help():
     )
     showinfo("Three Packers Rules", three_packers_help_text)
 
+# Start a new shift batch for the Three Packers Rules
+def reset_shift():
+    global shift_compliance
+    shift_compliance = None
+    showinfo("Shift Batch", "Shift batch compliance has been reset.")
+
 # Function to toggle theme
 def toggle_theme():
     current_theme = app.tk.call("ttk::style", "theme", "use")
@@ -333,7 +511,30 @@ average_width_var = tk.StringVar(value="93")
 average_height_var = tk.StringVar(value="90")
 number_of_slices_var = tk.StringVar(value="3600")
 include_waste_var = tk.BooleanVar(value=False) 
+use_optimal_cuts = tk.BooleanVar(value=False)
 tolerance_var = tk.DoubleVar(value=99.9)  # Tolerance percentage (default 99.9%)
+integration_method_var = tk.StringVar(value="rectangle")
+seed_var = tk.StringVar(value="")  # Blank = random loaf on every Calculate
+scan_file_var = tk.StringVar(value="")  # Blank = synthetic loaf
+scan_loaf_var = tk.StringVar(value="0")
+density_map_var = tk.StringVar(value="")  # Blank = uniform density
+compare_targets_var = tk.StringVar(value="")  # e.g. "150, 200, 250"; blank = off
+target_panel = None  # target comparison window, created on first use
+shift_compliance = None  # Three Packers tracker for the current shift batch
+portion_renderer = None  # persistent visualization figure, created on first Calculate
+# Per-stage timings: JSON log lines, the Run Statistics panel and a Prometheus text file.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+instrumentation = Instrumentation.from_environment(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "portion_metrics.prom")
+)
+result_cache = ResultCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "portion_cache.sqlite"))
+VISUALIZATION_OPTIONS = {
+    "title": "Cheese Loaf Portioning Visualization",
+    "xlabel": "Length (mm)",
+    "ylabel": "Height (mm)",
+    "equal_aspect": True,
+}
+image_exporter = ImageExporter(os.path.join(os.path.dirname(os.path.abspath(__file__)), "visualizations"))
 
 # Create input fields
 fields = [
@@ -343,6 +544,11 @@ fields = [
     ("Average Height (mm):", average_height_var),
     ("Number of Slice Cross Sections:", number_of_slices_var),
     ("Slice Cross Section Thickness (mm):", slice_thickness_var),
+    ("Random Seed (blank = random):", seed_var),
+    ("Scan File (blank = synthetic):", scan_file_var),
+    ("Scan Loaf Index:", scan_loaf_var),
+    ("Density Map (blank = uniform):", density_map_var),
+    ("Compare Targets (g, blank = off):", compare_targets_var),
 ]
 
 for i, (label, var) in enumerate(fields):
@@ -367,6 +573,12 @@ tolerance_slider = ttk.Scale(
 )
 tolerance_slider.grid(row=len(fields), column=1, padx=5, pady=5, sticky="ew")
 
+# Volume integration rule used for the density calculation
+ttk.Label(app, text="Volume Integration:").grid(row=len(fields) + 1, column=0, sticky=tk.W, padx=5, pady=5)
+ttk.Combobox(
+    app, textvariable=integration_method_var, values=INTEGRATION_METHODS, state="readonly"
+).grid(row=len(fields) + 1, column=1, padx=5, pady=5, sticky="ew")
+
 # Add help button
 ttk.Button(app, text="Helper", command=show_help).grid(row=0, column=2, padx=5, pady=5)
 
@@ -377,42 +589,56 @@ ttk.Button(app, text="Three Packers Rules", command=show_three_packers_help).gri
 theme_toggle_button = ttk.Button(app, text="Toggle Dark Mode", command=toggle_theme)
 theme_toggle_button.grid(row=2, column=2, padx=5, pady=5)
 
+# Add shift batch reset button
+ttk.Button(app, text="Reset Shift Batch", command=reset_shift).grid(row=3, column=2, padx=5, pady=5)
+
+# Add per-stage timing statistics button
+ttk.Button(app, text="Run Statistics", command=lambda: StatsPanel(app, instrumentation)).grid(row=4, column=2, padx=5, pady=5)
+
 # Add waste inclusion checkbox
 ttk.Checkbutton(
     app, text="Include Waste in Portions", variable=include_waste_var
-).grid(row=len(fields) + 1, column=0, columnspan=3, pady=5, sticky="w")
-
-# Scrollable text box for slice weights
-ttk.Label(app, text="Slice Weights:").grid(row=len(fields) + 2, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
-slice_output_frame = ttk.Frame(app)
-slice_output_frame.grid(row=len(fields) + 3, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
-slice_output_scrollbar = ttk.Scrollbar(slice_output_frame)
-slice_output_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-slice_output = tk.Text(slice_output_frame, height=10, width=50, yscrollcommand=slice_output_scrollbar.set)
-slice_output.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-slice_output_scrollbar.config(command=slice_output.yview)
-
-# Scrollable text box for cut solution
-ttk.Label(app, text="Cut Solution:").grid(row=len(fields) + 4, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
-cut_solution_frame = ttk.Frame(app)
-cut_solution_frame.grid(row=len(fields) + 5, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
-cut_solution_scrollbar = ttk.Scrollbar(cut_solution_frame)
-cut_solution_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-cut_solution_output = tk.Text(cut_solution_frame, height=10, width=50, yscrollcommand=cut_solution_scrollbar.set)
-cut_solution_output.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-cut_solution_scrollbar.config(command=cut_solution_output.yview)
-
-# Calculate button
-ttk.Button(app, text="Calculate", command=calculate).grid(row=len(fields) + 6, column=0, columnspan=3, pady=10)
+).grid(row=len(fields) + 2, column=0, columnspan=3, pady=5, sticky="w")
+
+ttk.Checkbutton(
+    app, text="Optimal Cut Placement [ Info - Check Helper ]", variable=use_optimal_cuts
+).grid(row=len(fields) + 3, column=0, columnspan=3, pady=5, sticky="w")
+
+# Virtualized list for slice weights
+ttk.Label(app, text="Slice Weights:").grid(row=len(fields) + 4, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
+slice_output = VirtualListView(app, height=10, width=50, row_label="Slice")
+slice_output.grid(row=len(fields) + 5, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+
+# Virtualized list for cut solution
+ttk.Label(app, text="Cut Solution:").grid(row=len(fields) + 6, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
+cut_solution_output = VirtualListView(app, height=10, width=50, row_label="Portion")
+cut_solution_output.grid(row=len(fields) + 7, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+
+# Calculate / Cancel buttons and progress bar (the calculation runs in the background)
+calculate_frame = ttk.Frame(app)
+calculate_frame.grid(row=len(fields) + 8, column=0, columnspan=3, padx=5, pady=10, sticky="ew")
+ttk.Button(calculate_frame, text="Calculate", command=calculate).pack(side=tk.LEFT)
+cancel_button = ttk.Button(calculate_frame, text="Cancel", command=lambda: calculation_runner.cancel())
+cancel_button.pack(side=tk.LEFT, padx=5)
+cancel_button.state(["disabled"])
+progress_var = tk.DoubleVar(value=0)
+ttk.Progressbar(calculate_frame, variable=progress_var, maximum=100).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+progress_status_var = tk.StringVar(value="")
+ttk.Label(calculate_frame, textvariable=progress_status_var, width=20).pack(side=tk.LEFT)
+
+calculation_runner = BackgroundRunner(
+    app, show_results, on_error=show_calculation_error, on_progress=show_progress,
+    on_cancel=lambda: finish_progress("Cancelled"),
+)
 
 # Button to open graph (initially hidden)
 view_graph_button = ttk.Button(app, text="View Visualization Graph", command=open_graph)
-view_graph_button.grid(row=len(fields) + 7, column=0, columnspan=3, pady=10)
+view_graph_button.grid(row=len(fields) + 9, column=0, columnspan=3, pady=10)
 view_graph_button.grid_remove()  # Hide initially
 
 # Configure resizing
-app.grid_rowconfigure(len(fields) + 3, weight=1)
 app.grid_rowconfigure(len(fields) + 5, weight=1)
+app.grid_rowconfigure(len(fields) + 7, weight=1)
 app.grid_columnconfigure(1, weight=1)
 
 # Run the app
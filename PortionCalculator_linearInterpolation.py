@@ -1,16 +1,189 @@
+import logging
 import os
 import tkinter as tk
 from tkinter import ttk
 from tkinter.messagebox import showinfo
-import random
 import numpy as np
 
 import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
 import matplotlib
 matplotlib.use("TkAgg")
 
+from background_tasks import BackgroundRunner
+from density_maps import open_density_map
+from instrumentation import NULL_RUN, Instrumentation
+from loaf_generator import generate_dimensions
+from optimal_cuts import compare_with_greedy
+from portion_engine import reverse_interpolated_portions, reverse_portions
+from portion_pipeline import compare_targets, make_params
+from portion_renderer import PortionRenderer
+from result_cache import ResultCache, cache_key
+from scan_io import open_scan
+from stats_panel import StatsPanel
+from target_panel import TargetComparisonPanel
+from three_packers import ComplianceTracker, get_tne
+from virtual_views import VirtualListView
+from volume_integration import INTEGRATION_METHODS, density_and_slice_weights
+
 def calculate():
+    # Read the inputs on the Tk thread, then hand the heavy work to the background runner.
+    # Clicking again while a run is in progress restarts it with the latest inputs.
+    try:
+        inputs = {
+            "total_weight": float(total_weight_var.get()),
+            "slice_thickness": float(slice_thickness_var.get()),
+            "target_portion_weight": float(target_portion_weight_var.get()),
+            "average_width": float(average_width_var.get()),
+            "average_height": float(average_height_var.get()),
+            "number_of_slices": int(number_of_slices_var.get()),
+            "include_waste": include_waste_var.get(),
+            "linear_interpolation": use_linear_Interpolation.get(),
+            "optimal": use_optimal_cuts.get(),
+            "integration_method": integration_method_var.get(),
+            "tolerance": tolerance_var.get() / 100,
+            "seed": int(seed_var.get()) if seed_var.get().strip() else None,
+            "scan_file": scan_file_var.get().strip(),
+            "scan_loaf": int(scan_loaf_var.get()) if scan_loaf_var.get().strip() else 0,
+            "density_map": density_map_var.get().strip(),
+            "compare_targets": [float(value) for value in compare_targets_var.get().replace(",", " ").split()],
+        }
+    except ValueError:
+        showinfo("Error", "Please enter valid numbers!")
+        return
+
+    progress_var.set(0)
+    progress_status_var.set("Calculating...")
+    cancel_button.state(["!disabled"])
+    calculation_runner.submit(compute_loaf, inputs)
+
+
+def compute_loaf(task, inputs):
+    # Runs on a worker thread: no Tk calls here, only task.progress().
+    # Stage timings go to the instrumentation, a no-op unless switched on (see instrumentation.py).
+    run = instrumentation.start_run("calculate")
+    slice_thickness = inputs["slice_thickness"]
+    target_portion_weight = inputs["target_portion_weight"]
+    tolerance = inputs["tolerance"]
+
+    # Recorded scanner profiles replace the synthetic loaf (see scan_io.py).
+    scan_loaf = None
+    if inputs["scan_file"]:
+        scan_loaf = open_scan(inputs["scan_file"]).loaf(inputs["scan_loaf"])
+        slice_thickness = scan_loaf.slice_thickness or slice_thickness
+        inputs = dict(inputs, slice_thickness=slice_thickness)
+
+    # An X-ray density map (eyes, rind) replaces the uniform density (see density_maps.py).
+    density_map = None
+    if inputs["density_map"]:
+        density_map = open_density_map(inputs["density_map"])
+
+    # A seeded loaf or a scan is reproducible, so its result can come from the cache (see result_cache.py).
+    # Scans and density maps are keyed on their data, not their file names.
+    key = None
+    if inputs["seed"] is not None or scan_loaf is not None:
+        key_inputs = {name: value for name, value in inputs.items()
+                      if name not in ("scan_file", "scan_loaf", "density_map")}
+        key_arrays = []
+        if scan_loaf is not None:
+            key_arrays += [scan_loaf.dims, scan_loaf.slice_positions()]
+            if scan_loaf.contours is not None:
+                key_arrays.append(scan_loaf.contours)
+        if density_map is not None:
+            key_inputs["voxel_size"] = density_map.voxel_size
+            key_arrays.append(density_map.plane_masses())
+        key = cache_key(key_inputs, *key_arrays)
+    if key is not None:
+        run.lap("cache")
+        cached = result_cache.get(key)
+        if cached is not None:
+            task.progress(80, "Loaded from cache...")
+            run.end_stage()
+            run.count(cached=True)
+            return dict(cached, metrics=run)
+
+    if scan_loaf is not None:
+        task.progress(5, "Reading scan...")
+        run.lap("scan")
+        dims = np.asarray(scan_loaf.dims)
+        positions = scan_loaf.slice_positions()
+        cross_sectional_areas = scan_loaf.areas  # polygon areas when the scan has contours
+    else:
+        # Generate dimensions (width, height) for each slice (blank seed = new random loaf).
+        task.progress(5, "Generating loaf...")
+        run.lap("generate")
+        dims = generate_dimensions(inputs["number_of_slices"], inputs["average_width"], inputs["average_height"],
+                                   seed=inputs["seed"])
+        positions = None
+        # Compute cross-sectional areas from these dimensions.
+        cross_sectional_areas = dims[:, 0] * dims[:, 1]
+
+    if density_map is not None:
+        # Measured mass per mm along the loaf stands in for area x uniform density.
+        task.progress(20, "Reducing density map...")
+        run.lap("density")
+        cross_sectional_areas = density_map.slice_profile(len(cross_sectional_areas), slice_thickness, positions)
+
+    # Compute density (trapezoidal rule by default) and the slice weights using density.
+    task.progress(35, "Integrating volume...")
+    run.lap("integrate")
+    total_volume, density, slice_weights = density_and_slice_weights(
+        cross_sectional_areas, inputs["total_weight"], slice_thickness, inputs["integration_method"],
+        positions=positions,
+    )
+
+    # Portion calculation in reverse order:
+    # We accumulate from the end of the scan backwards so that the leftover (waste)
+    # comes from the front (lowest slice indices).
+    # Each portion: (start_index, end_index, portion_length, portion_weight)
+    task.progress(55, "Cutting portions...")
+    run.lap("portion")
+    optimal_report = None
+    if inputs["optimal"]:
+        # Place all cuts together instead of greedily (see optimal_cuts.py).
+        # The optimal plan is in slice order; flip it to match the reverse loop.
+        portions, remainder, optimal_report = compare_with_greedy(
+            slice_weights, slice_thickness, target_portion_weight, tolerance, waste_at="front"
+        )
+        portions = portions[::-1]
+    elif inputs["linear_interpolation"]:
+        # Interpolate on the cut slice so each portion exactly meets the threshold,
+        # carrying the remaining fraction of that slice into the next portion.
+        portions, remainder, _ = reverse_interpolated_portions(
+            slice_weights, slice_thickness, target_portion_weight * tolerance
+        )
+    else:
+        portions, remainder, _ = reverse_portions(
+            slice_weights, slice_thickness, target_portion_weight * tolerance
+        )
+
+    # Every comparison target cut from this same loaf (see portion_pipeline.compare_targets).
+    comparison = None
+    if inputs["compare_targets"]:
+        task.progress(70, "Comparing targets...")
+        run.lap("compare")
+        params = make_params(slice_thickness=slice_thickness, tolerance=tolerance, optimal=inputs["optimal"],
+                             reverse=True, linear_interpolation=inputs["linear_interpolation"])
+        comparison = compare_targets(slice_weights, params, inputs["compare_targets"])
+    task.progress(80, "Displaying results...")
+    run.end_stage()
+    result = {
+        "inputs": inputs,
+        "dims": dims,
+        "slice_weights": slice_weights,
+        "portions": portions,
+        "remainder": remainder,
+        "optimal_report": optimal_report,
+        "comparison": comparison,
+    }
+    if key is not None:
+        result_cache.put(key, result)
+    return dict(result, metrics=run)
+
+
+def show_results(result):
+    # Back on the Tk thread: compliance, output views and the visualization.
+    run = result.get("metrics", NULL_RUN)
+    run.lap("results")
     try:
         global target_portion_weight
         global include_waste
@@ -18,89 +191,18 @@ def calculate():
         global waste_portion
         global waste
 
-        # Get inputs
-        total_weight = float(total_weight_var.get())
-        slice_thickness = float(slice_thickness_var.get())
-        target_portion_weight = float(target_portion_weight_var.get())
-        average_width = float(average_width_var.get())
-        average_height = float(average_height_var.get())
-        number_of_length_cross_sections = int(number_of_slices_var.get())
-        include_waste = include_waste_var.get()
-        linear_Interpolation = use_linear_Interpolation.get()
-        tolerance = tolerance_var.get() / 100
-
-        # Generate dimensions (width, height) for each slice.
-        dims = generate_dimensions(number_of_length_cross_sections, average_width, average_height)
+        inputs = result["inputs"]
+        slice_thickness = inputs["slice_thickness"]
+        target_portion_weight = inputs["target_portion_weight"]
+        include_waste = inputs["include_waste"]
+        slice_weights = result["slice_weights"]
+        portions = result["portions"]
+        remainder = result["remainder"]
+        optimal_report = result["optimal_report"]
         # Extract real heights.
-        real_heights = dims[:, 1]
-        # Compute cross-sectional areas from these dimensions.
-        cross_sectional_areas = dims[:, 0] * dims[:, 1]
-        
-        # Compute density using the trapezoidal rule.
-        volumes = np.array([
-            (slice_thickness / 2) * (cross_sectional_areas[i] + cross_sectional_areas[i+1])
-            for i in range(len(cross_sectional_areas) - 1)
-        ])
-        total_volume = np.sum(volumes)
-        density = total_weight / total_volume
-
-        # Calculate slice weights using density
-        slice_weights = []
-        for id, area in enumerate(cross_sectional_areas):
-            weight = area * slice_thickness * density
-            slice_weights.append(weight)
-
-        # Portion calculation in reverse order:
-        # We accumulate from the end of the scan backwards so that the leftover (waste)
-        # comes from the front (lowest slice indices).
-        portions = []  # Each portion: (start_index, end_index, portion_length, portion_weight)
-        current_weight = 0.0
-        current_length = 0.0
-
-        # The current_end_index starts at the last slice index.
-        current_end_index = len(cross_sectional_areas) - 1
-
-        if linear_Interpolation:
-            # Process slices in reverse order.
-            for i in reversed(range(len(slice_weights))):
-                weight = slice_weights[i]
-                prev_weight = current_weight
-                prev_length = current_length
-
-                current_weight += weight
-                current_length += slice_thickness
-
-                # Check if the accumulated weight reaches the threshold
-                if current_weight >= target_portion_weight * tolerance:
-                    # Interpolate on the current slice:
-                    overshoot = current_weight - (target_portion_weight * tolerance)
-                    fraction = (weight - overshoot) / weight if weight != 0 else 1
-                    # Compute adjusted length: full slices plus the needed fraction of the current slice.
-                    # Adjust length and weight so that the portion exactly meets the threshold.
-                    adjusted_length = prev_length + fraction * slice_thickness
-                    adjusted_weight = prev_weight + fraction * weight
-                    # Record the portion: note that since we're iterating in reverse,
-                    # the portion covers slices from index i up to current_end_index.
-                    portions.append((i, current_end_index, adjusted_length, adjusted_weight))
-                    # Reset accumulators with the remaining fraction of the current slice.
-                    remaining_fraction = 1 - fraction
-                    current_weight = remaining_fraction * weight
-                    current_length = remaining_fraction * slice_thickness
-                    # Set new current_end_index to the slice before the current one.
-                    current_end_index = i - 1
-        else:
-                # Process slices in reverse order.
-                for i in reversed(range(len(slice_weights))):
-                    weight = slice_weights[i]
-                    current_weight += weight
-                    current_length += slice_thickness
-
-                    if current_weight >= target_portion_weight * tolerance:
-                        portions.append((i, current_end_index, current_length, current_weight))
-                        current_weight = 0.0
-                        current_length = 0.0
-                        current_end_index = i - 1
+        real_heights = result["dims"][:, 1]
 
+        current_end_index, current_length, current_weight = remainder[1], remainder[2], remainder[3]
 
         # After the loop, the remaining accumulated weight corresponds to waste.
         # Calculate waste length: slices from 0 up to current_end_index plus any partial slice.
@@ -124,125 +226,160 @@ def calculate():
         
         # Calculate the total loaf length
         global total_loaf_length
-        total_loaf_length = len(cross_sectional_areas) * slice_thickness
+        total_loaf_length = len(slice_weights) * slice_thickness
 
         # --- Insert the waste portion as Portion 0 in the portions list ---
         if not include_waste and portions:
             portions.insert(0, waste_portion)
 
-        # UK three packers rule - https://www.stevenstraceability.com/average-weight-explained/
-        # TNE Calculation Based on TNE Table
-        def get_tne(nominal_weight):
-            if 5 <= nominal_weight <= 50:
-                return nominal_weight * 0.09  # 9% of nominal weight
-            elif 50 < nominal_weight <= 100:
-                return 4.5  # Fixed 4.5 g
-            elif 100 < nominal_weight <= 200:
-                return nominal_weight * 0.045  # 4.5%
-            elif 200 < nominal_weight <= 300:
-                return 9  # Fixed 9 g
-            elif 300 < nominal_weight <= 500:
-                return nominal_weight * 0.03  # 3%
-            elif 500 < nominal_weight <= 1000:
-                return 15  # Fixed 15 g
-            elif 1000 < nominal_weight <= 10000:
-                return nominal_weight * 0.015  # 1.5%
-            elif 10000 < nominal_weight <= 15000:
-                return 150  # Fixed 150 g
-            elif nominal_weight > 15000:
-                return nominal_weight * 0.01  # 1%
-            else:
-                return 0
-
-        tne = get_tne(target_portion_weight)
+        # UK three packers rule - see three_packers.py for the TNE table
         global t1_tolerance
         global t2_tolerance
+        global shift_compliance
+        tne = get_tne(target_portion_weight)
         t1_tolerance = tne  # T1 = 1x TNE
         t2_tolerance = 2 * tne  # T2 = 2x TNE
 
         start_index = 0 if waste_portion and include_waste else 1
-        # Rule 1: Average weight must meet or exceed nominal weight
         valid_portions = portions[:-1] if waste_portion and not include_waste else portions
-        total_portion_weight = sum(weight for _, _, _, weight in valid_portions[start_index:])
-        average_portion_weight = total_portion_weight / len(valid_portions[start_index:])
-        rule1_pass = average_portion_weight >= target_portion_weight
-
+        portion_weights = [weight for _, _, _, weight in valid_portions[start_index:]]
+        compliance = ComplianceTracker(target_portion_weight)
+        compliance.add_many(portion_weights)
+        # Rule 1: Average weight must meet or exceed nominal weight
+        average_portion_weight = compliance.average_weight
+        rule1_pass = compliance.rule1_pass
         # Rule 2: No more than 2.5% of portions can fall below T1 tolerance
-        t1_violations = [weight for _, _, _, weight in valid_portions[start_index:] if weight < target_portion_weight - t1_tolerance]
-        rule2_pass = len(t1_violations) <= len(valid_portions[start_index:]) * 0.025
-
+        rule2_pass = compliance.rule2_pass
         # Rule 3: No portions can fall below T2 tolerance
-        t2_violations = [weight for _, _, _, weight in valid_portions[start_index:] if weight < target_portion_weight - t2_tolerance]
-        rule3_pass = len(t2_violations) == 0
+        rule3_pass = compliance.rule3_pass
+
+        # Accumulate into the shift batch (a new batch starts when the target changes)
+        if shift_compliance is None or shift_compliance.nominal_weight != target_portion_weight:
+            shift_compliance = ComplianceTracker(target_portion_weight)
+        shift_compliance.merge(compliance)
 
-        # Display Slice Weights in the first output box
-        slice_output.delete("1.0", tk.END)
-        for idx, weight in enumerate(slice_weights):
-            slice_output.insert(tk.END, f"Slice {idx + 1}: Weight = {weight:.2f} g\n")
+        # Display Slice Weights in the first output box (only the visible rows are formatted)
+        slice_output.set_rows(len(slice_weights), lambda idx: f"Slice {idx + 1}: Weight = {slice_weights[idx]:.2f} g")
 
         # Display T1 and T2 results in the second output box
-        cut_solution_output.delete("1.0", tk.END)
-        cut_solution_output.insert(tk.END, "--- Three Packers Rule Compliance ---\n")
-        cut_solution_output.insert(tk.END, f"Rule 1 (Average Weight >= Nominal): {'PASS' if rule1_pass else 'FAIL'}\n")
-        cut_solution_output.insert(tk.END, f"  - Average Weight: {average_portion_weight:.2f} g\n")
-        cut_solution_output.insert(tk.END, f"Rule 2 (T1 Violations ≤ 2.5%): {'PASS' if rule2_pass else 'FAIL'}\n")
+        header = [
+            "--- Three Packers Rule Compliance ---",
+            f"Rule 1 (Average Weight >= Nominal): {'PASS' if rule1_pass else 'FAIL'}",
+            f"  - Average Weight: {average_portion_weight:.2f} g",
+            f"Rule 2 (T1 Violations ≤ 2.5%): {'PASS' if rule2_pass else 'FAIL'}",
+        ]
         if not rule2_pass:
-            cut_solution_output.insert(tk.END, f"  - T1 Violations: {len(t1_violations)} / {len(valid_portions)}\n")
-        cut_solution_output.insert(tk.END, f"Rule 3 (No T2 Violations): {'PASS' if rule3_pass else 'FAIL'}\n")
+            header.append(f"  - T1 Violations: {compliance.t1_count} / {len(valid_portions)}")
+        header.append(f"Rule 3 (No T2 Violations): {'PASS' if rule3_pass else 'FAIL'}")
         if not rule3_pass:
-            cut_solution_output.insert(tk.END, f"  - T2 Violations: {len(t2_violations)}\n")
-
+            header.append(f"  - T2 Violations: {compliance.t2_count}")
+
+        # Running batch status for the whole shift (the rules legally apply per batch)
+        shift = shift_compliance.status()
+        header += [
+            "",
+            f"--- Shift Batch: {shift['count']} Portions ---",
+            f"Rule 1: {shift['rule1']}  (Average {shift['average_weight']:.2f} g, "
+            f"total headroom {shift['rule1_headroom']:.1f} g)",
+            f"Rule 2: {shift['rule2']}  (T1 {shift['t1_count']}, {shift['rule2_headroom']} more allowed)",
+            f"Rule 3: {shift['rule3']}  (T2 {shift['t2_count']})",
+        ]
 
         # Display total loaf length
-        cut_solution_output.insert(tk.END, f"\nTotal Loaf Length: {total_loaf_length:.2f} mm\n")
-
-        # Display portion details
-        for idx, (start, end, length, weight) in enumerate(portions):
-            if portions and not include_waste and idx == 0:
-                cut_solution_output.insert(tk.END,
-                f"\nWaste Portion {idx + 1}:\n"
-                f"  Start Slice = {start}\n"
-                f"  End Slice = {end}\n"
-                f"  Length = {length:.2f} mm\n"
-                f"  Weight = {weight:.2f} g\n\n"
-            )
-            else:
-                cut_solution_output.insert(tk.END,
-                    f"\nPortion {idx + 1}:\n"
-                    f"  Start Slice = {start}\n"
-                    f"  End Slice = {end}\n"
-                    f"  Length = {length:.2f} mm\n"
-                    f"  Weight = {weight:.2f} g\n\n"
-                )
+        header += ["", f"Total Loaf Length: {total_loaf_length:.2f} mm", ""]
+
+        # Portion details, one row per portion, formatted when scrolled into view
+        waste_first = bool(portions) and not include_waste
+
+        def portion_row(idx):
+            start, end, length, weight = portions[idx]
+            label = "Waste Portion" if waste_first and idx == 0 else "Portion"
+            return (f"{label} {idx + 1}: Slices {start}-{end}, "
+                    f"Length = {length:.2f} mm, Weight = {weight:.2f} g")
+
+        # Filters only look at the portions the compliance check counted
+        portion_weight_array = np.array([weight for _, _, _, weight in portions])
+        checked = np.zeros(len(portions), dtype=bool)
+        checked[start_index:len(valid_portions)] = True
+        portion_filters = {
+            "Below T1": lambda: np.flatnonzero(checked & (portion_weight_array < compliance.t1_limit)),
+            "Below T2": lambda: np.flatnonzero(checked & (portion_weight_array < compliance.t2_limit)),
+            "Below Target": lambda: np.flatnonzero(checked & (portion_weight_array < target_portion_weight)),
+        }
 
         # Display waste details (if applicable)
+        footer = [""]
         if waste_portion and not include_waste:
-            cut_solution_output.insert(tk.END,
-                f"Waste (discarded):\n"
-                f"  Start Slice = {waste_portion[0]}\n"
-                f"  End Slice = {waste_portion[1]}\n"
-                f"  Length = {waste_portion[2]:.2f} mm\n"
-                f"  Weight = {waste_portion[3]:.2f} g\n\n"
-            )
+            footer += [
+                "Waste (discarded):",
+                f"  Start Slice = {waste_portion[0]}",
+                f"  End Slice = {waste_portion[1]}",
+                f"  Length = {waste_portion[2]:.2f} mm",
+                f"  Weight = {waste_portion[3]:.2f} g",
+                "",
+            ]
 
         if include_waste and waste_portion:
-            cut_solution_output.insert(tk.END, f"\nHypothetical Waste (if not included): {waste_hypothetical:.2f} g\n")
+            footer.append(f"Hypothetical Waste (if not included): {waste_hypothetical:.2f} g")
         else:
-            cut_solution_output.insert(tk.END, f"\nTotal Waste: {waste:.2f} g\n")
+            footer.append(f"Total Waste: {waste:.2f} g")
+
+        if optimal_report:
+            footer += [
+                "",
+                f"Optimal Cuts vs Greedy: {optimal_report['portions_gained']} extra portions, "
+                f"{optimal_report['giveaway_saved']:.2f} g less giveaway",
+            ]
+
+        cut_solution_output.set_rows(len(portions), portion_row, header, footer, portion_filters)
+
+        if result.get("comparison"):
+            show_target_comparison(result["comparison"])
 
         # Generate image for portions
+        run.lap("plot")
         generate_portion_image(portions, real_heights, slice_thickness)
         
     except ValueError:
         showinfo("Error", "Please enter valid numbers!")
+    finally:
+        run.finish(slices=len(result["slice_weights"]), portions=len(result["portions"]))
+        finish_progress("Done")
+
 
+def show_target_comparison(rows):
+    # One comparison window, refreshed by every Calculate that has comparison targets.
+    global target_panel
+    if target_panel is None or not target_panel.winfo_exists():
+        target_panel = TargetComparisonPanel(app)
+    target_panel.show(rows)
+
+
+def show_progress(percent, text):
+    progress_var.set(percent)
+    progress_status_var.set(text)
+
+
+def finish_progress(text):
+    progress_var.set(0)
+    progress_status_var.set(text)
+    cancel_button.state(["disabled"])
+
+
+def show_calculation_error(error):
+    finish_progress("Failed")
+    showinfo("Error", f"Calculation failed: {error}")
 
-def generate_dimensions(n_slices, avg_width, avg_height, width_std=2, height_std=2):
-    dims = [(random.gauss(avg_width, width_std), random.gauss(avg_height, height_std))
-        for _ in range(n_slices)]
-    return np.array(dims)
 
 def generate_portion_image(portions, real_heights, slice_thickness):
+    # One persistent figure updated in place (see portion_renderer.py).
+    global portion_renderer
+    if portion_renderer is None:
+        portion_renderer = PortionRenderer(
+            "Cheese Loaf Portioning Visualization\nwith Real Slice Height Variation",
+            "Cumulative Length (mm)", "Slice Height (mm)",
+        )
+
     # Calculate the cumulative length array.
     n = len(real_heights)
     cum_length = np.arange(1, n + 1) * slice_thickness  # x-axis positions for each slice.
@@ -252,58 +389,32 @@ def generate_portion_image(portions, real_heights, slice_thickness):
     
     # For the schematic, use the total length as sum of all slice thicknesses.
     total_loaf_length = n * slice_thickness
-    
-    fig, ax = plt.subplots(figsize=(12, 8))
-    
-    # Draw the overall loaf as a rectangle using the average height.
-    ax.add_patch(Rectangle((0, 0), total_loaf_length, avg_height,
-                            edgecolor="black", facecolor="lightblue"))
-    
-    # Overlay a line plot that shows the real height variation.
-    ax.plot(cum_length, real_heights, linestyle="--", color="purple",
-            label="Real Height Variation")
-    
-    # Optionally annotate the average height.
-    ax.axhline(avg_height, color="blue", linestyle=":", label=f"Avg Height = {avg_height:.2f} mm")
-    
-    # Draw the portions (we assume portions already include any waste handling as needed).
-    current_x = 0
-    # Determine starting portion index. If the waste is included as Portion 0, start from index 1.
-    start_idx = 0
-    for idx, (start, end, length, weight) in enumerate(portions[start_idx:], start=start_idx):
-        # For each portion, you can compute an average height over its slice range:
-        portion_heights = real_heights[start:(end + 1)]
-        portion_avg_height = np.mean(portion_heights) if len(portion_heights) > 0 else avg_height
-        
-        if waste_portion and not include_waste and idx == 0:
-            # Draw the portion as a rectangle with height equal to its average real height.
-            ax.add_patch(Rectangle((current_x, 0), length, portion_avg_height,
-                                    edgecolor="black", facecolor="red", alpha=0.7))
-        else:
-            ax.add_patch(Rectangle((current_x, 0), length, portion_avg_height,
-                        edgecolor="black", facecolor="orange", alpha=0.7))
-
-        # Annotate the portion in the center.
-        mid_x = current_x + length / 2
-        ax.text(mid_x, portion_avg_height / 2, 
-                f"P{idx+1}: {weight:.1f} g\n{length:.1f} mm",
-                ha="center", va="center", fontsize=8, rotation=90)
-        current_x += length
-
-    # Add gridlines and labels.
-    ax.set_title("Cheese Loaf Portioning Visualization\nwith Real Slice Height Variation", fontsize=14)
-    ax.set_xlabel("Cumulative Length (mm)", fontsize=12)
-    ax.set_ylabel("Slice Height (mm)", fontsize=12)
-    ax.legend(loc="upper left")
-    ax.grid(True)
-    
-    # Optionally, display the total loaf length.
-    ax.text(total_loaf_length / 2, -avg_height * 0.17,
-            f"Total Loaf Length: {total_loaf_length:.2f} mm",
-            ha="center", va="top", fontsize=12, color="black")
-    
-    print("here")
-    plt.show(block=True)
+
+    # Average real height over each portion's slice range, from prefix sums of the heights.
+    plan = np.array([(start, end, length, weight) for start, end, length, weight in portions],
+                    dtype=np.float64).reshape(-1, 4)
+    starts = plan[:, 0].astype(np.int64)
+    stops = np.minimum(plan[:, 1].astype(np.int64) + 1, n)
+    cum_heights = np.concatenate(([0.0], np.cumsum(real_heights)))
+    counts = stops - starts
+    portion_heights = np.where(counts > 0, (cum_heights[stops] - cum_heights[starts]) / np.maximum(counts, 1),
+                               avg_height)
+
+    # The waste is shown in red when it is listed as Portion 1.
+    colors = ["orange"] * len(plan)
+    if waste_portion and not include_waste and len(plan):
+        colors[0] = "red"
+    labels = [f"P{idx + 1}: {weight:.1f} g\n{length:.1f} mm" for idx, (_, _, length, weight) in enumerate(portions)]
+
+    portion_renderer.update(
+        plan[:, 2], portion_heights, colors, labels, avg_height,
+        trace=(cum_length, real_heights),
+        reference_lines=[(avg_height, "blue", ":", f"Avg Height = {avg_height:.2f} mm")],
+        footer=f"Total Loaf Length: {total_loaf_length:.2f} mm", footer_y=-avg_height * 0.17,
+    )
+
+    # Non-blocking, so the calculator stays responsive while the graph is open.
+    plt.show(block=False)
 
 
 # Function to show help dialog
@@ -323,8 +434,22 @@ def show_help():
         "Total number of slices along the loaf.\n"
         "\nCross Sections Slice Thickness:\n" 
         "Thickness of each slice in mm.\n"
+        "\nRandom Seed:\n"
+        "Optional whole number. The same seed always generates the same loaf; leave blank for a new loaf each time. Seeded results are cached on disk, so repeating a calculation is instant.\n"
+        "\nScan File / Scan Loaf Index:\n"
+        "Optional path to a recorded scanner file (.scan, see scan_io.py) and which loaf in it to portion. Widths, heights and positions come from the scan instead of the inputs above.\n"
+        "\nDensity Map:\n"
+        "Optional path to a voxel density map of the loaf (.dmap, see density_maps.py), e.g. from an X-ray scan. Eyes and rind then change the slice weights instead of one density for the whole loaf; the loaf still weighs the Total Weight.\n"
+        "\nCompare Targets:\n"
+        "Optional list of target weights, e.g. 150, 200, 250. Each Calculate also cuts the same loaf at every one of them and opens a table of portions, giveaway, waste and Three Packers results per target.\n"
+        "\nRun Statistics:\n"
+        "Records wall time, CPU time and peak memory of each calculation stage when switched on, and writes them to the log and portion_metrics.prom.\n"
         "\nTolerance:\n"
         "- Allowed percentage under target weight. This will be useful if the next cross-section takes the portion weight over.\n\n"
+        "Volume Integration:\n"
+        "- Rule used to integrate the cross-sectional areas into the loaf volume (rectangle, trapezoid or Simpson).\n\n"
+        "Optimal Cut Placement:\n"
+        "- Chooses all cuts on the loaf together to get the most portions with the least giveaway, keeping every portion above T1. Tolerance and interpolation are not used in this mode.\n\n"
         "Outputs:\n"
         "\nSlice Weights:\n" 
         "Displays the calculated weight of each individual slice.\n"
@@ -375,6 +500,12 @@ def show_three_packers_help():
     )
     showinfo("Three Packers Rules", three_packers_help_text)
 
+# Start a new shift batch for the Three Packers Rules
+def reset_shift():
+    global shift_compliance
+    shift_compliance = None
+    showinfo("Shift Batch", "Shift batch compliance has been reset.")
+
 # Function to toggle theme
 def toggle_theme():
     current_theme = app.tk.call("ttk::style", "theme", "use")
@@ -404,7 +535,23 @@ average_height_var = tk.StringVar(value="90")
 number_of_slices_var = tk.StringVar(value="3600")
 include_waste_var = tk.BooleanVar(value=False) 
 use_linear_Interpolation = tk.BooleanVar(value=False)
+use_optimal_cuts = tk.BooleanVar(value=False)
 tolerance_var = tk.DoubleVar(value=100)  # Tolerance percentage (default 100%)
+integration_method_var = tk.StringVar(value="trapezoid")
+seed_var = tk.StringVar(value="")  # Blank = random loaf on every Calculate
+scan_file_var = tk.StringVar(value="")  # Blank = synthetic loaf
+scan_loaf_var = tk.StringVar(value="0")
+density_map_var = tk.StringVar(value="")  # Blank = uniform density
+compare_targets_var = tk.StringVar(value="")  # e.g. "150, 200, 250"; blank = off
+target_panel = None  # target comparison window, created on first use
+shift_compliance = None  # Three Packers tracker for the current shift batch
+portion_renderer = None  # persistent visualization figure, created on first Calculate
+# Per-stage timings: JSON log lines, the Run Statistics panel and a Prometheus text file.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+instrumentation = Instrumentation.from_environment(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "portion_metrics.prom")
+)
+result_cache = ResultCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "portion_cache.sqlite"))
 
 # Create input fields
 fields = [
@@ -414,6 +561,11 @@ fields = [
     ("Average Height (mm):", average_height_var),
     ("Number of Slice Cross Sections:", number_of_slices_var),
     ("Slice Cross Section Thickness (mm):", slice_thickness_var),
+    ("Random Seed (blank = random):", seed_var),
+    ("Scan File (blank = synthetic):", scan_file_var),
+    ("Scan Loaf Index:", scan_loaf_var),
+    ("Density Map (blank = uniform):", density_map_var),
+    ("Compare Targets (g, blank = off):", compare_targets_var),
 ]
 
 for i, (label, var) in enumerate(fields):
@@ -438,6 +590,12 @@ tolerance_slider = ttk.Scale(
 )
 tolerance_slider.grid(row=len(fields), column=1, padx=5, pady=5, sticky="ew")
 
+# Volume integration rule used for the density calculation
+ttk.Label(app, text="Volume Integration:").grid(row=len(fields) + 1, column=0, sticky=tk.W, padx=5, pady=5)
+ttk.Combobox(
+    app, textvariable=integration_method_var, values=INTEGRATION_METHODS, state="readonly"
+).grid(row=len(fields) + 1, column=1, padx=5, pady=5, sticky="ew")
+
 # Add help button
 ttk.Button(app, text="Helper", command=show_help).grid(row=0, column=2, padx=5, pady=5)
 
@@ -448,42 +606,55 @@ ttk.Button(app, text="Three Packers Rules", command=show_three_packers_help).gri
 theme_toggle_button = ttk.Button(app, text="Toggle Dark Mode", command=toggle_theme)
 theme_toggle_button.grid(row=2, column=2, padx=5, pady=5)
 
+# Add shift batch reset button
+ttk.Button(app, text="Reset Shift Batch", command=reset_shift).grid(row=3, column=2, padx=5, pady=5)
+
+# Add per-stage timing statistics button
+ttk.Button(app, text="Run Statistics", command=lambda: StatsPanel(app, instrumentation)).grid(row=4, column=2, padx=5, pady=5)
+
 # Add waste inclusion checkbox
 ttk.Checkbutton(
     app, text="Include Waste in Portions", variable=include_waste_var
-).grid(row=len(fields) + 1, column=0, columnspan=3, pady=5, sticky="w")
+).grid(row=len(fields) + 2, column=0, columnspan=3, pady=5, sticky="w")
 
 ttk.Checkbutton(
     app, text="Use Linear Interpolation [ Info - Check Helper ]", variable=use_linear_Interpolation
-).grid(row=len(fields) + 2, column=0, columnspan=3, pady=5, sticky="w")
+).grid(row=len(fields) + 3, column=0, columnspan=3, pady=5, sticky="w")
 
-
-# Scrollable text box for slice weights
-ttk.Label(app, text="Slice Weights:").grid(row=len(fields) + 3, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
-slice_output_frame = ttk.Frame(app)
-slice_output_frame.grid(row=len(fields) + 4, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
-slice_output_scrollbar = ttk.Scrollbar(slice_output_frame)
-slice_output_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-slice_output = tk.Text(slice_output_frame, height=10, width=50, yscrollcommand=slice_output_scrollbar.set)
-slice_output.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-slice_output_scrollbar.config(command=slice_output.yview)
-
-# Scrollable text box for cut solution
-ttk.Label(app, text="Cut Solution:").grid(row=len(fields) + 5, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
-cut_solution_frame = ttk.Frame(app)
-cut_solution_frame.grid(row=len(fields) + 6, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
-cut_solution_scrollbar = ttk.Scrollbar(cut_solution_frame)
-cut_solution_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-cut_solution_output = tk.Text(cut_solution_frame, height=10, width=50, yscrollcommand=cut_solution_scrollbar.set)
-cut_solution_output.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-cut_solution_scrollbar.config(command=cut_solution_output.yview)
-
-# Calculate button
-ttk.Button(app, text="Calculate", command=calculate).grid(row=len(fields) + 7, column=0, columnspan=3, pady=10)
+ttk.Checkbutton(
+    app, text="Optimal Cut Placement [ Info - Check Helper ]", variable=use_optimal_cuts
+).grid(row=len(fields) + 4, column=0, columnspan=3, pady=5, sticky="w")
+
+# Virtualized list for slice weights
+ttk.Label(app, text="Slice Weights:").grid(row=len(fields) + 5, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
+slice_output = VirtualListView(app, height=10, width=50, row_label="Slice")
+slice_output.grid(row=len(fields) + 6, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+
+# Virtualized list for cut solution
+ttk.Label(app, text="Cut Solution:").grid(row=len(fields) + 7, column=0, columnspan=3, sticky=tk.W, padx=5, pady=(10, 0))
+cut_solution_output = VirtualListView(app, height=10, width=50, row_label="Portion")
+cut_solution_output.grid(row=len(fields) + 8, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+
+# Calculate / Cancel buttons and progress bar (the calculation runs in the background)
+calculate_frame = ttk.Frame(app)
+calculate_frame.grid(row=len(fields) + 9, column=0, columnspan=3, padx=5, pady=10, sticky="ew")
+ttk.Button(calculate_frame, text="Calculate", command=calculate).pack(side=tk.LEFT)
+cancel_button = ttk.Button(calculate_frame, text="Cancel", command=lambda: calculation_runner.cancel())
+cancel_button.pack(side=tk.LEFT, padx=5)
+cancel_button.state(["disabled"])
+progress_var = tk.DoubleVar(value=0)
+ttk.Progressbar(calculate_frame, variable=progress_var, maximum=100).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+progress_status_var = tk.StringVar(value="")
+ttk.Label(calculate_frame, textvariable=progress_status_var, width=20).pack(side=tk.LEFT)
+
+calculation_runner = BackgroundRunner(
+    app, show_results, on_error=show_calculation_error, on_progress=show_progress,
+    on_cancel=lambda: finish_progress("Cancelled"),
+)
 
 # Configure resizing
-app.grid_rowconfigure(len(fields) + 3, weight=1)
 app.grid_rowconfigure(len(fields) + 5, weight=1)
+app.grid_rowconfigure(len(fields) + 7, weight=1)
 app.grid_columnconfigure(1, weight=1)
 
 # Run the app
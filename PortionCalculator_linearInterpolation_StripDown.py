@@ -1,6 +1,9 @@
-import random
-import numpy as np
-import pandas as pd
+from density_maps import open_density_map
+from loaf_generator import generate_dimensions
+from portion_engine import reverse_portions, reverse_interpolated_portions
+from portion_export import PortionExporter
+from scan_io import open_scan
+from volume_integration import density_and_slice_weights
 
 def calculate():
     try:
@@ -16,80 +19,51 @@ def calculate():
         linear_interpolation_enabled = True
         # Assuming tolerance of 99.9% (i.e. target * 0.999)
         tolerance = 1
-
-        # Generate cross-sectional areas
-        cross_sectional_areas = [
-            random.gauss(average_width, 2) * random.gauss(average_height, 2)
-            for _ in range(number_of_length_cross_sections)
-        ]
-
-        # Calculate density using the rectangular rule
-        #total_volume = sum(area * slice_thickness for area in cross_sectional_areas)
-        #density = total_weight / total_volume
-
-        # Calculate volume using the trapezoidal rule:
-        volumes = np.array([
-            (slice_thickness / 2) * (cross_sectional_areas[i] + cross_sectional_areas[i+1])
-            for i in range(len(cross_sectional_areas) - 1)
-        ])
-        total_volume = np.sum(volumes)
-        density = total_weight / total_volume
-
-        # Calculate slice weights using density
-        slice_weights = []
-        for area in cross_sectional_areas:
-            weight = area * slice_thickness * density
-            slice_weights.append(weight)
+        seed = None                     # set an int to reproduce a loaf exactly
+        integration_method = "trapezoid"  # "rectangle", "trapezoid" or "simpson"
+        output_dir = "portion_output"   # where the portion / slice-weight files are written
+        export_format = "csv"           # "csv", "parquet" or "arrow" (parquet/arrow need pyarrow)
+        excel_summary = False           # also write a one-row-per-loaf Excel summary (needs pandas)
+        scan_file = None                # path to a recorded .scan file (see scan_io.py), None = synthetic loaf
+        scan_loaf = 0                   # which loaf of the scan file to portion
+        density_map = None              # path to a voxel density map (.dmap, see density_maps.py), None = uniform
+
+        # Cross-sectional areas from a recorded scan, or generated
+        positions = None
+        if scan_file:
+            loaf = open_scan(scan_file).loaf(scan_loaf)
+            dims = loaf.dims
+            positions = loaf.slice_positions()
+            slice_thickness = loaf.slice_thickness or slice_thickness
+            cross_sectional_areas = loaf.areas  # polygon areas when the scan has contours
+        else:
+            dims = generate_dimensions(number_of_length_cross_sections, average_width, average_height, seed=seed)
+            cross_sectional_areas = dims[:, 0] * dims[:, 1]
+        if density_map:
+            # Measured mass per mm along the loaf stands in for area x uniform density
+            cross_sectional_areas = open_density_map(density_map).slice_profile(
+                len(cross_sectional_areas), slice_thickness, positions)
+
+        # Calculate volume and density with the selected rule, then slice weights using density
+        total_volume, density, slice_weights = density_and_slice_weights(
+            cross_sectional_areas, total_weight, slice_thickness, integration_method, positions=positions
+        )
 
         # Portion calculation in reverse order:
         # We accumulate from the end of the scan backwards so that the leftover (waste)
         # comes from the front (lowest slice indices).
-        portions = []  # Each portion: (start_index, end_index, portion_length, portion_weight)
-        current_weight = 0.0
-        current_length = 0.0
-        # The current_end_index starts at the last slice index.
-        current_end_index = len(cross_sectional_areas) - 1
-
+        # Each portion: (start_index, end_index, portion_length, portion_weight)
         if linear_interpolation_enabled:
-            # Process slices in reverse order.
-            for i in reversed(range(len(slice_weights))):
-                weight = slice_weights[i]
-                prev_weight = current_weight
-                prev_length = current_length
-
-                current_weight += weight
-                current_length += slice_thickness
-
-                # Check if the accumulated weight reaches the threshold
-                if current_weight >= target_portion_weight * tolerance:
-                    # Interpolate on the current slice:
-                    overshoot = current_weight - (target_portion_weight * tolerance)
-                    fraction = (weight - overshoot) / weight if weight != 0 else 1
-                    # Adjust length and weight so that the portion exactly meets the threshold.
-                    adjusted_length = prev_length + fraction * slice_thickness
-                    adjusted_weight = prev_weight + fraction * weight
-                    # Record the portion: note that since we're iterating in reverse,
-                    # the portion covers slices from index i up to current_end_index.
-                    portions.append((i, current_end_index, adjusted_length, adjusted_weight))
-                    # Reset accumulators with the remaining fraction of the current slice.
-                    remaining_fraction = 1 - fraction
-                    current_weight = remaining_fraction * weight
-                    current_length = remaining_fraction * slice_thickness
-                    # Set new current_end_index to the slice before the current one.
-                    current_end_index = i - 1
+            # Interpolate on the cut slice so each portion exactly meets the threshold,
+            # carrying the remaining fraction of that slice into the next portion.
+            portions, remainder, _ = reverse_interpolated_portions(
+                slice_weights, slice_thickness, target_portion_weight * tolerance
+            )
         else:
-                # Process slices in reverse order.
-                for i in reversed(range(len(slice_weights))):
-                    weight = slice_weights[i]
-                    current_weight += weight
-                    current_length += slice_thickness
-
-                    if current_weight >= target_portion_weight * tolerance:
-                        portions.append((i, current_end_index, current_length, current_weight))
-                        current_weight = 0.0
-                        current_length = 0.0
-                        current_end_index = i - 1
-
+            portions, remainder, _ = reverse_portions(
+                slice_weights, slice_thickness, target_portion_weight * tolerance
+            )
+        current_end_index, current_length, current_weight = remainder[1], remainder[2], remainder[3]
 
         # After the loop, the remaining accumulated weight corresponds to waste.
         waste = current_weight
@@ -127,33 +101,12 @@ def calculate():
             print("\nWaste (at the front):")
             print(f"Start Slice = {waste_portion[0]}, End Slice = {waste_portion[1]}, Length = {waste_portion[2]:.3f} mm, Weight = {waste_portion[3]:.3f} g")
 
-        # After calculating portions, build a list of dictionaries with the output data.
-        data = []
-        for idx, (start, end, length, weight) in enumerate(portions):
-            data.append({
-                "Portion": idx + 1,
-                "Start Slice": start,
-                "End Slice": end,
-                "Length (mm)": length,
-                "Weight (g)": weight
-            })
-
-        # Optionally, if you want to log waste as well:
-        if waste_portion and not include_waste:
-            data.append({
-                "Portion": "Waste",
-                "Start Slice": waste_portion[0],
-                "End Slice": waste_portion[1],
-                "Length (mm)": waste_portion[2],
-                "Weight (g)": waste_portion[3]
-            })
-
-        # Convert the list to a DataFrame
-        df = pd.DataFrame(data)
-
-        # Save the DataFrame to an Excel file
-        df.to_excel("C:\\Users\\PC\\Desktop\\Python\\PortionCalculatorApp\\portion_data.xlsx", index=False)
-
+        # Write the portions, waste and slice weights as columns (see portion_export.py).
+        with PortionExporter(output_dir, export_format) as exporter:
+            exporter.add_loaf(portions[1:], waste_portion if not include_waste else None, slice_weights)
+        if excel_summary:
+            exporter.write_excel_summary()
+        print(f"\nPortion data written to {exporter.portions.path}")
 
     except ValueError:
         print("Error in calculating portions")
@@ -0,0 +1,115 @@
+import queue
+import threading
+
+# Runs long calculations off the Tk event thread.
+#
+# Tk widgets may only be touched from the thread running mainloop(), so the worker never
+# calls back into Tk directly. It posts progress, results and errors on a queue, and the
+# runner drains that queue from an after() poll on the Tk side.
+#
+# Clicking Calculate again while a run is in progress does not queue up another full run
+# per click: the current run is cancelled and only the latest request is kept, started as
+# soon as the worker has stopped.
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskContext:
+    # Handed to the worker function to report progress and to check for cancellation.
+    def __init__(self, messages):
+        self._messages = messages
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check(self):
+        # Call between stages; stops the worker if Cancel was pressed.
+        if self._cancel_event.is_set():
+            raise TaskCancelled()
+
+    def progress(self, fraction, text=""):
+        self.check()
+        self._messages.put(("progress", self, (fraction, text)))
+
+
+class BackgroundRunner:
+    def __init__(self, widget, on_done, on_error=None, on_progress=None, on_cancel=None, poll_ms=50):
+        self.widget = widget
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_cancel = on_cancel
+        self.poll_ms = poll_ms
+        self._messages = queue.Queue()
+        self._task = None
+        self._pending = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def submit(self, func, *args):
+        # func(task, *args) runs on a worker thread; its return value goes to on_done.
+        if self._task is not None:
+            self._pending = (func, args)
+            self._task.cancel()
+            return
+        self._start(func, args)
+
+    def cancel(self):
+        self._pending = None
+        if self._task is not None:
+            self._task.cancel()
+
+    def _start(self, func, args):
+        task = TaskContext(self._messages)
+        self._task = task
+        threading.Thread(target=self._run, args=(task, func, args), daemon=True).start()
+        self.widget.after(self.poll_ms, self._poll)
+
+    def _run(self, task, func, args):
+        try:
+            result = func(task, *args)
+            task.check()
+            self._messages.put(("done", task, result))
+        except TaskCancelled:
+            self._messages.put(("cancelled", task, None))
+        except Exception as error:
+            self._messages.put(("error", task, error))
+
+    def _poll(self):
+        finished = False
+        try:
+            while True:
+                kind, task, payload = self._messages.get_nowait()
+                if task is not self._task:
+                    continue
+                if kind == "progress":
+                    if self.on_progress and not task.cancelled:
+                        self.on_progress(*payload)
+                    continue
+                finished = True
+                self._task = None
+                if kind == "done":
+                    self.on_done(payload)
+                elif kind == "error" and self.on_error:
+                    self.on_error(payload)
+                elif kind == "cancelled" and self.on_cancel and self._pending is None:
+                    self.on_cancel()
+                break
+        except queue.Empty:
+            pass
+
+        if not finished:
+            self.widget.after(self.poll_ms, self._poll)
+        elif self._pending is not None:
+            func, args = self._pending
+            self._pending = None
+            self._start(func, args)
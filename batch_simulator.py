@@ -0,0 +1,233 @@
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from portion_pipeline import loaf_slice_weights, make_params, plan_portion_table
+from three_packers import check_batch, tolerance_limits
+
+# Multi-process batch simulator.
+#
+# Shards N loaves across a process pool. Every loaf gets its own RNG stream derived from
+# (seed, loaf index), so results do not depend on the number of workers or chunk size.
+# Workers write straight into shared NumPy buffers instead of pickling results back:
+#   - without a checkpoint directory the buffers live in multiprocessing.shared_memory;
+#   - with one they are .npy memmaps in that directory, and a per-chunk "done" table lets
+#     an interrupted run resume where it stopped.
+
+
+def result_layout(params, store_slice_weights=False):
+    # Per-loaf fields: name -> (dtype, shape per loaf).
+    # No portion weighs less than the threshold, or than the T1 limit in optimal mode.
+    threshold = params["target_portion_weight"] * params["tolerance"]
+    if params["optimal"]:
+        threshold = min(threshold, tolerance_limits(params["target_portion_weight"])[0])
+    max_portions = int(math.ceil(params["total_weight"] * 1.05 / threshold)) + 1
+    layout = {
+        "portion_count": (np.int32, ()),
+        "portion_start": (np.int32, (max_portions,)),
+        "portion_end": (np.int32, (max_portions,)),
+        "portion_length": (np.float64, (max_portions,)),
+        "portion_weight": (np.float64, (max_portions,)),
+        "waste_length": (np.float64, ()),
+        "waste_weight": (np.float64, ()),
+    }
+    if store_slice_weights:
+        layout["slice_weights"] = (np.float32, (params["number_of_slices"],))
+    return layout
+
+
+def _attach(spec, dtype, shape):
+    kind, location = spec
+    if kind == "file":
+        return np.load(location, mmap_mode="r+"), None
+    # Workers share the parent's resource tracker, and the parent unlinks the block.
+    shm = shared_memory.SharedMemory(name=location)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def _create_buffers(layout, n_loaves, checkpoint_dir, resume):
+    specs = {}
+    arrays = {}
+    handles = []
+    for name, (dtype, shape) in layout.items():
+        full_shape = (n_loaves,) + shape
+        if checkpoint_dir:
+            path = os.path.join(checkpoint_dir, f"{name}.npy")
+            if resume:
+                arrays[name] = np.load(path, mmap_mode="r+")
+            else:
+                arrays[name] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=full_shape)
+            specs[name] = ("file", path)
+        else:
+            size = max(1, int(np.prod(full_shape)) * np.dtype(dtype).itemsize)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            handles.append(shm)
+            arrays[name] = np.ndarray(full_shape, dtype=dtype, buffer=shm.buf)
+            arrays[name].fill(0)
+            specs[name] = ("shm", shm.name)
+    return specs, arrays, handles
+
+
+# Worker-side state, attached once per process by _init_worker.
+_worker_arrays = {}
+_worker_handles = []
+
+
+def _init_worker(specs, layout, n_loaves):
+    for name, spec in specs.items():
+        dtype, shape = layout[name]
+        array, handle = _attach(spec, dtype, (n_loaves,) + shape)
+        _worker_arrays[name] = array
+        if handle is not None:
+            _worker_handles.append(handle)
+
+
+def loaf_rng(seed, loaf_index):
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(loaf_index,)))
+
+
+def _simulate_chunk(params, seed, start, stop):
+    out = _worker_arrays
+    max_portions = out["portion_start"].shape[1]
+    for i in range(start, stop):
+        _, slice_weights = loaf_slice_weights(params, loaf_rng(seed, i))
+        table = plan_portion_table(slice_weights, params)
+        portions = table.valid()
+        n = len(portions)
+        if n > max_portions:
+            raise ValueError(f"Loaf {i} has {n} portions, more than the {max_portions} the result buffers hold")
+        out["portion_count"][i] = n
+        out["portion_start"][i, :n] = portions.start
+        out["portion_end"][i, :n] = portions.end
+        out["portion_length"][i, :n] = portions.length
+        out["portion_weight"][i, :n] = portions.weight
+        waste = table.waste()
+        out["waste_length"][i] = waste["length"] if waste is not None else 0.0
+        out["waste_weight"][i] = waste["weight"] if waste is not None else 0.0
+        if "slice_weights" in out:
+            out["slice_weights"][i] = slice_weights
+    for array in out.values():
+        if isinstance(array, np.memmap):
+            array.flush()
+    return start, stop
+
+
+def _load_manifest(checkpoint_dir, manifest):
+    path = os.path.join(checkpoint_dir, "manifest.json")
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        saved = json.load(f)
+    if saved != manifest:
+        raise ValueError(f"Checkpoint in {checkpoint_dir} was made with different settings")
+    return True
+
+
+def run_batch(n_loaves, params=None, seed=0, workers=None, chunk_size=256,
+              store_slice_weights=False, checkpoint_dir=None, progress=None):
+    # Returns a dict of per-loaf result arrays (see result_layout) plus "summary".
+    params = make_params(**(params or {}))
+    layout = result_layout(params, store_slice_weights)
+    n_chunks = int(math.ceil(n_loaves / chunk_size))
+
+    resume = False
+    done = None
+    if checkpoint_dir:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        manifest = {"n_loaves": n_loaves, "params": params, "seed": seed,
+                    "chunk_size": chunk_size, "store_slice_weights": store_slice_weights}
+        resume = _load_manifest(checkpoint_dir, manifest)
+        done_path = os.path.join(checkpoint_dir, "done.npy")
+        if resume:
+            done = np.load(done_path, mmap_mode="r+")
+        else:
+            done = np.lib.format.open_memmap(done_path, mode="w+", dtype=np.bool_, shape=(n_chunks,))
+            with open(os.path.join(checkpoint_dir, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2)
+
+    specs, arrays, handles = _create_buffers(layout, n_loaves, checkpoint_dir, resume)
+    try:
+        pending = [c for c in range(n_chunks) if done is None or not done[c]]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(specs, layout, n_loaves)) as pool:
+            futures = [
+                pool.submit(_simulate_chunk, params, seed, c * chunk_size,
+                            min((c + 1) * chunk_size, n_loaves))
+                for c in pending
+            ]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                start, _ = future.result()
+                if done is not None:
+                    done[start // chunk_size] = True
+                    done.flush()
+                if progress:
+                    progress(completed, len(futures))
+
+        if checkpoint_dir:
+            results = dict(arrays)
+        else:
+            # Copy out so the shared blocks can be released.
+            results = {name: np.array(array) for name, array in arrays.items()}
+    finally:
+        arrays.clear()
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+    results["summary"] = summarize(results, params["target_portion_weight"])
+    return results
+
+
+def summarize(results, target_portion_weight):
+    counts = results["portion_count"]
+    mask = np.arange(results["portion_weight"].shape[1]) < counts[:, None]
+    weights = results["portion_weight"][mask]
+    return {
+        "loaves": int(len(counts)),
+        "portions": int(counts.sum()),
+        "mean_portion_weight": float(weights.mean()) if len(weights) else 0.0,
+        "min_portion_weight": float(weights.min()) if len(weights) else 0.0,
+        "total_waste_weight": float(results["waste_weight"].sum()),
+        "mean_waste_weight": float(results["waste_weight"].mean()) if len(counts) else 0.0,
+        "compliance": check_batch(weights, target_portion_weight),
+    }
+
+
+if __name__ == "__main__":
+    from portion_cli import add_param_arguments, params_from_args
+
+    parser = argparse.ArgumentParser(description="Simulate a batch of cheese loaves in parallel.")
+    parser.add_argument("loaves", type=int)
+    add_param_arguments(parser)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="Keep results on disk here and resume if the run is interrupted.")
+    parser.add_argument("--store-slice-weights", action="store_true")
+    parser.add_argument("--export-dir", default=None,
+                        help="Write portion (and slice weight) records for every loaf here.")
+    parser.add_argument("--export-format", choices=("csv", "parquet", "arrow"), default="parquet")
+    args = parser.parse_args()
+    params = make_params(**params_from_args(args))
+
+    batch = run_batch(
+        args.loaves, params, seed=args.seed, workers=args.workers, chunk_size=args.chunk_size,
+        store_slice_weights=args.store_slice_weights, checkpoint_dir=args.checkpoint_dir,
+        progress=lambda done, total: print(f"\r{done}/{total} chunks", end="", flush=True),
+    )
+    print()
+    print(json.dumps(batch["summary"], indent=2))
+
+    if args.export_dir:
+        # Imported here so worker processes do not load pyarrow.
+        from portion_export import PortionExporter
+
+        with PortionExporter(args.export_dir, args.export_format, slice_weights=args.store_slice_weights) as exporter:
+            exporter.add_batch(batch, params)
+        print(f"Portion records written to {exporter.portions.path}")
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from loaf_generator import generate_dimensions
+from portion_engine import cumulative_weights, forward_portions, reverse_interpolated_portions, reverse_portions
+from portion_kernels import KERNEL_BACKEND
+from three_packers import check_batch, tolerance_limits
+from volume_integration import slice_weights_from_areas, total_volume
+
+# Headless benchmark suite for the calculate() / generate_portion_image() hot path.
+#
+# Each stage is timed on its own, for loaves of 3.6k up to 10M cross-sections (the loaf
+# stays 360 mm long, so slices get thinner as the count grows):
+#   generate      - generate_dimensions()
+#   volume        - total volume and density (trapezoid rule)
+#   slice_weights - slice weights from areas and density
+#   forward / reverse / interpolated - the three portioning modes
+#   compliance    - Three Packers check of the portion weights
+#   rows          - result list work per refresh: filter masks plus one visible page of
+#                   slice and portion rows (see virtual_views.py)
+#   plot          - PortionRenderer update and Agg draw, without a display (needs matplotlib)
+# A stage's time is the best of --repeat runs after one untimed warm-up call, which takes
+# the Numba compile or cache load of the kernels on large loaves. Every run is appended to
+# a JSON history file; a stage counts as a regression when it is more than --threshold
+# slower than the best of the last --baseline-runs runs recorded on the same host with the
+# same kernel backend (Numba or Python, see portion_kernels.py).
+
+STAGES = ("generate", "volume", "slice_weights", "forward", "reverse", "interpolated",
+          "compliance", "rows", "plot")
+DEFAULT_SIZES = (3_600, 36_000, 360_000, 3_600_000, 10_000_000)
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_history.json")
+NOISE_FLOOR = 0.001  # seconds; smaller differences are never reported as regressions
+
+LOAF_LENGTH = 360.0
+TOTAL_WEIGHT = 3330.0
+TARGET_WEIGHT = 250.0
+AVERAGE_WIDTH = 93.0
+AVERAGE_HEIGHT = 90.0
+PAGE_ROWS = 40
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _list_rows(slice_weights, portions, checked, limits):
+    # What one refresh of the two result lists does: filter masks over every portion, then
+    # format only the visible page.
+    weights = np.fromiter((weight for _, _, _, weight in portions), dtype=np.float64, count=len(portions))
+    masks = [np.flatnonzero(checked & (weights < limit)) for limit in limits]
+    rows = [f"Slice {idx + 1}: Weight = {slice_weights[idx]:.2f} g" for idx in range(min(PAGE_ROWS, len(slice_weights)))]
+    rows += [f"Portion {idx + 1}: Slices {start}-{end}, Length = {length:.2f} mm, Weight = {weight:.2f} g"
+             for idx, (start, end, length, weight) in enumerate(portions[:PAGE_ROWS])]
+    return masks, rows
+
+
+def _make_renderer():
+    try:
+        from portion_renderer import PortionRenderer
+    except ImportError:
+        return None
+    return PortionRenderer("Cheese Loaf Portions", "Length (mm)", "Height (mm)", headless=True)
+
+
+def _plot(renderer, portions, heights, positions, waste_portion, limits):
+    lengths = [length for _, _, length, _ in portions] + [waste_portion[2]]
+    labels = [f"{weight:.2f} g\n{length:.2f} mm" for _, _, length, weight in portions] + ["Waste"]
+    renderer.update(lengths, [AVERAGE_HEIGHT] * len(lengths), ["orange"] * len(portions) + ["red"], labels,
+                    AVERAGE_HEIGHT, trace=(positions, heights),
+                    reference_lines=[(limit, "blue", "--", name) for name, limit in zip(("T1", "T2"), limits)])
+    renderer.figure.canvas.draw()
+
+
+def benchmark_size(n_slices, repeat=3, stages=STAGES, seed=0):
+    # Times every requested stage for one loaf of n_slices cross-sections.
+    slice_thickness = LOAF_LENGTH / n_slices
+    timings = {}
+
+    def timed(stage, func):
+        if stage in stages:
+            func()  # warm-up, see the module comment
+            timings[stage] = best_time(func, repeat)
+
+    timed("generate", lambda: generate_dimensions(n_slices, AVERAGE_WIDTH, AVERAGE_HEIGHT, seed=seed))
+    dims = generate_dimensions(n_slices, AVERAGE_WIDTH, AVERAGE_HEIGHT, seed=seed)
+    areas = dims[:, 0] * dims[:, 1]
+
+    timed("volume", lambda: TOTAL_WEIGHT / total_volume(areas, slice_thickness, "trapezoid"))
+    density = TOTAL_WEIGHT / total_volume(areas, slice_thickness, "trapezoid")
+    timed("slice_weights", lambda: slice_weights_from_areas(areas, slice_thickness, density))
+    slice_weights = slice_weights_from_areas(areas, slice_thickness, density)
+
+    timed("forward", lambda: forward_portions(slice_weights, slice_thickness, TARGET_WEIGHT))
+    timed("reverse", lambda: reverse_portions(slice_weights, slice_thickness, TARGET_WEIGHT))
+    timed("interpolated", lambda: reverse_interpolated_portions(slice_weights, slice_thickness, TARGET_WEIGHT))
+    portions, waste_portion, _ = forward_portions(slice_weights, slice_thickness, TARGET_WEIGHT,
+                                                  cum=cumulative_weights(slice_weights))
+    weights = [weight for _, _, _, weight in portions]
+
+    timed("compliance", lambda: check_batch(weights, TARGET_WEIGHT))
+    limits = tolerance_limits(TARGET_WEIGHT)
+    checked = np.ones(len(portions), dtype=bool)
+    timed("rows", lambda: _list_rows(slice_weights, portions, checked, limits + (TARGET_WEIGHT,)))
+
+    if "plot" in stages:
+        renderer = _make_renderer()
+        if renderer is not None:
+            positions = np.arange(n_slices) * slice_thickness
+            timed("plot", lambda: _plot(renderer, portions, dims[:, 1], positions, waste_portion, limits))
+            renderer.close()
+    return timings
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, stages=STAGES, seed=0, log=print):
+    results = {}
+    for n_slices in sizes:
+        results[str(n_slices)] = timings = benchmark_size(n_slices, repeat, stages, seed)
+        if log:
+            log(f"{n_slices:>10} slices  " + "  ".join(f"{stage} {seconds * 1000:.2f} ms"
+                                                     for stage, seconds in timings.items()))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_record(results, repeat):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "kernels": KERNEL_BACKEND,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_history(path, history):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(history, f, indent=1)
+    os.replace(temp_path, path)
+
+
+def find_regressions(record, history, threshold=0.2, baseline_runs=5):
+    # (size, stage, seconds, baseline) for every stage slower than the baseline by more
+    # than threshold (a fraction) and NOISE_FLOOR.
+    previous = [run for run in history if run.get("host") == record["host"]
+                and run.get("kernels", "python") == record["kernels"]][-baseline_runs:]
+    regressions = []
+    for size, timings in record["results"].items():
+        for stage, seconds in timings.items():
+            earlier = [run["results"][size][stage] for run in previous
+                       if stage in run["results"].get(size, {})]
+            if not earlier:
+                continue
+            baseline = min(earlier)
+            if seconds > baseline * (1 + threshold) and seconds - baseline > NOISE_FLOOR:
+                regressions.append((size, stage, seconds, baseline))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each stage of the portioning hot path.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Slice counts to benchmark.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON file the runs are appended to.")
+    parser.add_argument("--no-save", action="store_true", help="Compare against the history without recording.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown before a stage counts as a regression (0.2 = 20%%).")
+    parser.add_argument("--baseline-runs", type=int, default=5)
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    record = run_record(run_benchmarks(args.sizes, args.repeat, args.stages, args.seed), args.repeat)
+    regressions = find_regressions(record, history, args.threshold, args.baseline_runs)
+    if not args.no_save:
+        save_history(args.history, history + [record])
+    for size, stage, seconds, baseline in regressions:
+        print(f"REGRESSION {stage} @ {size} slices: {seconds * 1000:.2f} ms (baseline {baseline * 1000:.2f} ms)")
+    sys.exit(1 if regressions else 0)
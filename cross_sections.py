@@ -0,0 +1,89 @@
+import numpy as np
+
+# Cross-section profiles as polygons.
+#
+# A loaf's profiles are a (slices x points x 2) array of (x, y) contour points in mm, one
+# closed polygon per slice (the last point joins back to the first). Slices with fewer
+# points are padded by repeating their last point, which adds nothing to the area.
+#
+# Areas use the shoelace formula over the whole array at once, in blocks of CHUNK_SLICES
+# slices so the float64 working copies stay small however long the loaf is; there is no
+# per-slice Python. The result feeds volume_integration exactly like width * height did.
+#
+# profile_contours() builds realistic synthetic profiles - a block with rounded corners
+# and a crowned top - from the (width, height) pairs of loaf_generator.
+
+CHUNK_SLICES = 16384
+
+
+def polygon_areas(contours, chunk_slices=CHUNK_SLICES):
+    # contours: (n_slices, n_points, 2) -> area of each slice in mm^2, float64.
+    # Point order may be clockwise or anticlockwise.
+    contours = np.asarray(contours)
+    if contours.ndim != 3 or contours.shape[-1] != 2:
+        raise ValueError(f"Contours must have shape (slices, points, 2), got {contours.shape}")
+    n_slices = len(contours)
+    areas = np.empty(n_slices, dtype=np.float64)
+    for start in range(0, n_slices, chunk_slices):
+        block = contours[start:start + chunk_slices]
+        # Measure from each slice's first point: same area, less cancellation in float64.
+        x = block[..., 0] - block[:, :1, 0].astype(np.float64)
+        y = block[..., 1] - block[:, :1, 1].astype(np.float64)
+        twice_area = np.einsum("ij,ij->i", x[:, :-1], y[:, 1:]) - np.einsum("ij,ij->i", x[:, 1:], y[:, :-1])
+        areas[start:start + len(block)] = 0.5 * np.abs(twice_area)
+    return areas
+
+
+def contour_dims(contours):
+    # Bounding (width, height) of each slice, shape (n_slices, 2), for plots and reports.
+    contours = np.asarray(contours)
+    return contours.max(axis=1) - contours.min(axis=1)
+
+
+def profile_template(width, height, corner_radius=0.0, crown=0.0, n_points=64):
+    # One closed profile, shape (n_points, 2): a width x (height - crown) block with rounded
+    # corners, its top raised by a parabolic crown reaching `height` at the centre line.
+    # Points run anticlockwise from the bottom-left, spread evenly along the outline.
+    if n_points < 4:
+        raise ValueError("A profile needs at least 4 points")
+    shoulder = height - crown
+    radius = min(corner_radius, width / 2, shoulder / 2)
+    half_x = width / 2 - radius
+    half_y = shoulder / 2 - radius
+    mid_y = shoulder / 2
+    # Outline as 8 segments: bottom, corner, right, corner, top, corner, left, corner.
+    # Lines run from start to end; arcs turn 90 degrees about centre from start_angle.
+    starts = np.array([[-half_x, 0], [0, 0], [width / 2, mid_y - half_y], [0, 0],
+                       [half_x, shoulder], [0, 0], [-width / 2, mid_y + half_y], [0, 0]], dtype=np.float64)
+    ends = np.array([[half_x, 0], [0, 0], [width / 2, mid_y + half_y], [0, 0],
+                     [-half_x, shoulder], [0, 0], [-width / 2, mid_y - half_y], [0, 0]], dtype=np.float64)
+    centres = np.array([[0, 0], [half_x, radius], [0, 0], [half_x, shoulder - radius],
+                        [0, 0], [-half_x, shoulder - radius], [0, 0], [-half_x, radius]], dtype=np.float64)
+    start_angles = np.array([0, -0.5, 0, 0.0, 0, 0.5, 0, 1.0]) * np.pi
+    is_arc = np.arange(8) % 2 == 1
+    lengths = np.where(is_arc, 0.5 * np.pi * radius, np.linalg.norm(ends - starts, axis=1))
+    edges = np.concatenate(([0.0], np.cumsum(lengths)))
+
+    # Every segment start is a point (so sharp corners are exact), the rest spread evenly.
+    corners = np.unique(edges[:-1])[:n_points]
+    fill = n_points - len(corners)
+    along = np.sort(np.concatenate((corners, (np.arange(fill) + 0.5) * (edges[-1] / max(fill, 1)))))
+    segment = np.clip(np.searchsorted(edges, along, side="right") - 1, 0, 7)
+    u = (along - edges[segment]) / np.where(lengths[segment] > 0, lengths[segment], 1.0)
+    line_points = starts[segment] + u[:, None] * (ends[segment] - starts[segment])
+    angles = start_angles[segment] + 0.5 * np.pi * u
+    arc_points = centres[segment] + radius * np.column_stack((np.cos(angles), np.sin(angles)))
+    points = np.where(is_arc[segment][:, None], arc_points, line_points)
+    if crown:
+        lift = crown * np.clip(1.0 - (2.0 * points[:, 0] / width) ** 2, 0.0, None)
+        points[:, 1] += lift * points[:, 1] / shoulder
+    return points
+
+
+def profile_contours(dims, corner_radius=0.0, crown=0.0, n_points=64, dtype=np.float64):
+    # (width, height) per slice -> contours (n_slices, n_points, 2). The template for the
+    # mean dimensions is scaled per slice, which is one broadcast multiply.
+    dims = np.asarray(dims, dtype=np.float64)
+    mean = dims.mean(axis=0)
+    template = profile_template(mean[0], mean[1], corner_radius, crown, n_points)
+    return (template[None, :, :] * (dims / mean)[:, None, :]).astype(dtype, copy=False)
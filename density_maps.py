@@ -0,0 +1,221 @@
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+
+from volume_integration import slice_thicknesses
+
+# Voxel density maps (e.g. from an X-ray scan) for eyed and rinded cheeses.
+#
+# A map is a (planes, rows, columns) float32 grid along the loaf: planes follow the loaf's
+# length like the slices do, and each voxel holds the density there - in any unit, only
+# proportions matter, since slice weights are still scaled to the weighed total. Eyes and
+# the air around the loaf are 0, a rind is denser than the paste.
+#
+# Maps are read through numpy.memmap, one chunk of planes at a time: each chunk is mapped,
+# summed in float64 and unmapped again, so memory stays at about CHUNK_BYTES (plus half
+# of that for a threshold mask) however large the grid is. The per-plane mass is
+# resampled onto the portioning slices as mass per mm (slice_profile), which takes the
+# place of the cross-sectional areas in volume_integration: area x uniform density
+# becomes the measured mass along the loaf, and density_and_slice_weights() and the
+# portioning run unchanged.
+#
+# Files are either .npy arrays (voxel size given separately) or .dmap files:
+#
+#   offset 0   header, 64 bytes: struct "<8sIIQQQddd", little-endian
+#                magic       b"CHDMAP01"
+#                version     uint32 (1)
+#                flags       uint32 (0)
+#                planes, rows, columns   uint64
+#                voxel size  float64 x3, mm along the loaf, across rows, across columns
+#   offset 64  voxels, float32[planes, rows, columns]
+#
+# DensityMapWriter streams planes into a .dmap file, so a converter or scanner bridge
+# never holds the whole grid.
+
+MAGIC = b"CHDMAP01"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQddd")
+HEADER_SIZE = 64
+VOXEL_DTYPE = np.dtype("<f4")
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+class DensityMap:
+    def __init__(self, path, shape, voxel_size, offset=HEADER_SIZE, dtype=VOXEL_DTYPE):
+        self.path = path
+        self.shape = tuple(int(n) for n in shape)
+        self.voxel_size = tuple(float(size) for size in voxel_size)
+        self.offset = offset
+        self.dtype = np.dtype(dtype)
+        self._plane_masses = {}
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def length(self):
+        # Length of the mapped part of the loaf in mm.
+        return self.shape[0] * self.voxel_size[0]
+
+    def planes(self, start=0, stop=None):
+        # Memory-mapped view of planes start:stop (zero-copy; the whole grid by default).
+        stop = self.shape[0] if stop is None else min(stop, self.shape[0])
+        plane_bytes = self.shape[1] * self.shape[2] * self.dtype.itemsize
+        return np.memmap(self.path, self.dtype, "r", self.offset + start * plane_bytes,
+                         (stop - start,) + self.shape[1:])
+
+    def plane_masses(self, threshold=None, chunk_bytes=CHUNK_BYTES):
+        # Mass of each plane (sum of its voxels x voxel volume), float64. Voxels below
+        # threshold count as empty, e.g. to drop scanner noise in eyes and air.
+        key = (threshold, chunk_bytes)
+        if key not in self._plane_masses:
+            n_planes, rows, columns = self.shape
+            chunk_planes = max(1, chunk_bytes // max(1, rows * columns * self.dtype.itemsize))
+            masses = np.empty(n_planes, dtype=np.float64)
+            for start in range(0, n_planes, chunk_planes):
+                block = self.planes(start, start + chunk_planes)
+                keep = True if threshold is None else block >= threshold
+                masses[start:start + len(block)] = block.sum(axis=(1, 2), dtype=np.float64, where=keep)
+                del block  # unmaps the chunk
+            masses *= self.voxel_size[0] * self.voxel_size[1] * self.voxel_size[2]
+            self._plane_masses = {key: masses}
+        return self._plane_masses[key]
+
+    def slice_profile(self, n_slices, slice_thickness=None, positions=None, start=0.0, threshold=None):
+        # Mass per mm of each portioning slice, for use in place of cross-sectional areas.
+        # Slices start `start` mm into the map and are slice_thickness apart, or at
+        # `positions` (mm, first slice at `start`). The cumulative plane mass is interpolated
+        # onto the slice edges, so the mass is conserved whatever the two spacings are;
+        # slices beyond the mapped length get none.
+        if positions is None:
+            thicknesses = np.full(n_slices, float(slice_thickness))
+        else:
+            thicknesses = slice_thicknesses(positions, n_slices)[:n_slices]
+        edges = np.empty(n_slices + 1, dtype=np.float64)
+        edges[0] = start
+        np.cumsum(thicknesses, out=edges[1:])
+        edges[1:] += start
+
+        plane_edges = np.arange(self.shape[0] + 1) * self.voxel_size[0]
+        cumulative = np.zeros(self.shape[0] + 1, dtype=np.float64)
+        np.cumsum(self.plane_masses(threshold), out=cumulative[1:])
+        return np.diff(np.interp(edges, plane_edges, cumulative)) / thicknesses
+
+
+def open_density_map(path, voxel_size=None):
+    # .npy files need voxel_size (mm along the loaf, across rows, across columns).
+    if path.lower().endswith(".npy"):
+        if voxel_size is None:
+            raise ValueError("voxel_size is needed for .npy density maps")
+        with open(path, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+                np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            offset = f.tell()
+        if len(shape) != 3 or fortran_order:
+            raise ValueError(f"{path} must hold a C-ordered (planes, rows, columns) array")
+        return DensityMap(path, shape, voxel_size, offset, dtype)
+    with open(path, "rb") as f:
+        magic, version, _, planes, rows, columns, *header_voxel_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a density map")
+    if version != VERSION:
+        raise ValueError(f"Unsupported density map version {version}")
+    return DensityMap(path, (planes, rows, columns), voxel_size or header_voxel_size)
+
+
+class DensityMapWriter:
+    def __init__(self, path, rows, columns, voxel_size):
+        self.path = path
+        self.rows = int(rows)
+        self.columns = int(columns)
+        self.voxel_size = tuple(float(size) for size in voxel_size)
+        self.n_planes = 0
+        self._file = open(path, "wb")
+        self._file.write(self._header())
+
+    def _header(self):
+        return HEADER.pack(MAGIC, VERSION, 0, self.n_planes, self.rows, self.columns, *self.voxel_size)
+
+    def add_planes(self, planes):
+        planes = np.asarray(planes)
+        if planes.ndim == 2:
+            planes = planes[np.newaxis]
+        if planes.shape[1:] != (self.rows, self.columns):
+            raise ValueError(f"Planes must have shape (n, {self.rows}, {self.columns})")
+        self._file.write(np.ascontiguousarray(planes, dtype=VOXEL_DTYPE).tobytes())
+        self.n_planes += len(planes)
+
+    def close(self):
+        # The plane count is only known now: rewrite the header.
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.close()
+        return open_density_map(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_synthetic_map(path, n_planes=2000, rows=256, columns=256, voxel_size=(0.18, 0.4, 0.4),
+                        paste_density=1.1, rind_density=1.3, rind_voxels=4, eyes=400,
+                        eye_radius=(3, 12), seed=None):
+    # An eyed, rinded block for trying the density path without a scanner: paste with a
+    # denser rind on every side (both ends included) and empty spherical eyes, inside a
+    # 6-voxel air margin.
+    rng = np.random.default_rng(seed)
+    margin = 6
+    rind_depth = np.minimum.outer(np.minimum(np.arange(rows), np.arange(rows)[::-1]) - margin,
+                                  np.minimum(np.arange(columns), np.arange(columns)[::-1]) - margin)
+    base = np.where(rind_depth < 0, 0.0, np.where(rind_depth < rind_voxels, rind_density, paste_density))
+    base = base.astype(np.float32)
+    ends = np.full((rows, columns), rind_density, dtype=np.float32) * (rind_depth >= 0)
+
+    radii = rng.uniform(eye_radius[0], eye_radius[1], eyes)
+    low = margin + rind_voxels + radii
+    centres = np.column_stack((rng.uniform(rind_voxels + radii, n_planes - rind_voxels - radii),
+                               rng.uniform(low, rows - low), rng.uniform(low, columns - low)))
+    row_grid, column_grid = np.ogrid[:rows, :columns]
+    with DensityMapWriter(path, rows, columns, voxel_size) as writer:
+        for z in range(n_planes):
+            if z < rind_voxels or z >= n_planes - rind_voxels:
+                writer.add_planes(ends)
+                continue
+            plane = base.copy()
+            for (cz, cy, cx), radius in zip(centres, radii):
+                reach = radius * radius - (z - cz) ** 2
+                if reach > 0:
+                    plane[(row_grid - cy) ** 2 + (column_grid - cx) ** 2 < reach] = 0.0
+            writer.add_planes(plane)
+    return open_density_map(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reduce a voxel density map to mass per plane.")
+    parser.add_argument("path", help=".dmap or .npy file")
+    parser.add_argument("--voxel-size", type=float, nargs=3, help="mm along the loaf, rows, columns (.npy)")
+    parser.add_argument("--threshold", type=float, default=None, help="Ignore voxels below this density.")
+    parser.add_argument("--synthetic", type=int, nargs=3, metavar=("PLANES", "ROWS", "COLUMNS"),
+                        help="Write an eyed, rinded synthetic map to path first.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        start = time.perf_counter()
+        write_synthetic_map(args.path, *args.synthetic, seed=args.seed)
+        print(f"Wrote {args.path} in {time.perf_counter() - start:.2f} s")
+    density_map = open_density_map(args.path, args.voxel_size)
+    start = time.perf_counter()
+    masses = density_map.plane_masses(args.threshold)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(args.path)
+    print(f"{density_map.shape} voxels, {size / 1e6:.0f} MB: reduced in {elapsed:.2f} s "
+          f"({size / 1e6 / elapsed:.0f} MB/s)")
+    print(f"Mass per plane: min {masses.min():.4g}, mean {masses.mean():.4g}, max {masses.max():.4g}")
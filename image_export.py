@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from portion_renderer import PortionRenderer
+
+# Background PNG export with an on-disk render cache.
+#
+# A plot is described by a spec: the keyword arguments of PortionRenderer.update() plus the
+# renderer options (title, axis labels, size, dpi). The PNG is named after a SHA-256 hash
+# of that spec, so an identical plan with identical options is never rendered twice - the
+# cached file is returned instead. Rendering uses the Agg backend outside pyplot on a
+# worker thread, and the cache directory is trimmed to max_bytes by evicting the least
+# recently used images.
+
+RENDER_OPTIONS = ("title", "xlabel", "ylabel", "figsize", "equal_aspect", "dpi")
+DEFAULT_CACHE_BYTES = 200 * 1024 * 1024
+
+
+def _hash_value(digest, value):
+    if isinstance(value, dict):
+        for key in sorted(value):
+            digest.update(key.encode())
+            _hash_value(digest, value[key])
+    elif isinstance(value, np.ndarray) and value.dtype.kind in "biuf":
+        array = np.ascontiguousarray(value, dtype=np.float64)
+        digest.update(repr(array.shape).encode())
+        digest.update(array.tobytes())
+    elif isinstance(value, (list, tuple)) and value and all(isinstance(v, (int, float, np.number)) for v in value):
+        _hash_value(digest, np.asarray(value, dtype=np.float64))
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"[")
+        for item in value:
+            _hash_value(digest, item)
+        digest.update(b"]")
+    else:
+        digest.update(json.dumps(value, default=float).encode())
+
+
+def spec_key(spec):
+    digest = hashlib.sha256()
+    _hash_value(digest, spec)
+    return digest.hexdigest()
+
+
+def render_png(spec, path):
+    # Draws the spec on a private headless figure and writes it to path.
+    options = {name: spec[name] for name in RENDER_OPTIONS if name in spec and name != "dpi"}
+    renderer = PortionRenderer(options.pop("title", ""), options.pop("xlabel", ""), options.pop("ylabel", ""),
+                               headless=True, **options)
+    renderer.update(**{name: value for name, value in spec.items() if name not in RENDER_OPTIONS})
+    renderer.savefig(path, dpi=spec.get("dpi", 100))
+    renderer.close()
+
+
+class ImageCache:
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get_or_render(self, spec, key=None):
+        key = key or spec_key(spec)
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.utime(path)  # mark as recently used
+            return path
+        # Render to a temporary file and rename, so readers never see a partial PNG.
+        fd, temp_path = tempfile.mkstemp(suffix=".png", dir=self.directory)
+        os.close(fd)
+        try:
+            render_png(spec, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        # Removes least recently used images until the directory fits in max_bytes.
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".png") and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class ImageExporter:
+    # Renders specs on a background thread; identical requests in flight share one Future.
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES, workers=1):
+        self.cache = ImageCache(directory, max_bytes)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-export")
+        self._in_flight = {}
+        self._lock = threading.RLock()  # a Future that is already done runs its callback inline
+
+    def submit(self, spec):
+        # Returns a Future resolving to the PNG path.
+        key = spec_key(spec)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._pool.submit(self.cache.get_or_render, spec, key)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda _, key=key: self._forget(key))
+        return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def export_many(self, specs):
+        # Batch reports: one PNG path per spec, in order.
+        return [future.result() for future in [self.submit(spec) for spec in specs]]
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
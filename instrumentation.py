@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+# Per-stage timing and memory instrumentation.
+#
+# A run (one Calculate) is split into stages; each stage records wall time, CPU time of
+# the thread it ran on, and, with trace_memory, the peak memory allocated above the level
+# at its start (tracemalloc). Counts such as slices and portions are attached to the run.
+# A finished run is
+#   - logged as one JSON line on the "cheese.metrics" logger,
+#   - kept in a rolling history for summary() and the statistics panel (stats_panel.py),
+#   - written to a Prometheus text file (if prometheus_path is set) for a textfile exporter.
+#
+# Switched off, start_run() returns a shared no-op run and stage() a shared nullcontext,
+# and tracemalloc is not running, so the cost is a couple of attribute lookups per stage.
+# Stages are either `with run.stage(name):` blocks or consecutive run.lap(name) calls, and
+# must not nest (each one resets the tracemalloc peak).
+#
+# The CHEESE_METRICS environment variable (1/true/on) enables it at start-up and
+# CHEESE_METRICS_FILE overrides the Prometheus file path.
+
+logger = logging.getLogger("cheese.metrics")
+
+_NULL_STAGE = nullcontext()
+
+
+class _NullRun:
+    __slots__ = ()
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def count(self, **counts):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def end_stage(self):
+        pass
+
+    def finish(self, **counts):
+        pass
+
+
+NULL_RUN = _NullRun()
+
+
+class _Stage:
+    __slots__ = ("run", "name", "wall", "cpu", "memory")
+
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        if self.run.trace_memory:
+            self.memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        stage = {"stage": self.name, "wall_s": wall, "cpu_s": cpu}
+        if self.run.trace_memory:
+            stage["peak_bytes"] = max(0, tracemalloc.get_traced_memory()[1] - self.memory)
+        self.run.stages.append(stage)
+        return False
+
+
+class RunMetrics:
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+        self.trace_memory = owner.trace_memory and tracemalloc.is_tracing()
+        self.stages = []
+        self.counts = {}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._current = None
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def lap(self, name):
+        # Ends the open stage (if any) and starts the next, for straight-line code. A run can
+        # move between threads, but a stage must end on the thread that started it.
+        self.end_stage()
+        self._current = _Stage(self, name).__enter__()
+
+    def end_stage(self):
+        if self._current is not None:
+            self._current.__exit__(None, None, None)
+            self._current = None
+
+    def count(self, **counts):
+        self.counts.update(counts)
+
+    def finish(self, **counts):
+        self.end_stage()
+        self.counts.update(counts)
+        self.owner.record({
+            "run": self.name,
+            "timestamp": self.started,
+            "total_s": time.perf_counter() - self._start,
+            "counts": self.counts,
+            "stages": self.stages,
+        })
+
+
+class Instrumentation:
+    def __init__(self, enabled=False, trace_memory=True, history=100, prometheus_path=None, prefix="cheese"):
+        self.trace_memory = trace_memory
+        self.prometheus_path = prometheus_path
+        self.prefix = prefix
+        self.history = deque(maxlen=history)
+        self.totals = {}  # (run, stage) -> [runs, wall_s, cpu_s], for the Prometheus counters
+        self.run_totals = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+        self.enabled = False
+        self.enable(enabled)
+
+    @classmethod
+    def from_environment(cls, prometheus_path=None, **kwargs):
+        enabled = os.environ.get("CHEESE_METRICS", "").lower() in ("1", "true", "yes", "on")
+        return cls(enabled, prometheus_path=os.environ.get("CHEESE_METRICS_FILE", prometheus_path), **kwargs)
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        if enabled and self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        elif not enabled and self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def start_run(self, name="calculate"):
+        return RunMetrics(self, name) if self.enabled else NULL_RUN
+
+    def record(self, record):
+        with self._lock:
+            self.history.append(record)
+            self.run_totals[record["run"]] = self.run_totals.get(record["run"], 0) + 1
+            for stage in record["stages"]:
+                totals = self.totals.setdefault((record["run"], stage["stage"]), [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += stage["wall_s"]
+                totals[2] += stage["cpu_s"]
+        logger.info("%s", json.dumps(record, separators=(",", ":")))
+        if self.prometheus_path:
+            try:
+                self.write_prometheus(self.prometheus_path)
+            except OSError as error:
+                logger.warning("Could not write %s: %s", self.prometheus_path, error)
+        for listener in list(self.listeners):
+            listener(record)
+
+    def reset(self):
+        with self._lock:
+            self.history.clear()
+
+    def summary(self):
+        # Per stage over the rolling history: runs, last/mean/p95 wall time, mean CPU time
+        # and the largest peak allocation (None without memory tracing), in stage order.
+        with self._lock:
+            runs = list(self.history)
+        by_stage = {}
+        for record in runs:
+            for stage in record["stages"]:
+                by_stage.setdefault(stage["stage"], []).append(stage)
+        summary = []
+        for name, stages in by_stage.items():
+            wall = np.array([stage["wall_s"] for stage in stages])
+            peaks = [stage["peak_bytes"] for stage in stages if "peak_bytes" in stage]
+            summary.append({
+                "stage": name,
+                "runs": len(stages),
+                "last_s": float(wall[-1]),
+                "mean_s": float(wall.mean()),
+                "p95_s": float(np.percentile(wall, 95)),
+                "cpu_mean_s": float(np.mean([stage["cpu_s"] for stage in stages])),
+                "peak_bytes": max(peaks) if peaks else None,
+            })
+        return summary
+
+    def prometheus_text(self):
+        prefix = self.prefix
+        with self._lock:
+            last = {}
+            for record in self.history:
+                last[record["run"]] = record
+            totals = dict(self.totals)
+            run_totals = dict(self.run_totals)
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value:.9g}")
+
+        def last_stage(field):
+            return [({"run": run, "stage": stage["stage"]}, stage[field])
+                    for run, record in last.items() for stage in record["stages"] if field in stage]
+
+        metric("stage_wall_seconds", "gauge", "Wall time of the stage in the last run.", last_stage("wall_s"))
+        metric("stage_cpu_seconds", "gauge", "CPU time of the stage in the last run.", last_stage("cpu_s"))
+        metric("stage_peak_bytes", "gauge", "Peak memory allocated during the stage in the last run.",
+               last_stage("peak_bytes"))
+        metric("stage_runs_total", "counter", "Number of times the stage ran.",
+               [({"run": run, "stage": stage}, value[0]) for (run, stage), value in totals.items()])
+        metric("stage_wall_seconds_total", "counter", "Total wall time spent in the stage.",
+               [({"run": run, "stage": stage}, value[1]) for (run, stage), value in totals.items()])
+        metric("stage_cpu_seconds_total", "counter", "Total CPU time spent in the stage.",
+               [({"run": run, "stage": stage}, value[2]) for (run, stage), value in totals.items()])
+        metric("run_seconds", "gauge", "Wall time of the last run.",
+               [({"run": run}, record["total_s"]) for run, record in last.items()])
+        metric("run_timestamp_seconds", "gauge", "Start time of the last run (Unix time).",
+               [({"run": run}, record["timestamp"]) for run, record in last.items()])
+        metric("run_count", "gauge", "Counts attached to the last run (slices, portions...).",
+               [({"run": run, "item": item}, float(value)) for run, record in last.items()
+                for item, value in record["counts"].items()])
+        metric("runs_total", "counter", "Number of finished runs.",
+               [({"run": run}, count) for run, count in run_totals.items()])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # Atomic replace, so the exporter never reads a half-written file.
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(suffix=".prom.tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
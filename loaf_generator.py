@@ -0,0 +1,127 @@
+import numpy as np
+
+# Synthetic loaf generator.
+#
+# Draws slice widths and heights for whole loaves (or batches of loaves) in bulk from a
+# NumPy Generator, so a run is reproducible bit-for-bit from its seed and millions of
+# slices are generated in a few array operations.
+#
+# Noise models along the length of the loaf:
+#   "iid"      - every slice drawn independently (the original random.gauss behaviour).
+#   "ar1"      - AR(1) process, neighbouring slices correlated by `correlation`.
+#   "smoothed" - i.i.d. noise averaged over a moving window of `window` slices.
+# Each model keeps the requested standard deviation per slice. An optional end taper
+# shrinks both dimensions towards the ends of the loaf.
+
+NOISE_MODELS = ("iid", "ar1", "smoothed")
+
+
+def make_rng(seed=None):
+    # Accepts an int, a SeedSequence, an existing Generator or None (fresh OS entropy).
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def spawn_rngs(seed, n_streams):
+    # Independent child streams, e.g. one per worker process or per loaf.
+    if isinstance(seed, np.random.SeedSequence):
+        seed_seq = seed
+    else:
+        seed_seq = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed_seq.spawn(n_streams)]
+
+
+def _ar1_filter(noise, correlation):
+    # In-place AR(1) filter along the last-but-one axis (slices), scaled so the stationary
+    # standard deviation equals that of the input noise:
+    #   x[t] = phi * x[t - 1] + sqrt(1 - phi^2) * e[t],   x[0] = e[0]
+    # Inside a block, x[t] = phi^t * (x[-1] * phi + cumsum(phi^-k * e[k])), which vectorizes.
+    # Blocks are sized so phi^-k never overflows.
+    phi = float(correlation)
+    if not -1.0 < phi < 1.0:
+        raise ValueError("AR(1) correlation must be strictly between -1 and 1")
+    if phi == 0.0:
+        return noise
+    n = noise.shape[-2]
+    scale = np.sqrt(1.0 - phi * phi)
+    block = max(1, min(n, int(150 / -np.log10(abs(phi)))))
+    k = np.arange(block, dtype=np.float64)
+    powers = (phi ** k)[:, None]
+    inv_powers = (phi ** -k)[:, None]
+
+    carry = None
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        m = stop - start
+        e = noise[..., start:stop, :] * scale
+        if carry is None:
+            # The first slice is drawn from the stationary distribution directly.
+            e[..., 0, :] /= scale
+            acc = np.cumsum(e * inv_powers[:m], axis=-2)
+        else:
+            acc = np.cumsum(e * inv_powers[:m], axis=-2) + (carry * phi)[..., None, :]
+        noise[..., start:stop, :] = acc * powers[:m]
+        carry = noise[..., stop - 1, :]
+    return noise
+
+
+def _moving_average(noise, window):
+    # Centred box filter along the slice axis, rescaled back to unit standard deviation.
+    window = int(window)
+    n = noise.shape[-2]
+    if window <= 1 or n == 0:
+        return noise
+    window = min(window, n)
+    pad_before = window // 2
+    pad_after = window - 1 - pad_before
+    pad_width = [(0, 0)] * noise.ndim
+    pad_width[-2] = (pad_before, pad_after)
+    padded = np.pad(noise, pad_width, mode="reflect" if n > 1 else "edge")
+    cum = np.cumsum(padded, axis=-2)
+    zeros = np.zeros_like(cum[..., :1, :])
+    cum = np.concatenate([zeros, cum], axis=-2)
+    smoothed = (cum[..., window:, :] - cum[..., :-window, :]) / window
+    return smoothed * np.sqrt(window)
+
+
+def taper_profile(n_slices, taper_slices, taper_depth):
+    # Multiplier per slice: 1 - taper_depth at the very ends, easing up to 1 over
+    # taper_slices slices with a smoothstep curve.
+    profile = np.ones(n_slices)
+    taper_slices = int(min(taper_slices, n_slices // 2))
+    if taper_slices <= 0 or taper_depth == 0:
+        return profile
+    t = np.arange(taper_slices) / taper_slices
+    ramp = 1 - taper_depth * (1 - t * t * (3 - 2 * t))
+    profile[:taper_slices] = ramp
+    profile[n_slices - taper_slices:] = ramp[::-1]
+    return profile
+
+
+def generate_loaves(n_loaves, n_slices, avg_width, avg_height, width_std=2, height_std=2,
+                    noise="iid", correlation=0.9, window=25, taper_slices=0, taper_depth=0.0,
+                    seed=None, dtype=np.float64):
+    # Returns an array of shape (n_loaves, n_slices, 2) holding (width, height) per slice.
+    if noise not in NOISE_MODELS:
+        raise ValueError(f"Unknown noise model {noise!r}, expected one of {NOISE_MODELS}")
+    rng = make_rng(seed)
+    dims = rng.standard_normal((n_loaves, n_slices, 2), dtype=dtype)
+
+    if noise == "ar1":
+        dims = _ar1_filter(dims, correlation)
+    elif noise == "smoothed":
+        dims = _moving_average(dims, window).astype(dtype, copy=False)
+
+    dims *= np.array([width_std, height_std], dtype=dtype)
+    dims += np.array([avg_width, avg_height], dtype=dtype)
+
+    if taper_slices and taper_depth:
+        dims *= taper_profile(n_slices, taper_slices, taper_depth).astype(dtype)[None, :, None]
+    return dims
+
+
+def generate_dimensions(n_slices, avg_width, avg_height, width_std=2, height_std=2, seed=None, **kwargs):
+    # Single loaf, shape (n_slices, 2) - drop-in replacement for the old per-slice generator.
+    return generate_loaves(1, n_slices, avg_width, avg_height, width_std, height_std,
+                           seed=seed, **kwargs)[0]
@@ -0,0 +1,189 @@
+import argparse
+import time
+
+import numpy as np
+
+from portion_engine import cumulative_weights
+from three_packers import check_batch, tolerance_limits
+
+# Mixed-SKU cut plans: one loaf cut into portions of several nominal weights.
+#
+# With a single target the slack at the end of the loaf is one waste piece that can be
+# almost a whole portion. Given a set of SKUs (nominal weights, e.g. 150 / 200 / 250 g)
+# the planner picks how many packs of each to cut, and in what order, so that the loaf
+# loses as little as possible to giveaway and waste. Every pack is cut like the greedy
+# plan: at the first slice boundary where it reaches its SKU's threshold, nominal x
+# tolerance but never below the SKU's own T1 limit (nominal - TNE from get_tne()). At the
+# default tolerance of 1 no pack is under its nominal, so every SKU passes all three rules.
+# Below 1, packs may fall short of their nominal and each SKU's average (Rule 1) is not
+# enforced by the planner, only reported per SKU by mixed_plan_cost().
+#
+# For a loaf, giveaway + waste = total - sum of the packs' nominal weights, so the best
+# plan packs the most nominal weight. The loss depends only on how many packs of each SKU
+# are cut, and so does everything that follows: the state of the dynamic programme is the
+# count vector c, and its value is the earliest boundary E[c] at which those packs can end,
+#
+#   E[c] = min over SKUs s with c_s > 0 of  next_cut(E[c - e_s], s)
+#
+# where next_cut is one search in the prefix sums. next_cut never moves backwards when its
+# start does, so the minimum over the last SKU is exact over all orders. States are
+# expanded one pack at a time, all states of a layer in one vectorized search per SKU, and
+# pruned when they:
+#   - run past the end of the loaf, or exceed a SKU's quota (packs still wanted);
+#   - repeat a count vector already reached at an earlier or equal boundary;
+#   - cannot beat the best plan found so far even if the rest of the loaf were packed
+#     at the best nominal weight per gram any SKU's threshold allows (value + remaining
+#     weight x max(nominal / threshold) < best value).
+# A 3.3 kg loaf against five SKUs has a few thousand live states, whatever the number of
+# slices: the slice count only enters through the searches.
+#
+#   python mixed_sku.py --skus 150 200 250   times a 100k-slice loaf against those SKUs
+
+
+def sku_thresholds(nominal_weights, tolerance=1.0):
+    # Cut threshold of each SKU: nominal x tolerance, clamped to the SKU's T1 limit.
+    nominal = np.asarray(nominal_weights, dtype=np.float64)
+    t1_limit, _ = tolerance_limits(nominal)
+    return np.maximum(nominal * tolerance, t1_limit)
+
+
+def _best_counts(cum, nominal, thresholds, quotas):
+    # Breadth-first over count vectors, one pack per layer. Returns the SKU sequence of the
+    # plan with the most nominal weight (fewest packs on ties).
+    n_slices = len(cum) - 1
+    total = cum[-1]
+    n_skus = len(nominal)
+    # Mixed-radix keys identify count vectors; no SKU can be cut more often than this.
+    radix = np.minimum(total // thresholds, quotas).astype(np.int64) + 1
+    place = np.concatenate(([1], np.cumprod(radix)[:-1]))
+    # No pack weighs less than its threshold, so a gram of loaf yields at most this much.
+    yield_per_gram = float(np.max(nominal / thresholds))
+
+    counts = np.zeros((1, n_skus), dtype=np.int64)
+    ends = np.zeros(1, dtype=np.int64)
+    values = np.zeros(1)
+    layers = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))]
+    best_value, best = 0.0, (0, 0)
+    while len(ends):
+        candidate_counts, candidate_ends, candidate_values, parents, skus = [], [], [], [], []
+        for s in range(n_skus):
+            wanted = counts[:, s] < quotas[s]
+            cut = np.searchsorted(cum, cum[ends[wanted]] + thresholds[s], side="left")
+            fits = cut <= n_slices
+            rows = np.flatnonzero(wanted)[fits]
+            grown = counts[rows].copy()
+            grown[:, s] += 1
+            candidate_counts.append(grown)
+            candidate_ends.append(np.maximum(cut[fits], ends[rows] + 1))
+            candidate_values.append(values[rows] + nominal[s])
+            parents.append(rows)
+            skus.append(np.full(len(rows), s, dtype=np.int64))
+        counts = np.concatenate(candidate_counts)
+        ends = np.concatenate(candidate_ends)
+        values = np.concatenate(candidate_values)
+        parents = np.concatenate(parents)
+        skus = np.concatenate(skus)
+
+        # Keep the earliest end of every count vector.
+        keys = counts @ place
+        order = np.lexsort((ends, keys))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = keys[order[1:]] != keys[order[:-1]]
+        keep = order[first]
+
+        keep = keep[values[keep] + (total - cum[ends[keep]]) * yield_per_gram >= best_value - 1e-9]
+        counts, ends, values = counts[keep], ends[keep], values[keep]
+        layers.append((parents[keep], skus[keep]))
+        if len(values) and values.max() > best_value + 1e-9:
+            best_value, best = float(values.max()), (len(layers) - 1, int(np.argmax(values)))
+
+    layer, row = best
+    sequence = []
+    while layer > 0:
+        parents, skus = layers[layer]
+        sequence.append(int(skus[row]))
+        row = int(parents[row])
+        layer -= 1
+    return sequence[::-1]
+
+
+def mixed_portions(slice_weights, slice_thickness, nominal_weights, quotas=None, tolerance=1.0, waste_at="back"):
+    # Returns (portions, waste_portion, skus): portions in the same tuple format as
+    # portion_engine, in increasing slice order, and the nominal weight of each portion.
+    # quotas: most packs wanted of each SKU (None = no limit), in nominal_weights order.
+    slice_weights = np.asarray(slice_weights, dtype=np.float64)
+    n_slices = len(slice_weights)
+    weights = slice_weights[::-1] if waste_at == "front" else slice_weights
+    cum = cumulative_weights(weights)
+    nominal = np.asarray(nominal_weights, dtype=np.float64)
+    if not np.all(nominal > 0):
+        raise ValueError("SKU weights must be positive")
+    thresholds = sku_thresholds(nominal, tolerance)
+    if not np.all(thresholds > 0):
+        raise ValueError("tolerance must be positive")
+    if quotas is None:
+        quotas = [None] * len(nominal)
+    if len(quotas) != len(nominal) or any(quota is not None and quota < 0 for quota in quotas):
+        raise ValueError("Give one non-negative quota (or None) per SKU")
+    limits = np.array([n_slices if quota is None else quota for quota in quotas], dtype=np.int64)
+
+    sequence = _best_counts(cum, nominal, thresholds, limits) if len(nominal) and n_slices else []
+    portions = []
+    start = 0
+    for s in sequence:
+        end = max(int(np.searchsorted(cum, cum[start] + thresholds[s], side="left")), start + 1)
+        portions.append((start, end - 1, (end - start) * slice_thickness, float(cum[end] - cum[start])))
+        start = end
+    waste_portion = (start, n_slices - 1, (n_slices - start) * slice_thickness, float(cum[-1] - cum[start]))
+    skus = [float(nominal[s]) for s in sequence]
+
+    if waste_at == "front":
+        last = n_slices - 1
+        portions = [(last - e, last - s, length, weight) for s, e, length, weight in portions][::-1]
+        waste_portion = (0, last - waste_portion[0], waste_portion[2], waste_portion[3])
+        skus = skus[::-1]
+    return portions, waste_portion, skus
+
+
+def mixed_plan_cost(portions, waste_portion, skus):
+    # Totals plus, per SKU, the pack count, giveaway and Three Packers status.
+    weights = np.array([weight for _, _, _, weight in portions], dtype=np.float64)
+    nominal = np.array(skus, dtype=np.float64)
+    waste = waste_portion[3] if waste_portion else 0.0
+    giveaway = float(np.sum(weights - nominal))
+    per_sku = []
+    for sku in sorted(set(skus)):
+        packs = weights[nominal == sku]
+        per_sku.append({"nominal_g": sku, "portions": len(packs), "giveaway_g": float(np.sum(packs - sku)),
+                        "compliance": check_batch(packs, sku)})
+    return {"portions": len(portions), "giveaway": giveaway, "waste": waste,
+            "giveaway_plus_waste": giveaway + waste, "skus": per_sku}
+
+
+if __name__ == "__main__":
+    from portion_engine import compute_portions
+
+    parser = argparse.ArgumentParser(description="Time a mixed-SKU plan on a synthetic loaf.")
+    parser.add_argument("--skus", type=float, nargs="+", default=[150.0, 180.0, 200.0, 227.0, 250.0])
+    parser.add_argument("--quotas", type=int, nargs="+", help="Most packs of each SKU, in --skus order.")
+    parser.add_argument("--slices", type=int, default=100_000)
+    parser.add_argument("--total-weight", type=float, default=3330.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    slice_weights = np.random.default_rng(args.seed).gamma(50.0, 1.0, args.slices)
+    slice_weights *= args.total_weight / slice_weights.sum()
+    thickness = 360.0 / args.slices
+    start = time.perf_counter()
+    portions, waste_portion, skus = mixed_portions(slice_weights, thickness, args.skus, args.quotas)
+    elapsed = time.perf_counter() - start
+    cost = mixed_plan_cost(portions, waste_portion, skus)
+    print(f"{args.slices} slices, {len(args.skus)} SKUs: planned in {elapsed * 1000:.1f} ms")
+    print(f"{cost['portions']} portions, giveaway {cost['giveaway']:.2f} g, waste {cost['waste']:.2f} g")
+    for row in cost["skus"]:
+        print(f"  {row['nominal_g']:g} g x {row['portions']}: giveaway {row['giveaway_g']:.2f} g, "
+              f"{row['compliance']['overall']}")
+    for sku in args.skus:
+        greedy, greedy_waste, _ = compute_portions(slice_weights, thickness, sku)
+        single = mixed_plan_cost(greedy, greedy_waste, [sku] * len(greedy))
+        print(f"  single {sku:g} g: giveaway + waste {single['giveaway_plus_waste']:.2f} g")
@@ -0,0 +1,133 @@
+import numpy as np
+
+from portion_engine import compute_portions, cumulative_weights
+from three_packers import get_tne
+
+# Globally optimal cut placement.
+#
+# The greedy loops cut as soon as a portion reaches the threshold, so every portion carries
+# its own overshoot and all remaining slack ends up in one waste piece. Here all cuts on the
+# loaf are chosen together. Cuts stay on slice boundaries and every portion must weigh at
+# least min_portion_weight (T1 by default, so Rules 2 and 3 cannot fail), while the loaf's
+# portions average at least the nominal weight (Rule 1).
+#
+# For a loaf, giveaway + waste = total - n * nominal, so the plan is chosen by:
+#   1. the most portions n that can satisfy the limits;
+#   2. the least total giveaway, i.e. the earliest end boundary b with cum[b] >= n * nominal
+#      (everything after b is waste);
+#   3. portions as even as possible: minimum sum of (portion - nominal)^2, solved by dynamic
+#      programming over prefix sums. Every portion weight is bounded, so each boundary only
+#      looks back over a short window of candidate boundaries.
+
+
+def _dp_boundaries(cum, n, end, nominal, lower, upper):
+    # Boundaries 0 = b0 < b1 < ... < bn = end with every portion in [lower, upper] that
+    # minimize sum((portion - nominal)^2). Returns None if no such plan exists.
+    total = cum[end]
+    prev_lo, prev_hi = 0, 0
+    prev_cost = np.zeros(1)
+    back_pointers = []
+    for k in range(1, n + 1):
+        if k == n:
+            lo, hi = end, end
+        else:
+            # Boundary k must leave room for k portions before it and n - k after it.
+            low_weight = max(k * lower, total - (n - k) * upper)
+            high_weight = min(k * upper, total - (n - k) * lower)
+            lo = int(np.searchsorted(cum, low_weight, side="left"))
+            hi = min(int(np.searchsorted(cum, high_weight, side="right")) - 1, end - 1)
+        if lo > hi:
+            return None
+        js = np.arange(lo, hi + 1)
+        # Predecessors i with lower <= cum[j] - cum[i] <= upper, within the previous layer.
+        i_lo = np.maximum(np.searchsorted(cum, cum[js] - upper, side="left"), prev_lo)
+        i_hi = np.minimum(np.searchsorted(cum, cum[js] - lower, side="right") - 1, prev_hi)
+        width = int((i_hi - i_lo).max()) + 1 if len(js) else 0
+        if width <= 0:
+            return None
+        candidates = i_lo[:, None] + np.arange(width)[None, :]
+        valid = candidates <= i_hi[:, None]
+        safe = np.where(valid, candidates, prev_lo)
+        cost = prev_cost[safe - prev_lo] + (cum[js][:, None] - cum[safe] - nominal) ** 2
+        cost = np.where(valid, cost, np.inf)
+        best = np.argmin(cost, axis=1)
+        prev_cost = cost[np.arange(len(js)), best]
+        back_pointers.append((lo, safe[np.arange(len(js)), best]))
+        prev_lo, prev_hi = lo, hi
+    if not np.isfinite(prev_cost[0]):
+        return None
+
+    boundaries = [end]
+    for lo, pointers in reversed(back_pointers):
+        boundaries.append(int(pointers[boundaries[-1] - lo]))
+    return boundaries[::-1]
+
+
+def optimal_portions(slice_weights, slice_thickness, nominal_weight, min_portion_weight=None,
+                     max_portion_weight=None, waste_at="back"):
+    # Returns (portions, waste_portion) in the same tuple format as portion_engine, with
+    # portions in increasing slice order.
+    slice_weights = np.asarray(slice_weights, dtype=np.float64)
+    n_slices = len(slice_weights)
+    weights = slice_weights[::-1] if waste_at == "front" else slice_weights
+    cum = cumulative_weights(weights)
+    total = cum[-1]
+    lower = nominal_weight - get_tne(nominal_weight) if min_portion_weight is None else min_portion_weight
+
+    # Upper bound on how many portions fit: by average weight, and by the minimum weight
+    # (greedy at the minimum gives the most portions of at least that weight).
+    greedy_min, _, _ = compute_portions(weights, slice_thickness, lower)
+    n = min(int(total // nominal_weight), len(greedy_min))
+
+    boundaries = None
+    while n > 0 and boundaries is None:
+        first_end = int(np.searchsorted(cum, n * nominal_weight, side="left"))
+        for end in dict.fromkeys((first_end, n_slices)):
+            mean = cum[end] / n
+            # Portions never need to stray further above the mean than the minimum sits below it.
+            upper = max_portion_weight if max_portion_weight is not None else 2 * mean - lower
+            boundaries = _dp_boundaries(cum, n, end, nominal_weight, lower, upper)
+            if boundaries is not None:
+                break
+        else:
+            n -= 1
+
+    if boundaries is None:
+        boundaries = [0]
+    portions = [(s, e - 1, (e - s) * slice_thickness, float(cum[e] - cum[s]))
+                for s, e in zip(boundaries[:-1], boundaries[1:])]
+    end = boundaries[-1]
+    waste_portion = (end, n_slices - 1, (n_slices - end) * slice_thickness, float(total - cum[end]))
+
+    if waste_at == "front":
+        last = n_slices - 1
+        portions = [(last - e, last - s, length, weight) for s, e, length, weight in portions][::-1]
+        waste_portion = (0, last - waste_portion[0], waste_portion[2], waste_portion[3])
+    return portions, waste_portion
+
+
+def plan_cost(portions, waste_portion, nominal_weight):
+    giveaway = sum(weight - nominal_weight for _, _, _, weight in portions)
+    waste = waste_portion[3] if waste_portion else 0.0
+    return {"portions": len(portions), "giveaway": giveaway, "waste": waste,
+            "giveaway_plus_waste": giveaway + waste}
+
+
+def compare_with_greedy(slice_weights, slice_thickness, nominal_weight, tolerance=1.0,
+                        waste_at="back", **limits):
+    # Optimal plan plus what it gains over the greedy plan with the same tolerance. Both
+    # plans have giveaway + waste = total - portions * nominal, so total_saved is just
+    # portions_gained * nominal: at the same portion count the giveaway saved goes to waste.
+    greedy, greedy_waste, _ = compute_portions(slice_weights, slice_thickness, nominal_weight,
+                                               tolerance, reverse=waste_at == "front")
+    optimal, optimal_waste = optimal_portions(slice_weights, slice_thickness, nominal_weight,
+                                              waste_at=waste_at, **limits)
+    greedy_cost = plan_cost(greedy, greedy_waste, nominal_weight)
+    optimal_cost = plan_cost(optimal, optimal_waste, nominal_weight)
+    return optimal, optimal_waste, {
+        "greedy": greedy_cost,
+        "optimal": optimal_cost,
+        "portions_gained": optimal_cost["portions"] - greedy_cost["portions"],
+        "giveaway_saved": greedy_cost["giveaway"] - optimal_cost["giveaway"],
+        "total_saved": greedy_cost["giveaway_plus_waste"] - optimal_cost["giveaway_plus_waste"],
+    }
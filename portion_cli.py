@@ -0,0 +1,157 @@
+import argparse
+import json
+import sys
+import time
+
+from density_maps import open_density_map
+from portion_pipeline import (DEFAULT_PARAMS, compare_targets, loaf_slice_weights, make_params, plan_mixed_skus,
+                               plan_portion_table, plan_report)
+
+# Headless command-line calculator for line-controller scripts.
+#
+#   python portion_cli.py --target-portion-weight 250 --seed 7
+#   python portion_cli.py --scan shift.scan --loaf 3 --output plan.json
+#   python portion_cli.py --seed 7 --density-map loaf.dmap
+#   python portion_cli.py --seed 7 --compare-targets 150 200 250
+#   python portion_cli.py --seed 7 --skus 150 200 250 --sku-quotas 2 0 100
+#   python portion_cli.py --batch < requests.jsonl > plans.jsonl
+#
+# Writes the cut plan and the Three Packers compliance of one loaf as JSON. With --batch,
+# every stdin line is a JSON request -
+#   {"params": {...}, "seed": ..., "scan": ..., "loaf": ..., "density_map": ...,
+#    "compare_targets": [...], "skus": [...], "sku_quotas": [...]}
+# (parameters may also sit at the top level) - and one JSON line is written per request,
+# an {"error": ...} line for a request that fails, so a controller pays the interpreter and
+# NumPy start-up once instead of per loaf. With compare targets the same loaf is also cut
+# at every listed target weight ("targets" in the output, see compare_targets), and with
+# SKUs it is also planned as a mix of those nominal weights ("mixed", see mixed_sku.py).
+#
+# Start-up is kept short: only NumPy and the calculation modules are imported. Nothing
+# here touches Tk, matplotlib or pandas, and scan_io is imported only when a scan is read.
+# The interpreter and NumPy take most of a cold start; use --batch to pay them once.
+
+
+def _parse_bool(text):
+    value = text.strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise argparse.ArgumentTypeError(f"expected true or false, got {text!r}")
+
+
+def add_param_arguments(parser):
+    # --params FILE plus one flag per DEFAULT_PARAMS entry (--target-portion-weight ...).
+    for name, default in DEFAULT_PARAMS.items():
+        kind = _parse_bool if isinstance(default, bool) else type(default)
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, type=kind, default=None,
+                            help=f"default: {default}")
+    parser.add_argument("--params", help="JSON file of parameters ('-' = stdin); flags override it.")
+
+
+def params_from_args(args):
+    # The parameters given on the command line, flags over the --params file.
+    params = {}
+    if args.params:
+        with (sys.stdin if args.params == "-" else open(args.params)) as f:
+            params.update(json.load(f))
+    params.update({name: getattr(args, name) for name in DEFAULT_PARAMS if getattr(args, name) is not None})
+    return params
+
+
+def _scan_loaf(path, index, params):
+    from scan_io import open_scan
+
+    loaf = open_scan(path).loaf(index)
+    params = dict(params, slice_thickness=loaf.slice_thickness or params["slice_thickness"])
+    return params, {"dims": loaf.dims, "positions": loaf.slice_positions(), "contours": loaf.contours}
+
+
+def solve(params=None, seed=None, scan=None, loaf=0, slice_weights=False, density_map=None, targets=None,
+          skus=None, sku_quotas=None):
+    # One loaf -> JSON-ready dict with the plan (slice order) and its compliance status.
+    start = time.perf_counter()
+    params = make_params(**(params or {}))
+    scan_data = {}
+    if scan:
+        params, scan_data = _scan_loaf(scan, loaf, params)
+    if density_map:
+        scan_data["density"] = open_density_map(density_map)
+    _, weights = loaf_slice_weights(params, seed, **scan_data)
+    result = {
+        "params": params,
+        "seed": seed,
+        "scan": {"file": scan, "loaf": loaf} if scan else None,
+        "density_map": density_map,
+        "slices": len(weights),
+        **plan_report(plan_portion_table(weights, params), params),
+    }
+    if targets:
+        result["targets"] = compare_targets(weights, params, targets)
+    if skus:
+        result["mixed"] = plan_mixed_skus(weights, params, skus, sku_quotas)
+    if slice_weights:
+        result["slice_weights"] = weights.tolist()
+    result["elapsed_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def _dump(result, pretty=False):
+    return json.dumps(result, indent=2 if pretty else None, default=float)
+
+
+def _run_batch(lines, output, defaults, slice_weights):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Each request must be a JSON object")
+            seed, scan, loaf = request.pop("seed", None), request.pop("scan", None), request.pop("loaf", 0)
+            density_map, targets = request.pop("density_map", None), request.pop("compare_targets", None)
+            skus, sku_quotas = request.pop("skus", None), request.pop("sku_quotas", None)
+            # Parameters may be nested under "params" or given at the top level.
+            params = dict(defaults, **request.pop("params", {}), **request)
+            result = solve(params, seed, scan, loaf, slice_weights, density_map, targets, skus, sku_quotas)
+        except (ValueError, KeyError, TypeError, OSError, IndexError) as error:
+            result = {"error": str(error), "request": line.strip()}
+        output.write(_dump(result) + "\n")
+        output.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Portion a cheese loaf and print the cut plan as JSON.")
+    add_param_arguments(parser)
+    parser.add_argument("--seed", type=int, default=None, help="Reproduce a synthetic loaf exactly.")
+    parser.add_argument("--scan", help="Recorded scan file to portion instead of a synthetic loaf.")
+    parser.add_argument("--loaf", type=int, default=0, help="Loaf index in the scan file.")
+    parser.add_argument("--density-map", help="Voxel density map (.dmap) of the loaf, see density_maps.py.")
+    parser.add_argument("--compare-targets", type=float, nargs="+", metavar="GRAMS",
+                        help="Also cut the same loaf at each of these target weights.")
+    parser.add_argument("--skus", type=float, nargs="+", metavar="GRAMS",
+                        help="Also plan the loaf as a mix of these nominal weights.")
+    parser.add_argument("--sku-quotas", type=int, nargs="+", metavar="PACKS",
+                        help="Most packs of each SKU on the loaf, in --skus order.")
+    parser.add_argument("--slice-weights", action="store_true", help="Include every slice weight.")
+    parser.add_argument("--batch", action="store_true", help="Read JSON requests from stdin, one per line.")
+    parser.add_argument("--output", help="Write to this file instead of stdout.")
+    parser.add_argument("--pretty", action="store_true")
+    args = parser.parse_args(argv)
+
+    params = params_from_args(args)
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        if args.batch:
+            _run_batch(sys.stdin, output, params, args.slice_weights)
+        else:
+            output.write(_dump(solve(params, args.seed, args.scan, args.loaf, args.slice_weights, args.density_map,
+                                     args.compare_targets, args.skus, args.sku_quotas), args.pretty) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+import numpy as np
+
+from portion_kernels import carry_over_cuts, greedy_cuts, kernel_for
+from portion_table import PortionTable
+
+# Headless portioning engine.
+#
+# Works out the same cut plans as the per-slice loops in calculate(), but from a
+# cumulative-weight array with binary search, so the cost is O(portions * log(slices))
+# instead of one Python iteration per slice.
+#
+# Every function returns (portions, waste_portion, cut_fractions):
+#   portions      - list of (start_index, end_index, portion_length, portion_weight)
+#                   in the order the original loop appends them.
+#   waste_portion - (start_index, end_index, waste_length, waste_weight) for whatever
+#                   is left once no further portion reaches the threshold.
+#   cut_fractions - fraction of the cut slice that belongs to each portion
+#                   (always 1.0 unless linear interpolation is used).
+#
+# portion_table() runs the same plans but returns a PortionTable (see portion_table.py) in
+# slice order, built straight from the cut arrays without the tuple lists.
+#
+# The loops that cannot be vectorized live in portion_kernels.py (Numba-compiled on large
+# loaves when it is installed).
+#
+# portion_tables() plans one loaf for several target weights from one cumulative array:
+# the greedy plans advance together, one searchsorted across all targets per portion, and
+# the interpolated marks of every target go into a single searchsorted.
+#
+# loaf_tables() is the other way round: several loaves cut with the same settings. Their
+# prefix sums are stacked into one sorted array of complex keys, loaf index + 1j * weight
+# (NumPy orders complex numbers by real part first), so one searchsorted serves every
+# loaf with the same float comparisons as searching each loaf on its own.
+
+
+def cumulative_weights(slice_weights):
+    # cum[k] is the weight of the first k slices, so cum[0] == 0 and cum[-1] == total.
+    slice_weights = np.asarray(slice_weights, dtype=np.float64)
+    cum = np.empty(len(slice_weights) + 1, dtype=np.float64)
+    cum[0] = 0.0
+    np.cumsum(slice_weights, out=cum[1:])
+    return cum
+
+
+def _greedy_cuts_many(cum, thresholds):
+    # greedy_cuts() for several thresholds at once: every plan takes its next cut in the
+    # same vectorized searchsorted, and plans drop out as they reach the end of the loaf.
+    # Returns one array of cut ends per threshold.
+    n = len(cum) - 1
+    active = np.arange(len(thresholds))
+    starts = np.zeros(len(thresholds), dtype=np.int64)
+    found_plans, found_ends = [], []
+    while len(active):
+        ends = np.searchsorted(cum, cum[starts] + thresholds[active], side="left")
+        fits = ends <= n
+        active, starts, ends = active[fits], starts[fits], ends[fits]
+        # Guard against the search landing on start itself for a non-positive threshold.
+        ends = np.maximum(ends, starts + 1)
+        found_plans.append(active)
+        found_ends.append(ends - 1)
+        more = ends < n
+        active, starts = active[more], ends[more]
+    return _split_plans(found_plans, found_ends, len(thresholds))
+
+
+def _split_plans(found_plans, found_ends, n_plans):
+    plans = np.concatenate(found_plans)
+    cut_ends = np.concatenate(found_ends)
+    # Stable sort by plan keeps each plan's cuts in order.
+    order = np.argsort(plans, kind="stable")
+    counts = np.bincount(plans, minlength=n_plans)
+    return np.split(cut_ends[order], np.cumsum(counts)[:-1])
+
+
+def _stacked_keys(arrays):
+    # Sorted arrays of several loaves as one sorted complex array, loaf index + 1j * value,
+    # and the offset of each loaf's first key.
+    sizes = [len(values) for values in arrays]
+    keys = np.empty(sum(sizes), dtype=np.complex128)
+    keys.real = np.repeat(np.arange(len(arrays)), sizes)
+    keys.imag = np.concatenate(arrays) if arrays else 0.0
+    return keys, np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+
+
+def _greedy_cuts_loaves(cums, thresholds):
+    # greedy_cuts() on several loaves at once, one threshold per loaf: every loaf takes its
+    # next cut in the same searchsorted over the stacked prefix sums. Returns one array of
+    # cut ends (indices within the loaf) per loaf.
+    keys, offsets = _stacked_keys(cums)
+    flat = keys.imag
+    last = offsets[1:] - 1  # key of each loaf's total, cum[n]
+    active = np.arange(len(cums))
+    starts = offsets[:-1].copy()
+    found_loaves, found_ends = [], []
+    while len(active):
+        ends = np.searchsorted(keys, active + 1j * (flat[starts] + thresholds[active]), side="left")
+        fits = ends <= last[active]
+        active, starts, ends = active[fits], starts[fits], ends[fits]
+        ends = np.maximum(ends, starts + 1)
+        found_loaves.append(active)
+        found_ends.append(ends - 1 - offsets[active])
+        more = ends < last[active]
+        active, starts = active[more], ends[more]
+    return _split_plans(found_loaves, found_ends, len(cums))
+
+
+def _forward_arrays(cum, slice_thickness, threshold, ends=None):
+    # (starts, ends, lengths, weights, waste_portion) of the forward greedy plan.
+    # ends: the plan's cut ends when they are already known (see _greedy_cuts_many).
+    n = len(cum) - 1
+    if ends is None:
+        ends = kernel_for(greedy_cuts, n)(cum, float(threshold))
+    starts = np.empty_like(ends)
+    if len(ends):
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+    weights = cum[ends + 1] - cum[starts]
+    lengths = (ends - starts + 1) * slice_thickness
+
+    waste_start = int(ends[-1]) + 1 if len(ends) else 0
+    waste = float(cum[n] - cum[waste_start])
+    waste_portion = (waste_start, n - 1, (n - waste_start) * slice_thickness, waste)
+    return starts, ends, lengths, weights, waste_portion
+
+
+def forward_portions(slice_weights, slice_thickness, threshold, cum=None):
+    # Forward greedy mode (CheesePortionCalculator): waste ends up at the back of the loaf.
+    if cum is None:
+        cum = cumulative_weights(slice_weights)
+    starts, ends, lengths, weights, waste_portion = _forward_arrays(cum, slice_thickness, threshold)
+    portions = list(zip(starts.tolist(), ends.tolist(), lengths.tolist(), weights.tolist()))
+    return portions, waste_portion, np.ones(len(portions))
+
+
+def _reverse_arrays(slice_weights, slice_thickness, threshold, cum=None, rev_cut_ends=None):
+    # Reverse greedy plan as arrays, in accumulation order (last slice first).
+    slice_weights = np.asarray(slice_weights, dtype=np.float64)
+    n = len(slice_weights)
+    if cum is None:
+        cum = cumulative_weights(slice_weights[::-1])
+    rev_starts, rev_ends, lengths, weights, rev_waste = _forward_arrays(cum, slice_thickness, threshold,
+                                                                        rev_cut_ends)
+    waste_portion = (0, n - 1 - rev_waste[0], rev_waste[2], rev_waste[3])
+    return n - 1 - rev_ends, n - 1 - rev_starts, lengths, weights, waste_portion
+
+
+def reverse_portions(slice_weights, slice_thickness, threshold, cum=None):
+    # Reverse greedy mode: accumulate from the end of the scan so waste comes from the front.
+    # Portions are returned in accumulation order (last slice first), like the loop.
+    starts, ends, lengths, weights, waste_portion = _reverse_arrays(slice_weights, slice_thickness,
+                                                                    threshold, cum)
+    portions = list(zip(starts.tolist(), ends.tolist(), lengths.tolist(), weights.tolist()))
+    return portions, waste_portion, np.ones(len(portions))
+
+
+def reverse_interpolated_portions(slice_weights, slice_thickness, threshold, cum=None):
+    # Reverse mode with linear interpolation inside the cut slice.
+    starts, ends, lengths, weights, fractions, waste_portion = _reverse_interpolated_arrays(
+        slice_weights, slice_thickness, threshold, cum)
+    portions = list(zip(starts.tolist(), ends.tolist(), lengths.tolist(), weights.tolist()))
+    return portions, waste_portion[:4], fractions
+
+
+def _interpolated_marks(total, threshold):
+    # Cumulative weight at each interpolated cut: 1, 2, 3... times the threshold.
+    n_cuts = int(total // threshold) if threshold > 0 else 0
+    return np.arange(1, n_cuts + 1, dtype=np.float64) * threshold
+
+
+def _reverse_interpolated_arrays(slice_weights, slice_thickness, threshold, cum=None, cuts=None):
+    # Every portion takes exactly `threshold` grams and the unused fraction of the cut slice
+    # carries into the next portion, so (in reversed order) the m-th cut lands where the
+    # cumulative weight first reaches m * threshold. All cuts are found in one searchsorted.
+    # Returns (starts, ends, lengths, weights, fractions, waste_portion) in accumulation
+    # order; waste_portion has its (start_offset, end_offset) appended, see portion_table.py.
+    # cuts: the searchsorted result for the marks when it is already known (the caller has
+    # then also checked that no slice is heavier than the threshold).
+    slice_weights = np.asarray(slice_weights, dtype=np.float64)
+    n = len(slice_weights)
+    rev_weights = slice_weights[::-1]
+    if cum is None:
+        cum = cumulative_weights(rev_weights)
+
+    # The carry-over argument only holds while no single slice can fill a portion by itself.
+    if cuts is None and n and threshold <= rev_weights.max():
+        kernel = kernel_for(carry_over_cuts, n)
+        loop_weights = slice_weights if kernel is not carry_over_cuts else slice_weights.tolist()
+        starts, ends, lengths, weights, fractions, waste_end, waste_length, waste = kernel(
+            loop_weights, float(slice_thickness), float(threshold))
+        remaining = 1 - float(fractions[-1]) if len(fractions) else 0.0
+        return (starts, ends, lengths, weights, fractions,
+                (0, int(waste_end), float(waste_length), float(waste), 0.0, remaining))
+
+    total = cum[n]
+    marks = _interpolated_marks(total, threshold)
+    # The loop cuts at slice k when cum[k + 1] >= mark, i.e. searchsorted on cum[1:].
+    if cuts is None:
+        cuts = np.searchsorted(cum[1:], marks, side="left")
+    cuts = cuts[cuts < n]
+    n_cuts = len(cuts)
+
+    cut_weights = rev_weights[cuts]
+    prev_weights = cum[cuts] - (marks[:n_cuts] - threshold)
+    safe = np.where(cut_weights != 0, cut_weights, 1.0)
+    fractions = np.where(cut_weights != 0, (threshold - prev_weights) / safe, 1.0)
+
+    prev_cuts = np.empty_like(cuts)
+    if n_cuts:
+        prev_cuts[0] = -1
+        prev_cuts[1:] = cuts[:-1]
+    carry_fractions = np.zeros(n_cuts)
+    carry_fractions[1:] = 1 - fractions[:-1]
+
+    weights = prev_weights + fractions * cut_weights
+    lengths = (carry_fractions + (cuts - prev_cuts - 1) + fractions) * slice_thickness
+
+    starts = n - 1 - cuts
+    ends = n - 1 - (prev_cuts + 1)
+
+    remaining = 0.0
+    if n_cuts:
+        last = int(cuts[-1])
+        remaining = 1 - float(fractions[-1])
+        waste = float(cum[n] - cum[last + 1]) + remaining * float(rev_weights[last])
+        waste_length = (remaining + (n - last - 1)) * slice_thickness
+        waste_end = n - 1 - (last + 1)
+    else:
+        waste = float(total)
+        waste_length = n * slice_thickness
+        waste_end = n - 1
+    waste_portion = (0, waste_end, waste_length, waste, 0.0, remaining)
+    return starts, ends, lengths, weights, fractions, waste_portion
+
+
+def compute_portions(slice_weights, slice_thickness, target_portion_weight, tolerance=1.0,
+                     reverse=False, linear_interpolation=False):
+    # Single entry point mirroring the calculate() options.
+    threshold = target_portion_weight * tolerance
+    if not reverse:
+        return forward_portions(slice_weights, slice_thickness, threshold)
+    if linear_interpolation:
+        return reverse_interpolated_portions(slice_weights, slice_thickness, threshold)
+    return reverse_portions(slice_weights, slice_thickness, threshold)
+
+
+def _forward_table(starts, ends, lengths, weights, waste):
+    return PortionTable.from_arrays(starts, ends, lengths, weights, waste=waste if waste[3] > 0 else None)
+
+
+def _reverse_table(starts, ends, lengths, weights, waste):
+    return PortionTable.from_arrays(starts[::-1], ends[::-1], lengths[::-1], weights[::-1],
+                                    waste=waste if waste[3] > 0 else None, waste_first=True)
+
+
+def _interpolated_table(starts, ends, lengths, weights, fractions, waste):
+    # The cut slice is shared: a portion leaves out 1 - fraction of its first slice and
+    # takes the carried remainder of the slice after its end.
+    carry = np.zeros(len(fractions))
+    carry[1:] = 1 - fractions[:-1]
+    return PortionTable.from_arrays(starts[::-1], ends[::-1], lengths[::-1], weights[::-1],
+                                    (1 - fractions)[::-1], carry[::-1],
+                                    waste=waste if waste[3] > 0 else None, waste_first=True)
+
+
+def portion_table(slice_weights, slice_thickness, target_portion_weight, tolerance=1.0,
+                  reverse=False, linear_interpolation=False):
+    # compute_portions() as a PortionTable in slice order. The waste record (first in
+    # reverse mode, last otherwise) is left out when it weighs nothing.
+    threshold = target_portion_weight * tolerance
+    if not reverse:
+        return _forward_table(*_forward_arrays(cumulative_weights(slice_weights), slice_thickness, threshold))
+    if linear_interpolation:
+        return _interpolated_table(*_reverse_interpolated_arrays(slice_weights, slice_thickness, threshold))
+    return _reverse_table(*_reverse_arrays(slice_weights, slice_thickness, threshold))
+
+
+def portion_tables(slice_weights, slice_thickness, target_portion_weights, tolerance=1.0,
+                   reverse=False, linear_interpolation=False):
+    # portion_table() for each of several target weights on the same loaf, sharing one
+    # cumulative-weight array and batching the searches across targets. Returns a list of
+    # PortionTables in the order of target_portion_weights.
+    slice_weights = np.asarray(slice_weights, dtype=np.float64)
+    thresholds = np.asarray(target_portion_weights, dtype=np.float64) * tolerance
+    if len(thresholds) == 0:
+        return []
+    cum = cumulative_weights(slice_weights[::-1] if reverse else slice_weights)
+    if not linear_interpolation or not reverse:
+        all_cut_ends = _greedy_cuts_many(cum, thresholds)
+        if not reverse:
+            return [_forward_table(*_forward_arrays(cum, slice_thickness, threshold, cut_ends))
+                    for threshold, cut_ends in zip(thresholds, all_cut_ends)]
+        return [_reverse_table(*_reverse_arrays(slice_weights, slice_thickness, threshold, cum, cut_ends))
+                for threshold, cut_ends in zip(thresholds, all_cut_ends)]
+
+    # Interpolated: the marks of every target in one search. Targets that a single slice
+    # can fill take the carry-over loop instead (see _reverse_interpolated_arrays).
+    shared = thresholds > (slice_weights.max() if len(slice_weights) else 0.0)
+    marks = [_interpolated_marks(cum[-1], threshold) if use else np.empty(0)
+             for threshold, use in zip(thresholds, shared)]
+    all_cuts = np.split(np.searchsorted(cum[1:], np.concatenate(marks), side="left"),
+                        np.cumsum([len(target_marks) for target_marks in marks])[:-1])
+    return [_interpolated_table(*_reverse_interpolated_arrays(slice_weights, slice_thickness, threshold, cum,
+                                                              cuts if use else None))
+            for threshold, cuts, use in zip(thresholds, all_cuts, shared)]
+
+
+def loaf_tables(loaves, slice_thickness, target_portion_weight, tolerance=1.0,
+                reverse=False, linear_interpolation=False):
+    # portion_table() for several loaves cut with the same settings, the searches of all
+    # loaves batched through one stacked key array (see _stacked_keys). Returns a list of
+    # PortionTables in the order of loaves.
+    loaves = [np.asarray(slice_weights, dtype=np.float64) for slice_weights in loaves]
+    if not loaves:
+        return []
+    threshold = np.float64(target_portion_weight * tolerance)
+    cums = [cumulative_weights(slice_weights[::-1] if reverse else slice_weights) for slice_weights in loaves]
+    if not linear_interpolation or not reverse:
+        all_cut_ends = _greedy_cuts_loaves(cums, np.full(len(loaves), threshold))
+        if not reverse:
+            return [_forward_table(*_forward_arrays(cum, slice_thickness, threshold, cut_ends))
+                    for cum, cut_ends in zip(cums, all_cut_ends)]
+        return [_reverse_table(*_reverse_arrays(slice_weights, slice_thickness, threshold, cum, cut_ends))
+                for slice_weights, cum, cut_ends in zip(loaves, cums, all_cut_ends)]
+
+    # Interpolated: the marks of every loaf in one search, as in portion_tables().
+    shared = [threshold > (slice_weights.max() if len(slice_weights) else 0.0) for slice_weights in loaves]
+    marks = [_interpolated_marks(cum[-1], threshold) if use else np.empty(0) for cum, use in zip(cums, shared)]
+    keys, offsets = _stacked_keys([cum[1:] for cum in cums])
+    mark_loaves = np.repeat(np.arange(len(loaves)), [len(loaf_marks) for loaf_marks in marks])
+    cuts = np.searchsorted(keys, mark_loaves + 1j * np.concatenate(marks), side="left") - offsets[mark_loaves]
+    all_cuts = np.split(cuts, np.cumsum([len(loaf_marks) for loaf_marks in marks])[:-1])
+    return [_interpolated_table(*_reverse_interpolated_arrays(slice_weights, slice_thickness, threshold, cum,
+                                                              loaf_cuts if use else None))
+            for slice_weights, cum, loaf_cuts, use in zip(loaves, cums, all_cuts, shared)]
@@ -0,0 +1,228 @@
+import os
+import time
+
+import numpy as np
+
+from portion_table import PortionTable
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # CSV export still works without pyarrow
+    pa = None
+
+# Streaming columnar export of portion plans and slice weights.
+#
+# Records for many loaves are buffered as NumPy columns and written in chunks to one file
+# per table, instead of building a list of dicts and a DataFrame per loaf:
+#   <run>_portions.<ext>       loaf, portion, start_slice, end_slice, length_mm, weight_g, is_waste
+#   <run>_slice_weights.<ext>  loaf, slice, weight_g
+# portion numbers the portions of a loaf 0, 1, ... in slice order; a waste row always
+# takes the next number (the loaf's portion count), whether the waste was cut from the
+# front or the back - its start_slice and end_slice say where it is. Rows are not sorted
+# by loaf within a file: add_batch() writes a chunk's waste rows after its portion rows.
+# Formats: "parquet" (row group per chunk), "arrow" (IPC file, record batch per chunk) and
+# "csv". Parquet and Arrow need pyarrow; CSV uses pyarrow's writer when it is installed
+# and falls back to NumPy otherwise. Excel is only used for an optional per-loaf summary.
+
+EXPORT_FORMATS = ("csv", "parquet", "arrow")
+FILE_EXTENSIONS = {"csv": "csv", "parquet": "parquet", "arrow": "arrow"}
+
+PORTION_COLUMNS = {
+    "loaf": np.int64,
+    "portion": np.int32,
+    "start_slice": np.int32,
+    "end_slice": np.int32,
+    "length_mm": np.float64,
+    "weight_g": np.float64,
+    "is_waste": np.bool_,
+}
+SLICE_COLUMNS = {
+    "loaf": np.int64,
+    "slice": np.int32,
+    "weight_g": np.float32,
+}
+CSV_FORMATS = {np.int64: "%d", np.int32: "%d", np.float64: "%.6f", np.float32: "%.4f", np.bool_: "%d"}
+
+
+class _TableWriter:
+    # Chunked writer for one table; columns arrive as NumPy arrays.
+    def __init__(self, path, columns, fmt, chunk_rows):
+        self.path = path
+        self.columns = columns
+        self.fmt = fmt
+        self.chunk_rows = chunk_rows
+        self.buffer = {name: [] for name in columns}
+        self.buffered_rows = 0
+        self.rows_written = 0
+        self._writer = None
+        self._file = None
+
+    def append(self, **arrays):
+        rows = len(next(iter(arrays.values())))
+        for name, dtype in self.columns.items():
+            self.buffer[name].append(np.asarray(arrays[name], dtype=dtype))
+        self.buffered_rows += rows
+        if self.buffered_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered_rows:
+            return
+        chunk = {name: np.concatenate(parts) for name, parts in self.buffer.items()}
+        self.buffer = {name: [] for name in self.columns}
+        self._write(chunk)
+        self.rows_written += self.buffered_rows
+        self.buffered_rows = 0
+
+    def _write(self, chunk):
+        if self.fmt == "csv" and pa is None:
+            if self._file is None:
+                self._file = open(self.path, "w", newline="")
+                self._file.write(",".join(self.columns) + "\n")
+            row_format = ",".join(CSV_FORMATS[dtype] for dtype in self.columns.values())
+            np.savetxt(self._file, np.column_stack([chunk[name] for name in self.columns]), fmt=row_format)
+            return
+
+        batch = pa.record_batch([pa.array(chunk[name]) for name in self.columns], names=list(self.columns))
+        if self._writer is None:
+            if self.fmt == "parquet":
+                self._writer = pq.ParquetWriter(self.path, batch.schema)
+            elif self.fmt == "arrow":
+                self._writer = pa.ipc.new_file(self.path, batch.schema)
+            else:
+                self._writer = pa_csv.CSVWriter(self.path, batch.schema)
+        if self.fmt == "parquet":
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class PortionExporter:
+    def __init__(self, output_dir, fmt="parquet", run_name=None, chunk_rows=1_000_000,
+                 slice_weights=True):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        if fmt != "csv" and pa is None:
+            raise ImportError(f"pyarrow is required for {fmt} export (pip install pyarrow), or use csv")
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.run_name = run_name or time.strftime("%Y%m%d-%H%M%S")
+        extension = FILE_EXTENSIONS[fmt]
+        self.portions = _TableWriter(self.path_for("portions", extension), PORTION_COLUMNS, fmt, chunk_rows)
+        self.slices = _TableWriter(self.path_for("slice_weights", extension), SLICE_COLUMNS, fmt, chunk_rows) \
+            if slice_weights else None
+        self.summary = []
+        self.next_loaf = 0
+
+    def path_for(self, table, extension):
+        return os.path.join(self.output_dir, f"{self.run_name}_{table}.{extension}")
+
+    def add_loaf(self, portions, waste_portion=None, slice_weights=None, loaf=None):
+        # portions: (start, end, length, weight) tuples in slice order; waste_portion as
+        # returned by portion_pipeline.plan_portions (None when there is no waste).
+        self.add_table(PortionTable.from_tuples(portions, waste_portion), slice_weights, loaf)
+
+    def add_table(self, table, slice_weights=None, loaf=None):
+        # One loaf's PortionTable (see portion_table.py); the waste row is written last.
+        loaf = self.next_loaf if loaf is None else loaf
+        self.next_loaf = loaf + 1
+        plan = table.valid()
+        waste = table.waste()
+        records = plan.records if waste is None else np.concatenate((plan.records, [waste]))
+        self.portions.append(
+            loaf=np.full(len(records), loaf), portion=np.arange(len(records)),
+            start_slice=records["start"], end_slice=records["end"], length_mm=records["length"],
+            weight_g=records["weight"], is_waste=records["is_waste"],
+        )
+        if self.slices is not None and slice_weights is not None:
+            self.slices.append(loaf=np.full(len(slice_weights), loaf), slice=np.arange(len(slice_weights)),
+                               weight_g=slice_weights)
+        self._summarize(np.array([loaf]), np.array([len(plan)]), plan.weight,
+                        np.array([waste["weight"] if waste is not None else 0.0]))
+
+    def add_batch(self, results, params, first_loaf=None):
+        # Whole run_batch() result in one pass: portion rows come from the padded arrays via a
+        # validity mask, then the waste rows of all loaves follow, numbered after each loaf's
+        # portions, with the slice range of the front (reverse) or back of the loaf.
+        first_loaf = self.next_loaf if first_loaf is None else first_loaf
+        counts = results["portion_count"].astype(np.int64)
+        n_loaves = len(counts)
+        self.next_loaf = first_loaf + n_loaves
+        loaf_ids = first_loaf + np.arange(n_loaves)
+        mask = np.arange(results["portion_start"].shape[1]) < counts[:, None]
+        loaf_index, portion_index = np.nonzero(mask)
+        self.portions.append(
+            loaf=loaf_ids[loaf_index], portion=portion_index,
+            start_slice=results["portion_start"][mask], end_slice=results["portion_end"][mask],
+            length_mm=results["portion_length"][mask], weight_g=results["portion_weight"][mask],
+            is_waste=np.zeros(len(loaf_index), dtype=bool),
+        )
+
+        has_waste = results["waste_weight"] > 0
+        last_slice = params["number_of_slices"] - 1
+        rows = np.arange(n_loaves)
+        if params["reverse"]:
+            waste_start = np.zeros(n_loaves, dtype=np.int64)
+            waste_end = np.where(counts > 0, results["portion_start"][:, 0] - 1, last_slice)
+        else:
+            waste_start = np.where(counts > 0, results["portion_end"][rows, np.maximum(counts - 1, 0)] + 1, 0)
+            waste_end = np.full(n_loaves, last_slice)
+        self.portions.append(
+            loaf=loaf_ids[has_waste], portion=counts[has_waste],
+            start_slice=waste_start[has_waste], end_slice=waste_end[has_waste],
+            length_mm=results["waste_length"][has_waste], weight_g=results["waste_weight"][has_waste],
+            is_waste=np.ones(int(has_waste.sum()), dtype=bool),
+        )
+
+        if self.slices is not None and "slice_weights" in results:
+            weights = results["slice_weights"]
+            n_slices = weights.shape[1]
+            for i in range(n_loaves):  # one loaf at a time keeps the id columns small
+                self.slices.append(loaf=np.full(n_slices, loaf_ids[i]), slice=np.arange(n_slices),
+                                   weight_g=weights[i])
+        self._summarize(loaf_ids, counts, results["portion_weight"][mask], results["waste_weight"])
+
+    def _summarize(self, loaf_ids, counts, weights, waste_weights):
+        # Per-loaf totals for the optional Excel summary (small: one row per loaf).
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        cum = np.concatenate(([0.0], np.cumsum(weights)))
+        sums = cum[offsets[1:]] - cum[offsets[:-1]]
+        for loaf, count, total, waste in zip(loaf_ids, counts, sums, waste_weights):
+            self.summary.append({
+                "Loaf": int(loaf),
+                "Portions": int(count),
+                "Total Portion Weight (g)": float(total),
+                "Average Portion Weight (g)": float(total / count) if count else 0.0,
+                "Waste (g)": float(waste),
+            })
+
+    def write_excel_summary(self, path=None):
+        # Optional: one row per loaf, not the full portion log. Needs pandas and openpyxl.
+        import pandas as pd
+
+        path = path or self.path_for("summary", "xlsx")
+        pd.DataFrame(self.summary).to_excel(path, index=False)
+        return path
+
+    def close(self):
+        self.portions.close()
+        if self.slices is not None:
+            self.slices.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,159 @@
+import importlib.util
+import os
+import sys
+import time
+
+import numpy as np
+
+# Serial loops of the portioning engine, compiled with Numba when it is installed.
+#
+# Both loops carry state from one cut to the next, so they do not vectorize:
+#   greedy_cuts      - forward / reverse greedy plans: one binary search per portion from
+#                      the previous cut in the cumulative-weight array.
+#   carry_over_cuts  - the reverse linear-interpolation loop of calculate(): the unused
+#                      fraction of each cut slice carries into the next portion. The engine
+#                      solves this with one searchsorted, except when a single slice is
+#                      heavier than a portion, where only the loop gives the same plan.
+# Each function is written once, in the subset of Python that Numba compiles, and is
+# ordinary Python as defined here. Importing Numba alone takes several hundred ms, more
+# than these loops need on a normal loaf, so nothing imports it up front: kernel_for()
+# hands out the compiled version only for loaves of at least JIT_MIN_SLICES slices (and
+# from then on for every loaf in the process), and only when Numba is installed and
+# CHEESE_JIT=0 is not set. Compiled versions are cached on disk (first use compiles, later
+# runs load the cache) and release the GIL, so they run in parallel on the portion_service
+# worker threads.
+#
+#   python portion_kernels.py   compares the compiled kernels with the Python ones on
+#                               random loaves and prints both timings.
+
+JIT_ENABLED = (os.environ.get("CHEESE_JIT", "1").lower() not in ("0", "false", "no", "off")
+               and importlib.util.find_spec("numba") is not None)
+KERNEL_BACKEND = "numba" if JIT_ENABLED else "python"
+JIT_MIN_SLICES = 200_000
+
+_compiled = {}
+
+
+def compiled(kernel):
+    # Numba version of a kernel, compiled or loaded from the disk cache on first use. The
+    # kernel itself when the JIT is disabled.
+    if not JIT_ENABLED:
+        return kernel
+    if kernel not in _compiled:
+        from numba import njit
+
+        _compiled[kernel] = njit(cache=True, nogil=True)(kernel)
+    return _compiled[kernel]
+
+
+def kernel_for(kernel, n_slices):
+    # The version of a kernel to run on a loaf of n_slices slices.
+    if kernel in _compiled or (JIT_ENABLED and n_slices >= JIT_MIN_SLICES):
+        return compiled(kernel)
+    return kernel
+
+
+def greedy_cuts(cum, threshold):
+    # Index of the last slice of each greedy portion. After every cut the accumulator is
+    # reset to zero, so each cut is one binary search from the previous cut.
+    n = len(cum) - 1
+    cut_ends = np.empty(n, dtype=np.int64)
+    count = 0
+    start = 0
+    while start < n:
+        j = int(np.searchsorted(cum, cum[start] + threshold))
+        if j > n:
+            break
+        # Guard against the search landing on start itself for a non-positive threshold.
+        j = max(j, start + 1)
+        cut_ends[count] = j - 1
+        count += 1
+        start = j
+    return cut_ends[:count]
+
+
+def carry_over_cuts(slice_weights, slice_thickness, threshold):
+    # Reverse interpolated plan, slice by slice from the end of the loaf. Returns
+    # (starts, ends, lengths, weights, fractions) in accumulation order and the waste left
+    # at the front as (waste_end, waste_length, waste_weight). slice_weights may be a list
+    # when the loop runs as Python (about three times faster than over an array).
+    n = len(slice_weights)
+    starts = np.empty(n, dtype=np.int64)
+    ends = np.empty(n, dtype=np.int64)
+    lengths = np.empty(n, dtype=np.float64)
+    weights = np.empty(n, dtype=np.float64)
+    fractions = np.empty(n, dtype=np.float64)
+    count = 0
+    current_weight = 0.0
+    current_length = 0.0
+    current_end_index = n - 1
+    for i in range(n - 1, -1, -1):
+        weight = slice_weights[i]
+        prev_weight = current_weight
+        prev_length = current_length
+        current_weight += weight
+        current_length += slice_thickness
+        if current_weight >= threshold:
+            overshoot = current_weight - threshold
+            fraction = (weight - overshoot) / weight if weight != 0 else 1.0
+            starts[count] = i
+            ends[count] = current_end_index
+            lengths[count] = prev_length + fraction * slice_thickness
+            weights[count] = prev_weight + fraction * weight
+            fractions[count] = fraction
+            count += 1
+            remaining_fraction = 1 - fraction
+            current_weight = remaining_fraction * weight
+            current_length = remaining_fraction * slice_thickness
+            current_end_index = i - 1
+    return (starts[:count], ends[:count], lengths[:count], weights[:count], fractions[:count],
+            current_end_index, current_length, current_weight)
+
+
+def _same(a, b):
+    return all(np.array_equal(x, y) for x, y in zip(a, b))
+
+
+def check_kernels(trials=200, max_slices=5000, seed=0):
+    # Compiled vs Python results on random loaves, including thresholds below the heaviest
+    # slice and zero-weight slices. Returns the number of mismatching trials.
+    rng = np.random.default_rng(seed)
+    mismatches = 0
+    for _ in range(trials):
+        n = int(rng.integers(0, max_slices))
+        slice_weights = rng.gamma(2.0, 1.0, n) * rng.uniform(0.1, 10.0)
+        slice_weights[rng.random(n) < 0.02] = 0.0
+        threshold = float(rng.uniform(0.5, 3.0) * (slice_weights.max() if n else 1.0))
+        thickness = float(rng.uniform(0.01, 1.0))
+        cum = np.concatenate(([0.0], np.cumsum(slice_weights)))
+        if not np.array_equal(compiled(greedy_cuts)(cum, threshold), greedy_cuts(cum, threshold)):
+            mismatches += 1
+        elif not _same(compiled(carry_over_cuts)(slice_weights, thickness, threshold),
+                       carry_over_cuts(slice_weights, thickness, threshold)):
+            mismatches += 1
+    return mismatches
+
+
+def _main():
+    print(f"Kernels: {KERNEL_BACKEND}")
+    mismatches = check_kernels()
+    print(f"Random trials with differences: {mismatches}")
+    slice_weights = np.random.default_rng(1).gamma(50.0, 0.015, 500_000)
+    cum = np.concatenate(([0.0], np.cumsum(slice_weights)))
+    for name, kernel, args in (("greedy_cuts", greedy_cuts, (cum, 250.0)),
+                               ("carry_over_cuts", carry_over_cuts, (slice_weights, 0.0007, 250.0))):
+        compiled(kernel)(*args)  # compile / load the cache outside the timing
+        timings = []
+        for label, func in (("compiled", compiled(kernel)), ("python", kernel)):
+            start = time.perf_counter()
+            func(*args)
+            timings.append(f"{label} {(time.perf_counter() - start) * 1000:.2f} ms")
+        print(f"{name:16} 500k slices: " + ", ".join(timings))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    # Run from the imported module: Numba's disk cache is keyed to the module name.
+    import portion_kernels
+
+    sys.exit(portion_kernels._main())
@@ -0,0 +1,195 @@
+import numpy as np
+
+from cross_sections import polygon_areas, profile_contours
+from density_maps import DensityMap
+from loaf_generator import generate_dimensions
+from mixed_sku import mixed_plan_cost, mixed_portions
+from optimal_cuts import optimal_portions
+from portion_engine import loaf_tables, portion_table, portion_tables
+from portion_table import PortionTable
+from three_packers import check_batch
+from volume_integration import density_and_slice_weights
+
+# Headless version of calculate(): the same steps without Tk variables or module globals,
+# so a loaf can be portioned from scripts, worker processes and services.
+
+# Parameter names and defaults mirror the GUI inputs. Tolerance is a fraction (0.999),
+# not the slider percentage.
+DEFAULT_PARAMS = {
+    "total_weight": 3330.0,
+    "slice_thickness": 0.1,
+    "target_portion_weight": 250.0,
+    "average_width": 93.0,
+    "average_height": 90.0,
+    "number_of_slices": 3600,
+    "tolerance": 1.0,
+    "include_waste": False,
+    "reverse": True,                 # waste at the front, as in the interpolation build
+    "linear_interpolation": False,
+    "optimal": False,                # place all cuts together, see optimal_cuts.py
+    "integration_method": "trapezoid",
+    "width_std": 2.0,
+    "height_std": 2.0,
+    "noise": "iid",
+    "corner_radius": 0.0,            # mm; with crown > 0 slices are rounded profiles, not
+    "crown": 0.0,                    # width * height rectangles (see cross_sections.py)
+    "profile_points": 64,
+}
+
+
+def make_params(**overrides):
+    unknown = set(overrides) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    params = dict(DEFAULT_PARAMS)
+    params.update(overrides)
+    return params
+
+
+def loaf_slice_weights(params, seed=None, dims=None, positions=None, contours=None, density=None):
+    # Synthetic (or supplied, e.g. scanned) slice dimensions -> (dims, slice_weights).
+    # positions: measured slice positions in mm for uneven spacing (see scan_io.py).
+    # contours: (slices, points, 2) profiles; their polygon areas replace width * height.
+    # density: relative density of each slice, or a DensityMap whose mass per mm along the
+    # loaf replaces area x uniform density (see density_maps.py). Either way the slice
+    # weights still add up to total_weight.
+    if dims is None:
+        dims = generate_dimensions(params["number_of_slices"], params["average_width"],
+                                   params["average_height"], params["width_std"],
+                                   params["height_std"], seed=seed, noise=params["noise"])
+    if contours is None and (params["corner_radius"] or params["crown"]):
+        contours = profile_contours(dims, params["corner_radius"], params["crown"], params["profile_points"])
+    areas = polygon_areas(contours) if contours is not None else dims[:, 0] * dims[:, 1]
+    if isinstance(density, DensityMap):
+        areas = density.slice_profile(len(areas), params["slice_thickness"], positions)
+    elif density is not None:
+        areas = areas * np.asarray(density, dtype=np.float64)
+    _, _, slice_weights = density_and_slice_weights(
+        areas, params["total_weight"], params["slice_thickness"], params["integration_method"], positions=positions
+    )
+    return dims, slice_weights
+
+
+def plan_portion_table(slice_weights, params):
+    # Cut plan as a PortionTable in slice order, waste record first in reverse mode and
+    # last otherwise (see portion_table.py). There is no waste record when nothing is left.
+    if params["optimal"]:
+        portions, waste_portion = optimal_portions(
+            slice_weights, params["slice_thickness"], params["target_portion_weight"],
+            waste_at="front" if params["reverse"] else "back",
+        )
+        table = PortionTable.from_tuples(portions, waste_portion if waste_portion[3] > 0 else None,
+                                         waste_first=params["reverse"])
+    else:
+        table = portion_table(
+            slice_weights, params["slice_thickness"], params["target_portion_weight"],
+            params["tolerance"], reverse=params["reverse"],
+            linear_interpolation=params["linear_interpolation"],
+        )
+
+    # Optionally, redistribute waste over the portions (weight and proportional length).
+    if params["include_waste"]:
+        table = table.redistribute_waste()
+    return table
+
+
+def plan_target_tables(slice_weights, params, targets):
+    # plan_portion_table() for several target weights on the same loaf, one PortionTable
+    # per target. The engine shares one cumulative-weight array and batches the searches
+    # across targets; optimal plans are still solved one target at a time.
+    if params["optimal"]:
+        return [plan_portion_table(slice_weights, dict(params, target_portion_weight=target)) for target in targets]
+    tables = portion_tables(slice_weights, params["slice_thickness"], targets, params["tolerance"],
+                            reverse=params["reverse"], linear_interpolation=params["linear_interpolation"])
+    if params["include_waste"]:
+        tables = [table.redistribute_waste() for table in tables]
+    return tables
+
+
+def plan_loaf_tables(loaves, params):
+    # plan_portion_table() for several loaves with the same parameters, one PortionTable per
+    # loaf. The engine searches all loaves together; optimal plans are solved one by one.
+    if params["optimal"]:
+        return [plan_portion_table(slice_weights, params) for slice_weights in loaves]
+    tables = loaf_tables(loaves, params["slice_thickness"], params["target_portion_weight"], params["tolerance"],
+                         reverse=params["reverse"], linear_interpolation=params["linear_interpolation"])
+    if params["include_waste"]:
+        tables = [table.redistribute_waste() for table in tables]
+    return tables
+
+
+def compare_targets(slice_weights, params, targets):
+    # One row per target weight: portion count, mean weight, giveaway over the target,
+    # waste and the Three Packers status of the portions, all from the same loaf.
+    total_weight = float(np.sum(slice_weights))
+    rows = []
+    for target, table in zip(targets, plan_target_tables(slice_weights, params, targets)):
+        weights = table.valid().weight
+        waste = table.waste()
+        waste_weight = 0.0 if waste is None else float(waste["weight"])
+        rows.append({
+            "target_g": float(target),
+            "portions": len(weights),
+            "mean_g": float(weights.mean()) if len(weights) else None,
+            "giveaway_g": float(np.sum(weights - target)),
+            "waste_g": waste_weight,
+            "waste_pct": 100 * waste_weight / total_weight if total_weight else 0.0,
+            "compliance": check_batch(weights, target),
+        })
+    return rows
+
+
+def plan_mixed_skus(slice_weights, params, skus, quotas=None):
+    # Cut plan mixing several nominal weights on one loaf (see mixed_sku.py), JSON-ready:
+    # portions in slice order with their SKU, the waste piece and the per-SKU status.
+    portions, waste_portion, nominal = mixed_portions(
+        slice_weights, params["slice_thickness"], skus, quotas, params["tolerance"],
+        waste_at="front" if params["reverse"] else "back",
+    )
+    cost = mixed_plan_cost(portions, waste_portion, nominal)
+    return {
+        "portions": [{"start_slice": start, "end_slice": end, "length_mm": length, "weight_g": weight, "sku_g": sku}
+                     for (start, end, length, weight), sku in zip(portions, nominal)],
+        "waste": None if waste_portion[3] <= 0 else {
+            "start_slice": waste_portion[0], "end_slice": waste_portion[1],
+            "length_mm": waste_portion[2], "weight_g": waste_portion[3],
+        },
+        "giveaway_g": cost["giveaway"],
+        "waste_g": cost["waste"],
+        "skus": cost["skus"],
+    }
+
+
+def plan_portions(slice_weights, params):
+    # Returns (portions, waste_portion) with portions in increasing slice order.
+    # waste_portion is None when nothing is left over.
+    table = plan_portion_table(slice_weights, params)
+    return table.valid().as_tuples(), table.waste_tuple()
+
+
+def plan_report(table, params):
+    # JSON-ready cut plan (slice order) and Three Packers status, for the CLI and service.
+    portions = table.valid()
+    records = portions.records
+    waste = table.waste()
+    return {
+        "portions": [
+            {"start_slice": start, "end_slice": end, "start_offset": start_offset, "end_offset": end_offset,
+             "length_mm": length, "weight_g": weight}
+            for start, end, start_offset, end_offset, length, weight in zip(
+                records["start"].tolist(), records["end"].tolist(), records["start_offset"].tolist(),
+                records["end_offset"].tolist(), records["length"].tolist(), records["weight"].tolist())
+        ],
+        "waste": None if waste is None else {
+            "start_slice": int(waste["start"]), "end_slice": int(waste["end"]),
+            "length_mm": float(waste["length"]), "weight_g": float(waste["weight"]),
+        },
+        "compliance": check_batch(portions.weight, params["target_portion_weight"]),
+    }
+
+
+def simulate_loaf(params, seed=None):
+    # One synthetic loaf end to end: (slice_weights, portions, waste_portion).
+    _, slice_weights = loaf_slice_weights(params, seed)
+    portions, waste_portion = plan_portions(slice_weights, params)
+    return slice_weights, portions, waste_portion
@@ -0,0 +1,160 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+
+# Persistent renderer for the loaf portioning visualization.
+#
+# The figure and its artists are created once and updated in place on every Calculate:
+#   - all portions are drawn by a single PolyCollection instead of one patch each, with
+#     the rectangle vertices built as one array;
+#   - portion labels come from a fixed pool of text artists, and at most max_labels
+#     portions are labelled (evenly spread) however many portions there are;
+#   - the slice height trace is min/max decimated, so the drawn line has a bounded
+#     number of points while still showing every peak and dip of the raw trace.
+# Redraw time and memory therefore stay flat from thousands to millions of slices.
+#
+# With headless=True the figure is a plain Agg Figure outside pyplot, which is safe to
+# render from a worker thread (see image_export.py).
+
+
+def decimate_minmax(x, y, max_points):
+    # Keeps the minimum and maximum of each of max_points // 2 buckets, in slice order.
+    # Every bucket's envelope is preserved exactly, so the drawn trace never misses a
+    # peak; the only error is in x, by at most one bucket width.
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n <= max_points:
+        return x, y
+    buckets = max(1, max_points // 2)
+    per_bucket = -(-n // buckets)
+    padded = np.concatenate((y, np.full(buckets * per_bucket - n, y[-1])))
+    blocks = padded.reshape(buckets, per_bucket)
+    base = np.arange(buckets) * per_bucket
+    lows = np.minimum(base + blocks.argmin(axis=1), n - 1)
+    highs = np.minimum(base + blocks.argmax(axis=1), n - 1)
+    index = np.sort(np.stack((lows, highs), axis=1), axis=1).ravel()
+    index = np.unique(np.concatenate(([0], index, [n - 1])))
+    return x[index], y[index]
+
+
+class PortionRenderer:
+    def __init__(self, title, xlabel, ylabel, figsize=(12, 8), equal_aspect=False,
+                 max_labels=60, max_trace_points=4000, headless=False):
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.figsize = figsize
+        self.equal_aspect = equal_aspect
+        self.max_labels = max_labels
+        self.max_trace_points = max_trace_points
+        self.headless = headless
+        self.figure = None
+
+    def _build(self):
+        # (Re)create the figure, e.g. on first use or after its window was closed.
+        if self.headless:
+            self.figure = Figure(figsize=self.figsize)
+            FigureCanvasAgg(self.figure)
+            self.ax = self.figure.add_subplot()
+        else:
+            if self.figure is not None:
+                plt.close(self.figure)
+            self.figure, self.ax = plt.subplots(figsize=self.figsize)
+        ax = self.ax
+        self.loaf_patch = ax.add_patch(Rectangle((0, 0), 0, 0, edgecolor="black", facecolor="lightblue"))
+        self.portion_collection = ax.add_collection(PolyCollection([], edgecolor="black", alpha=0.7))
+        (self.trace_line,) = ax.plot([], [], linestyle="--", color="purple", label="Real Height Variation")
+        self.reference_lines = []
+        self.labels = [
+            ax.text(0, 0, "", ha="center", va="center", fontsize=8, rotation=90, visible=False)
+            for _ in range(self.max_labels)
+        ]
+        self.footer = ax.text(0, 0, "", ha="center", va="top", fontsize=12, color="black")
+        ax.set_title(self.title, fontsize=14)
+        ax.set_xlabel(self.xlabel, fontsize=12)
+        ax.set_ylabel(self.ylabel, fontsize=12)
+        ax.grid(True)
+        if self.equal_aspect:
+            ax.set_aspect("equal", adjustable="box")
+
+    def update(self, lengths, heights, colors, labels, loaf_height, trace=None,
+               reference_lines=(), footer=None, footer_y=None):
+        # lengths/heights/colors/labels: one entry per portion, drawn left to right.
+        # trace: optional (x, y) raw height trace. reference_lines: (y, color, linestyle, label).
+        if self.figure is None or (not self.headless and not plt.fignum_exists(self.figure.number)):
+            self._build()
+        ax = self.ax
+        lengths = np.asarray(lengths, dtype=np.float64)
+        heights = np.asarray(heights, dtype=np.float64)
+        lefts = np.concatenate(([0.0], np.cumsum(lengths)[:-1])) if len(lengths) else lengths
+        total_length = float(lengths.sum())
+
+        self.loaf_patch.set_width(total_length)
+        self.loaf_patch.set_height(loaf_height)
+        rights = lefts + lengths
+        zeros = np.zeros_like(lefts)
+        corners = np.stack((np.stack((lefts, zeros), axis=1), np.stack((rights, zeros), axis=1),
+                            np.stack((rights, heights), axis=1), np.stack((lefts, heights), axis=1)), axis=1)
+        self.portion_collection.set_verts(corners)
+        self.portion_collection.set_facecolor(list(colors))
+
+        # Label at most max_labels portions, evenly spread along the loaf.
+        shown = np.unique(np.linspace(0, len(lengths) - 1, min(len(lengths), self.max_labels)).astype(int)) \
+            if len(lengths) else []
+        for text, idx in zip(self.labels, shown):
+            text.set_position((lefts[idx] + lengths[idx] / 2, heights[idx] / 2))
+            text.set_text(labels[idx])
+            text.set_visible(True)
+        for text in self.labels[len(shown):]:
+            text.set_visible(False)
+
+        if trace is not None:
+            self.trace_line.set_data(*decimate_minmax(trace[0], trace[1], self.max_trace_points))
+            self.trace_line.set_label("Real Height Variation")
+            self.trace_line.set_visible(True)
+        else:
+            self.trace_line.set_data([], [])
+            self.trace_line.set_label("_hidden")
+            self.trace_line.set_visible(False)
+
+        # Reuse the horizontal reference lines, adding more only if needed.
+        while len(self.reference_lines) < len(reference_lines):
+            self.reference_lines.append(ax.axhline(0))
+        for line, (y, color, linestyle, label) in zip(self.reference_lines, reference_lines):
+            line.set_ydata([y, y])
+            line.set_color(color)
+            line.set_linestyle(linestyle)
+            line.set_label(label)
+            line.set_visible(True)
+        for line in self.reference_lines[len(reference_lines):]:
+            line.set_visible(False)
+            line.set_label("_hidden")
+
+        self.footer.set_text(footer or "")
+        self.footer.set_position((total_length / 2, footer_y if footer_y is not None else 0))
+
+        top = max([loaf_height, float(heights.max()) if len(heights) else 0.0]
+                  + ([float(np.max(trace[1]))] if trace is not None and len(trace[1]) else [])
+                  + [y for y, _, _, _ in reference_lines])
+        bottom = min([0.0, footer_y if footer_y is not None else 0.0] + [y for y, _, _, _ in reference_lines])
+        ax.set_xlim(0, max(total_length, 1e-9) * 1.02)
+        ax.set_ylim(bottom - 0.05 * (top - bottom), top + 0.1 * (top - bottom))
+        if any(not artist.get_label().startswith("_") for artist in [self.trace_line] + self.reference_lines):
+            ax.legend(loc="upper left")
+        elif ax.get_legend() is not None:
+            ax.get_legend().remove()
+        if not self.headless:
+            self.figure.canvas.draw_idle()
+        return self.figure
+
+    def savefig(self, path, **kwargs):
+        self.figure.savefig(path, **kwargs)
+
+    def close(self):
+        if self.figure is not None and not self.headless:
+            plt.close(self.figure)
+        self.figure = None
@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from portion_pipeline import loaf_slice_weights, make_params, plan_loaf_tables, plan_portion_table, plan_report
+
+# Local portioning service for line controllers.
+#
+# A small HTTP/1.1 server on asyncio (TCP on localhost, or a Unix socket), keep-alive and
+# no dependencies beyond NumPy:
+#   POST /portion  JSON body {"params": {...}, "dims": [[w, h], ...]} - or "areas": [...]
+#                  instead of dims, optional "positions" (mm), "contours" and per-slice
+#                  relative "density" (see density_maps.py); without scan data a
+#                  synthetic loaf is generated from "seed" - or a binary body
+#                  (Content-Type: application/octet-stream) of little-endian float32 (width,
+#                  height) pairs, parameters in the X-Portion-Params header as JSON.
+#                  Returns plan_report() JSON: portions, waste and compliance, or 400 with
+#                  {"error": ...} for a body that does not describe a loaf.
+#   GET  /health   {"status": "ok"}
+#   GET  /stats    request and batch counters
+#
+# Requests that queue up while the workers are busy (plus, with a batch window, those that
+# arrive within batch_window seconds of the first) are grouped into one micro-batch and
+# handed to the worker pool as a single job, so the event loop only moves bytes: decoding,
+# the vectorized engine (portion_engine via portion_pipeline) and JSON encoding all run on
+# the workers. NumPy releases the GIL in the heavy array work. The loaves of a batch that
+# share their parameters are planned together, one stacked search for all of them (see
+# loaf_tables() in portion_engine.py), and each response is sent as soon as its report is
+# encoded. A bad body fails only its own request.
+#
+# service_loadgen.py is a matching load generator that reports latency percentiles.
+
+DEFAULT_PORT = 8765
+DEFAULT_BATCH_WINDOW = 0.002
+DEFAULT_MAX_BATCH = 64
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+def decode_request(content_type, params_header, body):
+    # HTTP body -> (params, seed, loaf_slice_weights keyword arguments).
+    if content_type.startswith("application/octet-stream"):
+        params = json.loads(params_header) if params_header else {}
+        if not isinstance(params, dict):
+            raise ValueError("X-Portion-Params must be a JSON object")
+        dims = np.frombuffer(body, dtype="<f4").reshape(-1, 2)
+        return params, None, _check_loaf({"dims": dims})
+    request = json.loads(body) if body else {}
+    if not isinstance(request, dict) or not isinstance(request.get("params", {}), dict):
+        raise ValueError("Request body must be a JSON object")
+    scan = {}
+    if "contours" in request:
+        scan["contours"] = np.asarray(request["contours"], dtype=np.float64)
+    if "dims" in request:
+        scan["dims"] = np.asarray(request["dims"], dtype=np.float64).reshape(-1, 2)
+    elif "areas" in request:
+        # Areas alone: a width of 1 makes width * height the area itself.
+        areas = np.asarray(request["areas"], dtype=np.float64)
+        scan["dims"] = np.column_stack((np.ones_like(areas), areas))
+    if "positions" in request:
+        scan["positions"] = np.asarray(request["positions"], dtype=np.float64)
+    if "density" in request:
+        scan["density"] = np.asarray(request["density"], dtype=np.float64)
+    return request.get("params", {}), request.get("seed"), _check_loaf(scan)
+
+
+def _check_loaf(scan):
+    # Scan data must describe at least one slice and some cross-section to weigh.
+    if "dims" in scan:
+        dims = scan["dims"]
+        if not len(dims):
+            raise ValueError("The loaf has no slices")
+        if not np.all(np.isfinite(dims)) or np.sum(dims[:, 0] * dims[:, 1]) <= 0:
+            raise ValueError("Slice dimensions must be finite with a positive total area")
+    if "contours" in scan and (scan["contours"].ndim != 3 or not len(scan["contours"])):
+        raise ValueError("contours must be a (slices, points, 2) array")
+    return scan
+
+
+def load_request(content_type, params_header, body):
+    # HTTP body -> (params, slice weights) of the loaf to plan.
+    params, seed, scan = decode_request(content_type, params_header, body)
+    params = make_params(**params)
+    if not params["slice_thickness"] > 0:
+        raise ValueError("slice_thickness must be positive")
+    _, weights = loaf_slice_weights(params, seed, **scan)
+    return params, weights
+
+
+def _response(table, weights, params):
+    report = plan_report(table, params)
+    report["slices"] = len(weights)
+    return 200, json.dumps(report, default=float).encode()
+
+
+def _error_response(error):
+    return 400, json.dumps({"error": f"{type(error).__name__}: {error}"}).encode()
+
+
+def solve_request(content_type, params_header, body):
+    # One request -> (status, JSON bytes). Runs on a worker thread.
+    try:
+        params, weights = load_request(content_type, params_header, body)
+        return _response(plan_portion_table(weights, params), weights, params)
+    except Exception as error:  # whatever the body, only this request fails
+        return _error_response(error)
+
+
+def solve_batch(requests, done=None):
+    # A whole micro-batch in one worker job: every loaf is decoded and weighed, then the
+    # loaves with the same parameters are planned together by plan_loaf_tables(). Same
+    # results as solve_request() one by one; done(index, result) is called as each
+    # response is encoded.
+    results = [None] * len(requests)
+
+    def finish(index, result):
+        results[index] = result
+        if done is not None:
+            done(index, result)
+
+    groups = {}
+    for index, request in enumerate(requests):
+        try:
+            params, weights = load_request(*request)
+        except Exception as error:
+            finish(index, _error_response(error))
+            continue
+        groups.setdefault(json.dumps(params, sort_keys=True, default=str), []).append((index, params, weights))
+
+    for loaves in groups.values():
+        try:
+            tables = plan_loaf_tables([weights for _, _, weights in loaves], loaves[0][1])
+        except Exception:  # plan the group one loaf at a time so only the bad one fails
+            tables = [None] * len(loaves)
+        for (index, params, weights), table in zip(loaves, tables):
+            try:
+                finish(index, _response(plan_portion_table(weights, params) if table is None else table,
+                                        weights, params))
+            except Exception as error:
+                finish(index, _error_response(error))
+    return results
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+class PortionService:
+    def __init__(self, batch_window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_MAX_BATCH, workers=None):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="portion-worker")
+        self.queue = None
+        self.servers = []
+        self.stats = {"requests": 0, "batches": 0, "errors": 0, "largest_batch": 0}
+        self._batcher = None
+        self._slots = None
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        self.queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._batcher = asyncio.create_task(self._batch_loop())
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            self.servers.append(await asyncio.start_unix_server(self._handle, path=unix_path))
+        else:
+            self.servers.append(await asyncio.start_server(self._handle, host, port))
+        return self
+
+    async def close(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        if self._batcher is not None:
+            self._batcher.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def serve_forever(self):
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    async def submit(self, content_type, params_header, body):
+        # Queue one request for the next micro-batch; resolves to (status, JSON bytes).
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((content_type, params_header, body), future))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()  # at most one batch per worker in flight
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            # Collect what arrives within the window, up to max_batch requests.
+            while len(batch) < self.max_batch:
+                while not self.queue.empty() and len(batch) < self.max_batch:
+                    batch.append(self.queue.get_nowait())
+                remaining = deadline - loop.time()
+                if remaining <= 0 or len(batch) >= self.max_batch:
+                    break
+                await asyncio.sleep(min(remaining, 0.0005))
+            asyncio.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        try:
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            loop = asyncio.get_running_loop()
+
+            def done(index, result):  # worker thread: hand the response back as it is ready
+                loop.call_soon_threadsafe(_resolve, batch[index][1], result)
+
+            try:
+                await loop.run_in_executor(self.executor, solve_batch, [request for request, _ in batch], done)
+            except Exception as error:  # the executor itself failed; never leave a client waiting
+                for _, future in batch:
+                    _resolve(future, (400, json.dumps({"error": str(error)}).encode()))
+        finally:
+            self._slots.release()
+
+    async def _route(self, method, path, headers, body):
+        if path == "/portion":
+            if method != "POST":
+                return 405, b'{"error": "use POST"}'
+            self.stats["requests"] += 1
+            status, payload = await self.submit(headers.get("content-type", "application/json"),
+                                                headers.get("x-portion-params"), body)
+            if status != 200:
+                self.stats["errors"] += 1
+            return status, payload
+        if path == "/health":
+            return 200, b'{"status": "ok"}'
+        if path == "/stats":
+            return 200, json.dumps(self.stats).encode()
+        return 404, b'{"error": "not found"}'
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self._route(method, path.split("?", 1)[0], headers, body)
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                             % (status, REASONS[status].encode(), len(payload)) + payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _main(args):
+    service = await PortionService(args.batch_window / 1000, args.max_batch, args.workers).start(
+        args.host, args.port, args.unix)
+    where = args.unix or f"http://{args.host}:{args.port}"
+    print(f"Portioning service on {where} ({service.workers} workers, {args.batch_window} ms batches)", flush=True)
+    try:
+        await service.serve_forever()
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve cut plans to line controllers over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="Listen on this Unix socket instead of TCP.")
+    parser.add_argument("--batch-window", type=float, default=DEFAULT_BATCH_WINDOW * 1000,
+                        help="Micro-batch window in milliseconds.")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
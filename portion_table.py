@@ -0,0 +1,144 @@
+import numpy as np
+
+# Compact container for one loaf's cut plan.
+#
+# Instead of a list of (start, end, length, weight) tuples plus a separate waste tuple, a
+# plan is one NumPy structured array in slice order (33 bytes per portion, against roughly
+# 150-200 for a tuple of Python numbers and its list slot). The waste piece, if any, is the
+# first record (reverse mode) or the last one (forward mode), flagged with is_waste, so the
+# valid portions are always a contiguous slice and valid() is a view, not a copy.
+#
+# Fractional offsets record partial slices from linear interpolation: a record covers
+#   [start + start_offset, end + 1 + end_offset)
+# in slice units, i.e. it leaves out start_offset of slice `start` and takes end_offset of
+# slice end + 1. Both are 0 for cuts on slice boundaries.
+
+PORTION_DTYPE = np.dtype([
+    ("start", np.int32),
+    ("end", np.int32),
+    ("start_offset", np.float32),
+    ("end_offset", np.float32),
+    ("length", np.float64),
+    ("weight", np.float64),
+    ("is_waste", np.bool_),
+])
+
+
+class PortionTable:
+    __slots__ = ("records",)
+
+    def __init__(self, records):
+        self.records = records
+
+    @classmethod
+    def from_arrays(cls, starts, ends, lengths, weights, start_offsets=None, end_offsets=None,
+                    waste=None, waste_first=False):
+        # Portions in slice order; waste: (start, end, length, weight[, start_offset, end_offset])
+        # or None, stored before the portions when waste_first else after them.
+        n = len(starts)
+        has_waste = waste is not None
+        records = np.zeros(n + has_waste, dtype=PORTION_DTYPE)
+        body = records[1:] if has_waste and waste_first else records[:n]
+        body["start"] = starts
+        body["end"] = ends
+        body["length"] = lengths
+        body["weight"] = weights
+        if start_offsets is not None:
+            body["start_offset"] = start_offsets
+        if end_offsets is not None:
+            body["end_offset"] = end_offsets
+        if has_waste:
+            record = records[0] if waste_first else records[n]
+            start, end, length, weight, *offsets = waste
+            record["start"], record["end"], record["length"], record["weight"] = start, end, length, weight
+            if offsets:
+                record["start_offset"], record["end_offset"] = offsets
+            record["is_waste"] = True
+        return cls(records)
+
+    @classmethod
+    def from_tuples(cls, portions, waste_portion=None, waste_first=False):
+        # portions: (start, end, length, weight) tuples in slice order.
+        plan = np.array(portions, dtype=np.float64).reshape(-1, 4)
+        return cls.from_arrays(plan[:, 0], plan[:, 1], plan[:, 2], plan[:, 3],
+                               waste=waste_portion, waste_first=waste_first)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PortionTable(self.records[index])
+        return self.records[index]
+
+    # Field views (no copies).
+    @property
+    def start(self):
+        return self.records["start"]
+
+    @property
+    def end(self):
+        return self.records["end"]
+
+    @property
+    def length(self):
+        return self.records["length"]
+
+    @property
+    def weight(self):
+        return self.records["weight"]
+
+    @property
+    def is_waste(self):
+        return self.records["is_waste"]
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+    @property
+    def waste_first(self):
+        return bool(len(self.records) and self.records["is_waste"][0])
+
+    def valid(self):
+        # The portions without the waste record, as a view.
+        records = self.records
+        lo = 1 if len(records) and records["is_waste"][0] else 0
+        hi = len(records) - 1 if len(records) > lo and records["is_waste"][-1] else len(records)
+        return PortionTable(records[lo:hi])
+
+    def waste(self):
+        # The waste record, or None.
+        records = self.records
+        if len(records) and records["is_waste"][0]:
+            return records[0]
+        if len(records) and records["is_waste"][-1]:
+            return records[-1]
+        return None
+
+    def redistribute_waste(self):
+        # New table with the waste weight spread evenly over the portions, each portion's
+        # length growing in proportion to its weight. The waste record is kept.
+        table = PortionTable(self.records.copy())
+        waste = table.waste()
+        portions = table.valid().records
+        if waste is None or not len(portions):
+            return table
+        extra = waste["weight"] / len(portions)
+        weights = portions["weight"]
+        portions["length"] += np.where(weights > 0, extra / np.where(weights > 0, weights, 1.0), 0.0) \
+            * portions["length"]
+        portions["weight"] += extra
+        return table
+
+    def as_tuples(self):
+        # (start, end, length, weight) tuples, for the GUIs and older callers.
+        records = self.records
+        return list(zip(records["start"].tolist(), records["end"].tolist(),
+                        records["length"].tolist(), records["weight"].tolist()))
+
+    def waste_tuple(self):
+        waste = self.waste()
+        if waste is None:
+            return None
+        return int(waste["start"]), int(waste["end"]), float(waste["length"]), float(waste["weight"])
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from portion_pipeline import loaf_slice_weights, make_params, plan_portions
+from three_packers import check_batch
+
+# Persistent, content-addressed cache of cut plans and compliance summaries.
+#
+# Keys are SHA-256 hashes of every input (parameters, seed) plus the bytes of any scan data,
+# so a result is only reused for exactly the same problem. Entries live in a SQLite file:
+#   - WAL mode and a busy timeout make it safe for several processes to share one file;
+#   - each entry records its size and last access time, and the least recently used
+#     entries are evicted once the file holds more than max_bytes of results;
+#   - a small in-process LRU of pickled entries in front of SQLite serves repeated hits
+#     without touching disk (each hit unpickles a fresh copy, so callers may modify it).
+#     It holds at most memory_bytes of pickles; larger entries are only kept on disk.
+#     Access times for hits are written back in batches, not on every hit.
+# Bump CACHE_VERSION when the portioning algorithms change to ignore older entries.
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(inputs, *arrays):
+    # inputs: dict of JSON-able values; arrays: scan data (dimensions, areas, weights...).
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"version": CACHE_VERSION, "inputs": inputs}, sort_keys=True, default=float).encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path, max_bytes=DEFAULT_CACHE_BYTES, memory_bytes=DEFAULT_MEMORY_BYTES, touch_batch=64):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.touch_batch = touch_batch
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, blob):
+        self._forget(key)
+        if len(blob) > self.memory_bytes:
+            return
+        self._memory[key] = blob
+        self._memory_size += len(blob)
+        while self._memory_size > self.memory_bytes:
+            self._memory_size -= len(self._memory.popitem(last=False)[1])
+
+    def _forget(self, key):
+        blob = self._memory.pop(key, None)
+        if blob is not None:
+            self._memory_size -= len(blob)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._touched[key] = time.time()
+                self.hits += 1
+                return pickle.loads(self._memory[key])
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            blob = row[0]
+            self._remember(key, blob)
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched()
+            self.hits += 1
+            return pickle.loads(blob)
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+            self._remember(key, blob)
+            self._flush_touched()
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def warm(self, jobs):
+        # jobs: iterable of (key, compute) pairs; computes and stores only what is missing.
+        computed = 0
+        for key, compute in jobs:
+            if not self.contains(key):
+                self.put(key, compute())
+                computed += 1
+        return computed
+
+    def contains(self, key):
+        with self._lock:
+            if key in self._memory:
+                return True
+            return self._db.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+
+    def invalidate(self, key=None):
+        # Drops one entry, or everything when key is None.
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+                self._memory_size = 0
+                self._touched.clear()
+                self._db.execute("DELETE FROM results")
+            else:
+                self._forget(key)
+                self._touched.pop(key, None)
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE results SET last_access = ? WHERE key = ?",
+                                 [(when, key) for key, when in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the budget so eviction does not run on every put.
+        excess = total - int(self.max_bytes * 0.9)
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            freed = 0
+            for key, size in self._db.execute("SELECT key, size FROM results ORDER BY last_access").fetchall():
+                if freed >= excess:
+                    break
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._forget(key)
+                freed += size
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": entries, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def solve_loaf(params, seed=None, dims=None):
+    # Cut plan and compliance summary for one loaf (the value stored in the cache).
+    dims, slice_weights = loaf_slice_weights(params, seed, dims)
+    portions, waste_portion = plan_portions(slice_weights, params)
+    return {
+        "dims": dims,
+        "slice_weights": slice_weights,
+        "portions": portions,
+        "waste_portion": waste_portion,
+        "compliance": check_batch([weight for _, _, _, weight in portions], params["target_portion_weight"]),
+    }
+
+
+def cached_solve_loaf(cache, params=None, seed=None, dims=None):
+    # A loaf without a seed or scan data is random every time, so it is never cached.
+    params = make_params(**(params or {}))
+    if seed is None and dims is None:
+        return solve_loaf(params)
+    key = cache_key({"params": params, "seed": seed}, *([] if dims is None else [dims]))
+    return cache.get_or_compute(key, lambda: solve_loaf(params, seed, dims))
+
+
+def warm_cache(cache, param_sets, seeds):
+    # Pre-computes every (parameter set, seed) combination the planning team re-runs.
+    jobs = []
+    for overrides in param_sets:
+        params = make_params(**overrides)
+        for seed in seeds:
+            key = cache_key({"params": params, "seed": seed})
+            jobs.append((key, lambda params=params, seed=seed: solve_loaf(params, seed)))
+    return cache.warm(jobs)
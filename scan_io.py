@@ -0,0 +1,275 @@
+import argparse
+import itertools
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+from cross_sections import contour_dims, polygon_areas
+from volume_integration import density_and_slice_weights, positions_from_timestamps
+
+# Laser-scanner cross-section files, read through numpy.memmap.
+#
+# A scan file holds the profiles of one or more loaves (e.g. a whole shift). All data is
+# little-endian and every block starts on a 64-byte boundary, so each block maps straight
+# onto a NumPy array without parsing or copying:
+#
+#   offset 0   header, 64 bytes: struct "<8sIIQQdI" + zero padding
+#                magic           b"CHSCAN01"
+#                version         uint32 (1)
+#                flags           uint32 bit 0 = positions block, bit 1 = timestamps block,
+#                                       bit 2 = dims are float64 (otherwise float32),
+#                                       bit 3 = contours block
+#                n_loaves        uint64
+#                n_slices        uint64 total over all loaves
+#                slice_thickness float64 nominal thickness in mm (0 = use positions)
+#                contour_points  uint32 points per contour (0 without contours)
+#   block 1    loaf offsets, uint64[n_loaves + 1]: loaf i is slices offsets[i]:offsets[i+1]
+#   block 2    dims, float32/float64[n_slices, 2]: (width, height) per slice in mm
+#   block 3    positions, float64[n_slices] in mm along the loaf        (if flag bit 0)
+#   block 4    timestamps, float64[n_slices] in seconds                 (if flag bit 1)
+#   block 5    contours, float32[n_slices, contour_points, 2] (x, y) in mm (if flag bit 3)
+#
+# With contours, the dims block holds each contour's bounding box and areas come from the
+# polygons (see cross_sections.py). Files without contours have zero padding where
+# contour_points is, so they read the same as before.
+#
+# ScanWriter streams loaves into per-block temporary files and joins them on close, so a
+# converter never needs the whole shift in memory.
+
+MAGIC = b"CHSCAN01"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQdI")
+HEADER_SIZE = 64
+ALIGNMENT = 64
+FLAG_POSITIONS = 1
+FLAG_TIMESTAMPS = 2
+FLAG_FLOAT64_DIMS = 4
+FLAG_CONTOURS = 8
+BLOCKS = ("dims", "positions", "timestamps", "contours")
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _block_offsets(flags, n_loaves, n_slices, contour_points=0):
+    # Byte offset of each block, in file order.
+    dims_itemsize = 8 if flags & FLAG_FLOAT64_DIMS else 4
+    offsets = {"loaf_offsets": HEADER_SIZE}
+    offset = _align(HEADER_SIZE + 8 * (n_loaves + 1))
+    offsets["dims"] = offset
+    offset = _align(offset + dims_itemsize * 2 * n_slices)
+    if flags & FLAG_POSITIONS:
+        offsets["positions"] = offset
+        offset = _align(offset + 8 * n_slices)
+    if flags & FLAG_TIMESTAMPS:
+        offsets["timestamps"] = offset
+        offset = _align(offset + 8 * n_slices)
+    if flags & FLAG_CONTOURS:
+        offsets["contours"] = offset
+        offset = _align(offset + 4 * 2 * contour_points * n_slices)
+    offsets["end"] = offset
+    return offsets
+
+
+class ScanLoaf:
+    # Zero-copy views of one loaf's profiles.
+    def __init__(self, dims, positions, timestamps, slice_thickness, contours=None):
+        self.dims = dims
+        self.positions = positions
+        self.timestamps = timestamps
+        self.slice_thickness = slice_thickness
+        self.contours = contours
+
+    def __len__(self):
+        return len(self.dims)
+
+    @property
+    def areas(self):
+        if self.contours is not None:
+            return polygon_areas(self.contours)
+        return self.dims[:, 0] * self.dims[:, 1]
+
+    def slice_positions(self, belt_speed=None):
+        # Measured positions, or positions from timestamps and belt speed (mm/s), or None.
+        if self.positions is not None:
+            return self.positions
+        if self.timestamps is not None and belt_speed is not None:
+            return positions_from_timestamps(self.timestamps, belt_speed)
+        return None
+
+    def slice_weights(self, total_weight, method="trapezoid", belt_speed=None, dtype=np.float64):
+        # Same step as the synthetic path: (total_volume, density, slice_weights).
+        return density_and_slice_weights(self.areas, total_weight, self.slice_thickness or None, method,
+                                         positions=self.slice_positions(belt_speed), dtype=dtype)
+
+
+class ScanFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, flags, n_loaves, n_slices, slice_thickness, contour_points = \
+                HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a cheese scan file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported scan file version {version}")
+        self.flags = flags
+        self.n_loaves = n_loaves
+        self.n_slices = n_slices
+        self.slice_thickness = slice_thickness
+        self.contour_points = contour_points
+        offsets = _block_offsets(flags, n_loaves, n_slices, contour_points)
+        dims_dtype = np.dtype("<f8") if flags & FLAG_FLOAT64_DIMS else np.dtype("<f4")
+        self.loaf_offsets = np.memmap(path, np.dtype("<u8"), "r", offsets["loaf_offsets"], (n_loaves + 1,))
+        self.dims = np.memmap(path, dims_dtype, "r", offsets["dims"], (n_slices, 2)) if n_slices else \
+            np.empty((0, 2), dims_dtype)
+        self.positions = np.memmap(path, np.dtype("<f8"), "r", offsets["positions"], (n_slices,)) \
+            if flags & FLAG_POSITIONS and n_slices else None
+        self.timestamps = np.memmap(path, np.dtype("<f8"), "r", offsets["timestamps"], (n_slices,)) \
+            if flags & FLAG_TIMESTAMPS and n_slices else None
+        self.contours = np.memmap(path, np.dtype("<f4"), "r", offsets["contours"], (n_slices, contour_points, 2)) \
+            if flags & FLAG_CONTOURS and n_slices else None
+
+    def __len__(self):
+        return self.n_loaves
+
+    def loaf(self, index):
+        if not 0 <= index < self.n_loaves:
+            raise IndexError(f"Loaf {index} out of range (file has {self.n_loaves})")
+        start, stop = int(self.loaf_offsets[index]), int(self.loaf_offsets[index + 1])
+        return ScanLoaf(
+            self.dims[start:stop],
+            self.positions[start:stop] if self.positions is not None else None,
+            self.timestamps[start:stop] if self.timestamps is not None else None,
+            self.slice_thickness,
+            self.contours[start:stop] if self.contours is not None else None,
+        )
+
+    def __iter__(self):
+        return (self.loaf(i) for i in range(self.n_loaves))
+
+
+def open_scan(path):
+    return ScanFile(path)
+
+
+class ScanWriter:
+    def __init__(self, path, slice_thickness=0.0, positions=False, timestamps=False, dtype=np.float32,
+                 contour_points=0):
+        self.path = path
+        self.slice_thickness = float(slice_thickness)
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.flags = (FLAG_POSITIONS if positions else 0) | (FLAG_TIMESTAMPS if timestamps else 0) \
+            | (FLAG_FLOAT64_DIMS if self.dtype.itemsize == 8 else 0) | (FLAG_CONTOURS if contour_points else 0)
+        self.contour_points = int(contour_points)
+        self.loaf_offsets = [0]
+        self._temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+        self._blocks = {name: open(os.path.join(self._temp_dir, name), "wb")
+                        for name in BLOCKS}
+
+    def add_loaf(self, dims=None, positions=None, timestamps=None, contours=None):
+        # dims may be omitted when contours are given: their bounding boxes are stored.
+        if (positions is not None) != bool(self.flags & FLAG_POSITIONS) or \
+                (timestamps is not None) != bool(self.flags & FLAG_TIMESTAMPS) or \
+                (contours is not None) != bool(self.flags & FLAG_CONTOURS):
+            raise ValueError("Positions/timestamps/contours must match the writer's settings")
+        if contours is not None:
+            contours = np.asarray(contours)
+            if contours.shape[1:] != (self.contour_points, 2):
+                raise ValueError(f"Contours must have shape (slices, {self.contour_points}, 2)")
+            self._blocks["contours"].write(np.ascontiguousarray(contours, dtype="<f4").tobytes())
+            if dims is None:
+                dims = contour_dims(contours)
+        dims = np.asarray(dims)
+        self._blocks["dims"].write(np.ascontiguousarray(dims, dtype=self.dtype).tobytes())
+        if positions is not None:
+            self._blocks["positions"].write(np.ascontiguousarray(positions, dtype="<f8").tobytes())
+        if timestamps is not None:
+            self._blocks["timestamps"].write(np.ascontiguousarray(timestamps, dtype="<f8").tobytes())
+        self.loaf_offsets.append(self.loaf_offsets[-1] + len(dims))
+
+    def close(self):
+        for block in self._blocks.values():
+            block.close()
+        n_loaves = len(self.loaf_offsets) - 1
+        n_slices = self.loaf_offsets[-1]
+        offsets = _block_offsets(self.flags, n_loaves, n_slices, self.contour_points)
+        try:
+            with open(self.path, "wb") as out:
+                out.write(HEADER.pack(MAGIC, VERSION, self.flags, n_loaves, n_slices, self.slice_thickness,
+                                      self.contour_points).ljust(HEADER_SIZE, b"\0"))
+                out.write(np.asarray(self.loaf_offsets, dtype="<u8").tobytes())
+                for name in BLOCKS:
+                    if name in offsets:
+                        out.write(b"\0" * (offsets[name] - out.tell()))
+                        with open(os.path.join(self._temp_dir, name), "rb") as block:
+                            shutil.copyfileobj(block, out, 16 * 1024 * 1024)
+                out.write(b"\0" * (offsets["end"] - out.tell()))
+        finally:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def convert_csv(csv_path, scan_path, slice_thickness=0.0, chunk_rows=1_000_000, dtype=np.float32):
+    # CSV export -> scan file. Columns (header row required): width, height, and optionally
+    # loaf (a new loaf starts whenever it changes), position and timestamp. Parsed in chunks
+    # of chunk_rows lines, so the CSV never has to fit in memory.
+    with open(csv_path, "r", newline="") as f:
+        header = [name.strip().lower() for name in f.readline().split(",")]
+        missing = {"width", "height"} - set(header)
+        if missing:
+            raise ValueError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+        column = {name: i for i, name in enumerate(header)}
+        has_positions = "position" in column
+        has_timestamps = "timestamp" in column
+        current = None
+        pending = []  # chunks of the loaf being read
+        with ScanWriter(scan_path, slice_thickness, has_positions, has_timestamps, dtype) as writer:
+            def emit(parts):
+                rows = np.concatenate(parts)
+                writer.add_loaf(rows[:, [column["width"], column["height"]]],
+                                rows[:, column["position"]] if has_positions else None,
+                                rows[:, column["timestamp"]] if has_timestamps else None)
+
+            while True:
+                lines = list(itertools.islice(f, chunk_rows))
+                if not lines:
+                    break
+                rows = np.loadtxt(lines, delimiter=",", ndmin=2)
+                if "loaf" not in column:
+                    pending.append(rows)
+                    continue
+                loaf_ids = rows[:, column["loaf"]]
+                breaks = np.flatnonzero(np.diff(loaf_ids)) + 1
+                for part, loaf_id in zip(np.split(rows, breaks), loaf_ids[np.concatenate(([0], breaks))]):
+                    if current is not None and loaf_id != current:
+                        emit(pending)
+                        pending = []
+                    pending.append(part)
+                    current = loaf_id
+            if pending:
+                emit(pending)
+    return ScanFile(scan_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a scanner CSV export to a memory-mapped scan file.")
+    parser.add_argument("csv")
+    parser.add_argument("output")
+    parser.add_argument("--slice-thickness", type=float, default=0.0,
+                        help="Nominal slice thickness in mm (leave 0 when the CSV has positions).")
+    parser.add_argument("--float64", action="store_true", help="Store widths/heights as float64.")
+    args = parser.parse_args()
+
+    scan = convert_csv(args.csv, args.output, args.slice_thickness,
+                       dtype=np.float64 if args.float64 else np.float32)
+    print(f"{args.output}: {scan.n_loaves} loaves, {scan.n_slices} slices")
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from loaf_generator import generate_loaves
+from portion_service import DEFAULT_BATCH_WINDOW, DEFAULT_PORT
+
+# Load generator for portion_service.py.
+#
+# Sends loaf scans at a fixed average rate with Poisson arrivals over a pool of keep-alive
+# connections. Latency is measured from each request's scheduled send time, so a stalled
+# service shows up in the percentiles instead of silently lowering the offered load.
+#
+#   python service_loadgen.py --spawn --rate 300 --duration 10
+#
+# --spawn starts the service in a child process for the run; otherwise it targets a
+# running one (--port or --unix). Exits non-zero when p99 exceeds --p99-target.
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def request(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, await self.reader.readexactly(length)
+
+    def close(self):
+        self.writer.close()
+
+
+async def _connect(host, port, unix_path):
+    if unix_path:
+        return _Connection(*await asyncio.open_unix_connection(unix_path))
+    return _Connection(*await asyncio.open_connection(host, port))
+
+
+def _http(method, path, body=b"", content_type="application/json", extra_headers=""):
+    return (f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\n"
+            f"{extra_headers}Content-Length: {len(body)}\r\n\r\n").encode() + body
+
+
+def make_payloads(count, n_slices, params=None, binary=False, seed=0):
+    # Ready-to-send POST /portion requests for `count` different synthetic loaves.
+    loaves = generate_loaves(count, n_slices, 93.0, 90.0, seed=seed, dtype=np.float32)
+    params = params or {}
+    if binary:
+        header = f"X-Portion-Params: {json.dumps(params)}\r\n"
+        return [_http("POST", "/portion", dims.astype("<f4").tobytes(), "application/octet-stream", header)
+                for dims in loaves]
+    return [_http("POST", "/portion", json.dumps({"params": params, "dims": dims.tolist()}).encode())
+            for dims in loaves]
+
+
+async def run_load(payloads, rate, duration, connections=32, host="127.0.0.1", port=DEFAULT_PORT,
+                   unix_path=None, seed=0):
+    loop = asyncio.get_running_loop()
+    pool = asyncio.Queue()
+    for _ in range(connections):
+        pool.put_nowait(await _connect(host, port, unix_path))
+    latencies = []
+    errors = 0
+
+    async def send(scheduled, payload):
+        nonlocal errors
+        connection = await pool.get()
+        try:
+            status, _ = await connection.request(payload)
+            if status != 200:
+                errors += 1
+        finally:
+            pool.put_nowait(connection)
+        latencies.append(loop.time() - scheduled)
+
+    rng = np.random.default_rng(seed)
+    tasks = []
+    start = loop.time()
+    scheduled = start
+    while scheduled < start + duration:
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(scheduled, payloads[len(tasks) % len(payloads)])))
+        scheduled += rng.exponential(1.0 / rate)
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    stats_connection = await pool.get()
+    _, stats = await stats_connection.request(_http("GET", "/stats"))
+    while not pool.empty():
+        pool.get_nowait().close()
+    stats_connection.close()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rate": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p90_ms": float(np.percentile(latencies_ms, 90)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+        "service": json.loads(stats),
+    }
+
+
+async def _wait_for_service(host, port, unix_path, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = await _connect(host, port, unix_path)
+            status, _ = await connection.request(_http("GET", "/health"))
+            connection.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("Service did not start")
+        await asyncio.sleep(0.05)
+
+
+async def _main(args):
+    payloads = make_payloads(args.loaves, args.slices, binary=args.binary)
+    child = None
+    if args.spawn:
+        command = [sys.executable, "portion_service.py", "--port", str(args.port),
+                   "--batch-window", str(args.batch_window)]
+        if args.unix:
+            command += ["--unix", args.unix]
+        if args.workers:
+            command += ["--workers", str(args.workers)]
+        child = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        await _wait_for_service(args.host, args.port, args.unix)
+        if args.warmup:
+            await run_load(payloads, args.rate, args.warmup, args.connections, args.host, args.port, args.unix)
+        return await run_load(payloads, args.rate, args.duration, args.connections, args.host, args.port,
+                              args.unix)
+    finally:
+        if child is not None:
+            child.terminate()
+            child.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure portion_service.py latency under load.")
+    parser.add_argument("--rate", type=float, default=300.0, help="Loaves per second (average).")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of measured load.")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds of unmeasured load first.")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--slices", type=int, default=3600)
+    parser.add_argument("--loaves", type=int, default=64, help="Distinct loaves to cycle through.")
+    parser.add_argument("--binary", action="store_true", help="Send float32 bodies instead of JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="Unix socket path of the service.")
+    parser.add_argument("--spawn", action="store_true", help="Start the service for the run.")
+    parser.add_argument("--batch-window", type=float, default=DEFAULT_BATCH_WINDOW * 1000,
+                        help="With --spawn, in milliseconds.")
+    parser.add_argument("--workers", type=int, default=None, help="With --spawn.")
+    parser.add_argument("--p99-target", type=float, default=10.0, help="Milliseconds.")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["p99_ms"] <= args.p99_target and not report["errors"] else 1)
@@ -0,0 +1,75 @@
+import tkinter as tk
+from tkinter import ttk
+
+# Rolling run statistics window for the calculators (see instrumentation.py).
+#
+# One row per pipeline stage with its last, mean and 95th percentile wall time, mean CPU
+# time and largest peak allocation over the recent runs, plus the counts of the last run.
+# The checkbox switches the instrumentation on and off; the table refreshes whenever a
+# run finishes (runs finish on the Tk thread, in show_results).
+
+COLUMNS = (
+    ("stage", "Stage", 110),
+    ("runs", "Runs", 50),
+    ("last", "Last (ms)", 80),
+    ("mean", "Mean (ms)", 80),
+    ("p95", "P95 (ms)", 80),
+    ("cpu", "CPU (ms)", 80),
+    ("peak", "Peak (KiB)", 90),
+)
+
+
+class StatsPanel(tk.Toplevel):
+    def __init__(self, master, instrumentation, title="Run Statistics"):
+        super().__init__(master)
+        self.title(title)
+        self.instrumentation = instrumentation
+
+        toolbar = ttk.Frame(self)
+        toolbar.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.enabled_var = tk.BooleanVar(value=instrumentation.enabled)
+        ttk.Checkbutton(toolbar, text="Record stage timings", variable=self.enabled_var,
+                        command=lambda: instrumentation.enable(self.enabled_var.get())).pack(side=tk.LEFT)
+        ttk.Button(toolbar, text="Clear", command=self._clear).pack(side=tk.RIGHT)
+
+        self.tree = ttk.Treeview(self, columns=[name for name, _, _ in COLUMNS], show="headings", height=10)
+        for name, heading, width in COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, anchor=tk.W if name == "stage" else tk.E)
+        self.tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5)
+        self.last_run_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self.last_run_var).pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+
+        instrumentation.listeners.append(self._on_record)
+        self.protocol("WM_DELETE_WINDOW", self._close)
+        self.refresh()
+
+    def _on_record(self, record):
+        self.refresh()
+
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        for row in self.instrumentation.summary():
+            peak = "-" if row["peak_bytes"] is None else f"{row['peak_bytes'] / 1024:.0f}"
+            self.tree.insert("", tk.END, values=(
+                row["stage"], row["runs"], f"{row['last_s'] * 1000:.2f}", f"{row['mean_s'] * 1000:.2f}",
+                f"{row['p95_s'] * 1000:.2f}", f"{row['cpu_mean_s'] * 1000:.2f}", peak,
+            ))
+        history = self.instrumentation.history
+        if history:
+            last = history[-1]
+            counts = ", ".join(f"{name} {value}" for name, value in last["counts"].items())
+            self.last_run_var.set(f"Last run: {last['total_s'] * 1000:.1f} ms" + (f" ({counts})" if counts else ""))
+        elif not self.instrumentation.enabled:
+            self.last_run_var.set("Timings are off - tick the box and press Calculate.")
+        else:
+            self.last_run_var.set("No runs recorded yet.")
+
+    def _clear(self):
+        self.instrumentation.reset()
+        self.refresh()
+
+    def _close(self):
+        if self._on_record in self.instrumentation.listeners:
+            self.instrumentation.listeners.remove(self._on_record)
+        self.destroy()
@@ -0,0 +1,166 @@
+import math
+
+import numpy as np
+
+# Streaming forward portioner.
+#
+# Consumes cross-sections one at a time (from a generator, a socket reader, ...) as the
+# scanner produces them and yields every cut the moment it becomes final, so the slicer
+# can run directly behind the scanner. State and per-slice work are O(1): the only
+# look-ahead ever needed is the slice currently being scanned, because a cut inside a
+# slice (interpolated) or at its far edge (greedy) depends on nothing after it.
+#
+# Yields (start_index, end_index, portion_length, portion_weight, is_waste).
+#
+# waste_at="back"  - same plan as the forward greedy loop; the remainder is yielded last.
+# waste_at="front" - the waste is cut off the front of the loaf first, as in the reverse
+#                    plans. The stream cannot see the rest of the loaf, so:
+#                    interpolated - needs the loaf weight up front (expected_total_weight,
+#                      e.g. from the checkweigher): every portion takes exactly the
+#                      threshold, so the offcut is expected_total_weight - n * threshold;
+#                    greedy - greedy portions overshoot, so the offcut depends on the whole
+#                      profile: expected_slice_weights (e.g. from a pre-scan) gives the
+#                      reverse greedy plan, and the stream cuts at its slice boundaries.
+#                    Any difference between the expected and scanned loaf shows up as a
+#                    trailing remainder, also yielded as waste.
+#
+# check_streams() compares the streamed plans with portion_engine on random loaves.
+
+
+def stream_portions(cross_sections, slice_thickness, threshold, density=None, waste_at="back",
+                    expected_total_weight=None, interpolate=False, expected_slice_weights=None):
+    # With a density (g/mm^3) the items are cross-sectional areas (mm^2); without one
+    # they are already slice weights (g).
+    if waste_at not in ("back", "front"):
+        raise ValueError("waste_at must be 'back' or 'front'")
+    if threshold <= 0:
+        raise ValueError("threshold must be positive")
+    if waste_at == "front" and not interpolate:
+        if expected_slice_weights is None:
+            raise ValueError("waste_at='front' without interpolation needs expected_slice_weights")
+        yield from _stream_planned(cross_sections, slice_thickness, threshold, density, expected_slice_weights)
+        return
+
+    mark = threshold
+    leading_waste = False
+    if waste_at == "front":
+        if expected_total_weight is None:
+            raise ValueError("waste_at='front' needs expected_total_weight to size the offcut")
+        offcut = expected_total_weight - math.floor(expected_total_weight / threshold) * threshold
+        if offcut > 1e-9 * threshold:
+            mark = offcut
+            leading_waste = True
+
+    weight_scale = slice_thickness * density if density is not None else None
+    current_weight = 0.0
+    current_length = 0.0
+    start_index = 0
+    i = -1
+
+    for i, value in enumerate(cross_sections):
+        weight = float(value) * weight_scale if weight_scale is not None else float(value)
+        remaining_weight = weight
+        remaining_fraction = 1.0
+
+        while current_weight + remaining_weight >= mark:
+            if interpolate and weight > 0:
+                # Take just enough of this slice to reach the mark; the rest carries on.
+                fraction = (mark - current_weight) / weight
+                yield (start_index, i, float(current_length + fraction * slice_thickness),
+                       float(current_weight + fraction * weight), leading_waste)
+                remaining_weight -= fraction * weight
+                remaining_fraction -= fraction
+                start_index = i
+            else:
+                yield (start_index, i, float(current_length + remaining_fraction * slice_thickness),
+                       float(current_weight + remaining_weight), leading_waste)
+                remaining_weight = 0.0
+                remaining_fraction = 0.0
+                start_index = i + 1
+            current_weight = 0.0
+            current_length = 0.0
+            mark = threshold
+            leading_waste = False
+            if remaining_fraction <= 0.0:
+                break
+
+        current_weight += remaining_weight
+        current_length += remaining_fraction * slice_thickness
+
+    # Whatever is left once the scan ends could not make a full portion, unless it only
+    # missed the mark by rounding (the declared total and the scanned sum agree). A sliver
+    # left over by rounding after the last interpolated cut is not a piece at all.
+    rounding = 1e-9 * threshold
+    if current_weight > rounding or current_length > 1e-9 * slice_thickness:
+        is_waste = leading_waste or current_weight < mark - rounding
+        yield (start_index, i, float(current_length), float(current_weight), is_waste)
+
+
+def _stream_planned(cross_sections, slice_thickness, threshold, density, expected_slice_weights):
+    # Greedy portions with the waste at the front: the cuts of the reverse greedy plan on
+    # the expected profile, taken in slice order. Per slice this is O(1); the plan itself
+    # holds one index per portion.
+    from portion_engine import reverse_portions
+
+    portions, waste_portion, _ = reverse_portions(expected_slice_weights, slice_thickness, threshold)
+    # Last slice of each piece in slice order, waste first when there is any.
+    cut_ends = [end for _, end, _, _ in reversed(portions)]
+    if waste_portion[1] >= 0:
+        cut_ends.insert(0, waste_portion[1])
+    leading_waste = waste_portion[1] >= 0
+
+    weight_scale = slice_thickness * density if density is not None else None
+    next_cut = 0
+    current_weight = 0.0
+    start_index = 0
+    i = -1
+    for i, value in enumerate(cross_sections):
+        current_weight += float(value) * weight_scale if weight_scale is not None else float(value)
+        if next_cut < len(cut_ends) and i == cut_ends[next_cut]:
+            yield (start_index, i, (i + 1 - start_index) * slice_thickness, float(current_weight),
+                   leading_waste)
+            leading_waste = False
+            next_cut += 1
+            current_weight = 0.0
+            start_index = i + 1
+
+    # A loaf shorter or longer than expected leaves a remainder; it is waste.
+    if start_index <= i:
+        yield (start_index, i, (i + 1 - start_index) * slice_thickness, float(current_weight), True)
+
+
+def check_streams(trials=200, seed=0):
+    # Streamed plans vs portion_engine on random loaves: forward greedy (waste at the back),
+    # reverse greedy and reverse interpolated (waste at the front). Interpolated pieces are
+    # compared by weight only: the stream counts the cut slice in both pieces it is shared
+    # by, the engine in the first. Returns the number of mismatching trials.
+    from portion_engine import forward_portions, reverse_interpolated_portions, reverse_portions
+
+    rng = np.random.default_rng(seed)
+    mismatches = 0
+    for _ in range(trials):
+        slice_weights = rng.normal(0.925, 0.05, int(rng.integers(100, 4000)))
+        thickness = float(rng.uniform(0.05, 0.5))
+        threshold = float(rng.uniform(50, 300))
+        total = float(slice_weights.sum())
+        for engine, kwargs, same_slices in (
+            (forward_portions, {}, True),
+            (reverse_portions, {"waste_at": "front", "expected_slice_weights": slice_weights}, True),
+            (reverse_interpolated_portions, {"waste_at": "front", "expected_total_weight": total,
+                                             "interpolate": True}, False),
+        ):
+            portions, waste_portion, _ = engine(slice_weights, thickness, threshold)
+            streamed = list(stream_portions(slice_weights, thickness, threshold, **kwargs))
+            expected = sorted((start, end, weight) for start, end, _, weight in portions)
+            got = [(start, end, weight) for start, end, _, weight, is_waste in streamed if not is_waste]
+            waste = sum(weight for _, _, _, weight, is_waste in streamed if is_waste)
+            if (len(got) != len(expected)
+                    or not np.allclose([row[2] for row in got], [row[2] for row in expected])
+                    or (same_slices and [row[:2] for row in got] != [row[:2] for row in expected])
+                    or not math.isclose(waste, waste_portion[3], abs_tol=1e-6)):
+                mismatches += 1
+    return mismatches
+
+
+if __name__ == "__main__":
+    print(f"Random trials with differences: {check_streams()}")
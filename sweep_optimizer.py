@@ -0,0 +1,193 @@
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+from batch_simulator import loaf_rng
+from portion_engine import _reverse_interpolated_arrays, cumulative_weights
+from portion_pipeline import loaf_slice_weights, make_params
+from three_packers import T1_ALLOWED_FRACTION, tolerance_limits
+
+# Tolerance / target sweep optimizer.
+#
+# Evaluates a grid of (interpolation on/off, tolerance, target offset) settings over many
+# simulated loaves and picks the setting with the lowest giveaway per pack that still
+# passes the Three Packers Rules at the chosen confidence.
+#
+# Each loaf's cumulative-weight array is built once and shared by every grid point:
+#   - greedy cuts advance all thresholds together, one vectorized searchsorted per portion;
+#   - interpolated cuts take exactly the threshold every time, so only the portion count
+#     floor(total / threshold) is needed - except for thresholds no heavier than the
+#     heaviest slice, where the carry-over loop cuts at most once per slice; those go
+#     through the engine (portion_engine._reverse_interpolated_arrays).
+# Only the modes asked for (interpolation on and/or off) are computed.
+# Loaves are spread over a process pool and only small per-grid-point totals come back.
+
+ACCUMULATORS = ("count", "weight_sum", "weight_sq_sum", "t1_count", "t2_count", "waste_sum")
+
+
+def _empty_totals(n_points):
+    return {name: np.zeros(n_points) for name in ACCUMULATORS}
+
+
+def _greedy_totals(cum, thresholds, t1_limit, t2_limit, totals):
+    n = len(cum) - 1
+    idx = np.arange(len(thresholds))
+    starts = np.zeros(len(thresholds), dtype=np.int64)
+    while len(idx):
+        ends = np.searchsorted(cum, cum[starts] + thresholds[idx], side="left")
+        ok = ends <= n
+        if not ok.all():
+            done = idx[~ok]
+            totals["waste_sum"][done] += cum[n] - cum[starts[~ok]]
+            idx, starts, ends = idx[ok], starts[ok], ends[ok]
+        ends = np.maximum(ends, starts + 1)
+        weights = cum[ends] - cum[starts]
+        totals["count"][idx] += 1
+        totals["weight_sum"][idx] += weights
+        totals["weight_sq_sum"][idx] += weights * weights
+        totals["t1_count"][idx] += weights < t1_limit
+        totals["t2_count"][idx] += weights < t2_limit
+        starts = ends
+        # Portions that ended exactly on the last slice leave no waste.
+        finished = starts >= n
+        if finished.any():
+            idx, starts = idx[~finished], starts[~finished]
+
+
+def _interpolated_totals(slice_weights, cum, thresholds, t1_limit, t2_limit, totals):
+    # slice_weights in accumulation order, cum their cumulative weights.
+    total = cum[-1]
+    counts = np.floor(total / thresholds)
+    waste = total - counts * thresholds
+    carry_over = np.flatnonzero(thresholds <= slice_weights.max()) if len(slice_weights) else []
+    for k in carry_over:
+        # The engine accumulates from the end of the array it is given.
+        _, _, _, weights, _, waste_portion = _reverse_interpolated_arrays(slice_weights[::-1], 1.0, thresholds[k])
+        counts[k] = len(weights)
+        waste[k] = waste_portion[3]
+    totals["count"] += counts
+    totals["weight_sum"] += counts * thresholds
+    totals["weight_sq_sum"] += counts * thresholds * thresholds
+    totals["t1_count"] += counts * (thresholds < t1_limit)
+    totals["t2_count"] += counts * (thresholds < t2_limit)
+    totals["waste_sum"] += waste
+
+
+def _sweep_chunk(params, seed, start, stop, thresholds, interpolation=(False, True)):
+    t1_limit, t2_limit = tolerance_limits(params["target_portion_weight"])
+    greedy = _empty_totals(len(thresholds))
+    interpolated = _empty_totals(len(thresholds))
+    for i in range(start, stop):
+        _, slice_weights = loaf_slice_weights(params, loaf_rng(seed, i))
+        if params["reverse"]:
+            slice_weights = slice_weights[::-1]
+        cum = cumulative_weights(slice_weights)
+        if False in interpolation:
+            _greedy_totals(cum, thresholds, t1_limit, t2_limit, greedy)
+        if True in interpolation:
+            _interpolated_totals(slice_weights, cum, thresholds, t1_limit, t2_limit, interpolated)
+    return greedy, interpolated
+
+
+def _wilson_upper(successes, trials, z):
+    trials = np.maximum(trials, 1)
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    centre = p + z * z / (2 * trials)
+    margin = z * np.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials))
+    return (centre + margin) / denominator
+
+
+def sweep(params=None, tolerances=None, target_offsets=None, interpolation=(False, True),
+          n_loaves=1000, seed=0, confidence=0.95, workers=None, chunk_size=50):
+    params = make_params(**(params or {}))
+    nominal = params["target_portion_weight"]
+    tolerances = np.asarray(np.linspace(0.90, 1.0, 100) if tolerances is None else tolerances, dtype=np.float64)
+    target_offsets = np.asarray(np.linspace(0.0, 10.0, 100) if target_offsets is None else target_offsets,
+                                dtype=np.float64)
+    # Cut threshold for every (tolerance, offset) pair, flattened for the workers.
+    thresholds = ((nominal + target_offsets)[None, :] * tolerances[:, None]).ravel()
+
+    greedy = _empty_totals(len(thresholds))
+    interpolated = _empty_totals(len(thresholds))
+    chunks = [(s, min(s + chunk_size, n_loaves)) for s in range(0, n_loaves, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_sweep_chunk, params, seed, s, e, thresholds, tuple(interpolation))
+                   for s, e in chunks]
+        for future in futures:
+            g, p = future.result()
+            for name in ACCUMULATORS:
+                greedy[name] += g[name]
+                interpolated[name] += p[name]
+
+    z = NormalDist().inv_cdf(confidence)
+    shape = (len(tolerances), len(target_offsets))
+    grid = {}
+    for flag in interpolation:
+        totals = interpolated if flag else greedy
+        count = np.maximum(totals["count"], 1)
+        mean = totals["weight_sum"] / count
+        variance = np.maximum(totals["weight_sq_sum"] / count - mean * mean, 0.0)
+        rule1 = mean - z * np.sqrt(variance / count) >= nominal
+        rule2 = _wilson_upper(totals["t1_count"], totals["count"], z) <= T1_ALLOWED_FRACTION
+        rule3 = totals["t2_count"] == 0
+        grid[flag] = {
+            "mean_weight": mean.reshape(shape),
+            "giveaway_per_pack": (mean - nominal).reshape(shape),
+            "waste_per_loaf": (totals["waste_sum"] / n_loaves).reshape(shape),
+            "packs_per_loaf": (totals["count"] / n_loaves).reshape(shape),
+            "t1_rate": (totals["t1_count"] / count).reshape(shape),
+            "t2_count": totals["t2_count"].reshape(shape),
+            "passes": (rule1 & rule2 & rule3 & (totals["count"] > 0)).reshape(shape),
+        }
+
+    return {"tolerances": tolerances, "target_offsets": target_offsets, "grid": grid,
+            "best": best_setting(grid, tolerances, target_offsets)}
+
+
+def best_setting(grid, tolerances, target_offsets):
+    # Lowest giveaway per pack among passing settings; ties go to the lower waste.
+    best = None
+    for flag, result in grid.items():
+        passing = np.argwhere(result["passes"])
+        for i, j in passing:
+            key = (result["giveaway_per_pack"][i, j], result["waste_per_loaf"][i, j])
+            if best is None or key < best[0]:
+                best = (key, flag, i, j)
+    if best is None:
+        return None
+    _, flag, i, j = best
+    result = grid[flag]
+    return {
+        "linear_interpolation": bool(flag),
+        "tolerance": float(tolerances[i]),
+        "target_offset": float(target_offsets[j]),
+        "giveaway_per_pack": float(result["giveaway_per_pack"][i, j]),
+        "waste_per_loaf": float(result["waste_per_loaf"][i, j]),
+        "packs_per_loaf": float(result["packs_per_loaf"][i, j]),
+        "t1_rate": float(result["t1_rate"][i, j]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the tolerance/target setting with the least giveaway.")
+    parser.add_argument("--loaves", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--tolerance-steps", type=int, default=100)
+    parser.add_argument("--offset-steps", type=int, default=100)
+    parser.add_argument("--max-offset", type=float, default=10.0, help="grams above nominal")
+    parser.add_argument("--target", type=float, default=250.0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    result = sweep(
+        {"target_portion_weight": args.target},
+        tolerances=np.linspace(0.90, 1.0, args.tolerance_steps),
+        target_offsets=np.linspace(0.0, args.max_offset, args.offset_steps),
+        n_loaves=args.loaves, seed=args.seed, confidence=args.confidence, workers=args.workers,
+    )
+    print(json.dumps(result["best"], indent=2))
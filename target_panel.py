@@ -0,0 +1,55 @@
+import tkinter as tk
+from tkinter import ttk
+
+# Target weight comparison window for the calculators.
+#
+# One row per target weight from portion_pipeline.compare_targets(): every target is cut
+# from the same loaf, so the rows differ only by the target. The summary line names the
+# target with the least giveaway plus waste per pack among those passing all Three
+# Packers rules.
+
+COLUMNS = (
+    ("target", "Target (g)", 80),
+    ("portions", "Portions", 70),
+    ("mean", "Mean (g)", 80),
+    ("giveaway", "Giveaway (g)", 90),
+    ("waste", "Waste (g)", 80),
+    ("waste_pct", "Waste (%)", 75),
+    ("t1", "T1", 45),
+    ("t2", "T2", 45),
+    ("rules", "Rules", 60),
+)
+
+
+class TargetComparisonPanel(tk.Toplevel):
+    def __init__(self, master, title="Target Comparison"):
+        super().__init__(master)
+        self.title(title)
+        self.tree = ttk.Treeview(self, columns=[name for name, _, _ in COLUMNS], show="headings", height=12)
+        for name, heading, width in COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, anchor=tk.E)
+        self.tree.tag_configure("fail", foreground="red")
+        self.tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.summary_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self.summary_var).pack(side=tk.TOP, fill=tk.X, padx=5, pady=(0, 5))
+
+    def show(self, rows):
+        self.tree.delete(*self.tree.get_children())
+        for row in rows:
+            compliance = row["compliance"]
+            mean = "-" if row["mean_g"] is None else f"{row['mean_g']:.2f}"
+            self.tree.insert("", tk.END, values=(
+                f"{row['target_g']:g}", row["portions"], mean, f"{row['giveaway_g']:.2f}",
+                f"{row['waste_g']:.2f}", f"{row['waste_pct']:.1f}", compliance["t1_count"],
+                compliance["t2_count"], compliance["overall"],
+            ), tags=() if compliance["overall"] == "PASS" else ("fail",))
+        passing = [row for row in rows if row["portions"] and row["compliance"]["overall"] == "PASS"]
+        if passing:
+            best = min(passing, key=lambda row: (row["giveaway_g"] + row["waste_g"]) / row["portions"])
+            self.summary_var.set(f"Least giveaway + waste per pack: {best['target_g']:g} g "
+                                 f"({(best['giveaway_g'] + best['waste_g']) / best['portions']:.2f} g per pack)")
+        else:
+            self.summary_var.set("No target passes the Three Packers Rules on this loaf.")
+        self.deiconify()
+        self.lift()
@@ -0,0 +1,140 @@
+import math
+
+import numpy as np
+
+# UK three packers rule - https://www.stevenstraceability.com/average-weight-explained/
+#
+# Rule 1: the average weight of a batch must meet or exceed the nominal weight.
+# Rule 2: no more than 2.5% of packs may fall below T1 (nominal - 1x TNE).
+# Rule 3: no pack may fall below T2 (nominal - 2x TNE).
+#
+# The rules apply per batch, so ComplianceTracker takes pack weights incrementally and
+# keeps the running totals needed to report PASS/FAIL and headroom in O(1) per pack.
+
+# TNE table: each band covers (previous upper bound, upper bound]; the first band starts
+# at 5 g inclusive. TNE = nominal * percent + fixed.
+TNE_UPPER_BOUNDS = np.array([50, 100, 200, 300, 500, 1000, 10000, 15000], dtype=np.float64)
+TNE_PERCENT = np.array([0.09, 0, 0.045, 0, 0.03, 0, 0.015, 0, 0.01], dtype=np.float64)
+TNE_FIXED = np.array([0, 4.5, 0, 9, 0, 15, 0, 150, 0], dtype=np.float64)
+TNE_MINIMUM_NOMINAL = 5
+
+T1_ALLOWED_FRACTION = 0.025
+
+
+def get_tne(nominal_weight):
+    # Works on a single nominal weight or an array of them.
+    nominal = np.asarray(nominal_weight, dtype=np.float64)
+    band = np.searchsorted(TNE_UPPER_BOUNDS, nominal, side="left")
+    tne = nominal * TNE_PERCENT[band] + TNE_FIXED[band]
+    tne = np.where(nominal < TNE_MINIMUM_NOMINAL, 0.0, tne)
+    return float(tne) if tne.ndim == 0 else tne
+
+
+def tolerance_limits(nominal_weight):
+    # (T1, T2) lower limits in grams.
+    tne = get_tne(nominal_weight)
+    return nominal_weight - tne, nominal_weight - 2 * tne
+
+
+class ComplianceTracker:
+    __slots__ = ("nominal_weight", "tne", "t1_limit", "t2_limit",
+                 "count", "total_weight", "t1_count", "t2_count", "min_weight")
+
+    def __init__(self, nominal_weight):
+        self.nominal_weight = float(nominal_weight)
+        self.tne = get_tne(self.nominal_weight)
+        self.t1_limit = self.nominal_weight - self.tne
+        self.t2_limit = self.nominal_weight - 2 * self.tne
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_weight = 0.0
+        self.t1_count = 0
+        self.t2_count = 0
+        self.min_weight = math.inf
+
+    def add(self, weight):
+        weight = float(weight)
+        self.count += 1
+        self.total_weight += weight
+        if weight < self.t1_limit:
+            self.t1_count += 1
+            if weight < self.t2_limit:
+                self.t2_count += 1
+        if weight < self.min_weight:
+            self.min_weight = weight
+
+    def add_many(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) == 0:
+            return
+        self.count += len(weights)
+        self.total_weight += float(weights.sum())
+        self.t1_count += int(np.count_nonzero(weights < self.t1_limit))
+        self.t2_count += int(np.count_nonzero(weights < self.t2_limit))
+        self.min_weight = min(self.min_weight, float(weights.min()))
+
+    def merge(self, other):
+        # Combine two trackers for the same nominal weight (e.g. one per line or worker).
+        if other.nominal_weight != self.nominal_weight:
+            raise ValueError("Cannot merge trackers for different nominal weights")
+        self.count += other.count
+        self.total_weight += other.total_weight
+        self.t1_count += other.t1_count
+        self.t2_count += other.t2_count
+        self.min_weight = min(self.min_weight, other.min_weight)
+
+    @property
+    def average_weight(self):
+        return self.total_weight / self.count if self.count else 0.0
+
+    @property
+    def t1_allowed(self):
+        return math.floor(self.count * T1_ALLOWED_FRACTION)
+
+    @property
+    def rule1_pass(self):
+        return self.count > 0 and self.average_weight >= self.nominal_weight
+
+    @property
+    def rule2_pass(self):
+        return self.t1_count <= self.count * T1_ALLOWED_FRACTION
+
+    @property
+    def rule3_pass(self):
+        return self.t2_count == 0
+
+    @property
+    def passed(self):
+        return self.rule1_pass and self.rule2_pass and self.rule3_pass
+
+    def status(self):
+        # Snapshot of the batch, including how much room is left before each rule fails:
+        #   rule1 headroom - grams above nominal x count (negative = short),
+        #   rule2 headroom - further T1 packs allowed at the current batch size,
+        #   rule3 headroom - grams between the lightest pack and T2.
+        return {
+            "nominal_weight": self.nominal_weight,
+            "tne": self.tne,
+            "t1_limit": self.t1_limit,
+            "t2_limit": self.t2_limit,
+            "count": self.count,
+            "average_weight": self.average_weight,
+            "t1_count": self.t1_count,
+            "t2_count": self.t2_count,
+            "rule1": "PASS" if self.rule1_pass else "FAIL",
+            "rule2": "PASS" if self.rule2_pass else "FAIL",
+            "rule3": "PASS" if self.rule3_pass else "FAIL",
+            "overall": "PASS" if self.passed else "FAIL",
+            "rule1_headroom": self.total_weight - self.nominal_weight * self.count,
+            "rule2_headroom": self.t1_allowed - self.t1_count,
+            "rule3_headroom": (self.min_weight - self.t2_limit) if self.count else None,
+        }
+
+
+def check_batch(weights, nominal_weight):
+    # One-shot status for a complete set of pack weights.
+    tracker = ComplianceTracker(nominal_weight)
+    tracker.add_many(weights)
+    return tracker.status()
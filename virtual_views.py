@@ -0,0 +1,147 @@
+import tkinter as tk
+from tkinter import ttk
+
+import numpy as np
+
+# Virtualized list view for the Slice Weights and Cut Solution boxes.
+#
+# Inserting one Text line per slice freezes Tk on large scans. This view keeps only the
+# rows that fit in the window inside its Text widget and formats them on demand from a
+# callback, so rendering cost depends on the window height, not on the number of rows.
+#
+# Rows are a few fixed header lines, the data rows, then a few fixed footer lines. Data rows
+# can be filtered (e.g. only portions below T1) and the "Go to" box jumps to a slice or
+# portion by its 1-based number.
+
+
+class VirtualListView(ttk.Frame):
+    def __init__(self, master, height=10, width=50, row_label="Row", **kwargs):
+        super().__init__(master, **kwargs)
+        self.row_label = row_label
+        self.header = []
+        self.footer = []
+        self.format_row = None
+        self.row_count = 0
+        self.filters = {}
+        self.view_rows = None  # data row ids after filtering (None = all rows)
+        self.top = 0
+
+        toolbar = ttk.Frame(self)
+        toolbar.pack(side=tk.TOP, fill=tk.X)
+        ttk.Label(toolbar, text=f"Go to {row_label}:").pack(side=tk.LEFT)
+        self.goto_var = tk.StringVar()
+        goto_entry = ttk.Entry(toolbar, textvariable=self.goto_var, width=10)
+        goto_entry.pack(side=tk.LEFT, padx=5)
+        goto_entry.bind("<Return>", lambda event: self._goto())
+        ttk.Button(toolbar, text="Go", command=self._goto).pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar(value="All")
+        self.filter_box = ttk.Combobox(toolbar, textvariable=self.filter_var, values=["All"],
+                                       state="readonly", width=16)
+        self.filter_box.pack(side=tk.RIGHT)
+        self.filter_box.bind("<<ComboboxSelected>>", lambda event: self._apply_filter())
+        self.count_label = ttk.Label(toolbar, text="")
+        self.count_label.pack(side=tk.RIGHT, padx=5)
+
+        self.scrollbar = ttk.Scrollbar(self, command=self._on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text = tk.Text(self, height=height, width=width, wrap="none")
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.text.bind("<Configure>", lambda event: self._render())
+        self.text.bind("<MouseWheel>", self._on_wheel)
+        self.text.bind("<Button-4>", lambda event: self.scroll_rows(-3))
+        self.text.bind("<Button-5>", lambda event: self.scroll_rows(3))
+        self.text.bind("<Prior>", lambda event: self.scroll_rows(-self._visible_rows()) or "break")
+        self.text.bind("<Next>", lambda event: self.scroll_rows(self._visible_rows()) or "break")
+        self.text.bind("<Home>", lambda event: self.scroll_to(0) or "break")
+        self.text.bind("<End>", lambda event: self.scroll_to(self._total_rows()) or "break")
+
+    def set_rows(self, count, format_row, header=(), footer=(), filters=None):
+        # format_row(i) returns the text for data row i (0-based). filters maps a label to
+        # a callable returning the data row ids to show.
+        self.header = list(header)
+        self.footer = list(footer)
+        self.row_count = count
+        self.format_row = format_row
+        self.filters = dict(filters or {})
+        self.filter_box.config(values=["All"] + list(self.filters))
+        self.filter_var.set("All")
+        self.view_rows = None
+        self.top = 0
+        self._render()
+
+    def clear(self):
+        self.set_rows(0, None)
+
+    def _apply_filter(self):
+        name = self.filter_var.get()
+        self.view_rows = self.filters[name]() if name in self.filters else None
+        self.top = 0
+        self._render()
+
+    def _data_count(self):
+        return self.row_count if self.view_rows is None else len(self.view_rows)
+
+    def _total_rows(self):
+        return len(self.header) + self._data_count() + len(self.footer)
+
+    def _visible_rows(self):
+        line_height = max(1, self.text.tk.call("font", "metrics", self.text.cget("font"), "-linespace"))
+        return max(1, self.text.winfo_height() // line_height) if self.text.winfo_ismapped() \
+            else int(self.text.cget("height"))
+
+    def _row_text(self, row):
+        if row < len(self.header):
+            return self.header[row]
+        row -= len(self.header)
+        if row >= self._data_count():
+            return self.footer[row - self._data_count()]
+        data_row = int(self.view_rows[row]) if self.view_rows is not None else row
+        return self.format_row(data_row)
+
+    def _render(self):
+        total = self._total_rows()
+        visible = self._visible_rows()
+        self.top = max(0, min(self.top, total - visible))
+        stop = min(total, self.top + visible)
+        self.text.config(state=tk.NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, "\n".join(self._row_text(row) for row in range(self.top, stop)))
+        self.text.config(state=tk.DISABLED)
+        if total:
+            self.scrollbar.set(self.top / total, stop / total)
+        else:
+            self.scrollbar.set(0, 1)
+        shown = self._data_count()
+        self.count_label.config(text=f"{shown} of {self.row_count}" if self.view_rows is not None
+                                else f"{self.row_count} rows")
+
+    def scroll_to(self, row):
+        self.top = int(row)
+        self._render()
+
+    def scroll_rows(self, delta):
+        self.scroll_to(self.top + delta)
+
+    def _on_scroll(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * self._total_rows())
+        elif args[0] == "scroll":
+            step = self._visible_rows() if args[2] == "pages" else 1
+            self.scroll_rows(int(args[1]) * step)
+
+    def _on_wheel(self, event):
+        self.scroll_rows(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def _goto(self):
+        # Jump to a data row by its 1-based number; with a filter active, to the first shown
+        # row at or after it.
+        try:
+            number = int(self.goto_var.get())
+        except ValueError:
+            return
+        data_row = number - 1
+        if self.view_rows is not None:
+            data_row = int(np.searchsorted(self.view_rows, data_row))
+        self.scroll_to(len(self.header) + max(0, data_row))
@@ -0,0 +1,110 @@
+import numpy as np
+
+# Volume, density and slice weights from cross-sectional areas.
+#
+# All rules work on the area array in one vectorized pass (no per-slice Python lists).
+# Slices are either evenly spaced by `slice_thickness` or placed at explicit `positions`
+# (mm along the loaf, e.g. from encoder timestamps) for non-uniform spacing.
+#
+#   "rectangle" - sum(area * thickness), the original CheesePortionCalculator rule.
+#   "trapezoid" - average of neighbouring areas over each gap, as in the interpolation build.
+#   "simpson"   - composite Simpson's rule; an odd number of gaps finishes with one trapezoid.
+
+INTEGRATION_METHODS = ("rectangle", "trapezoid", "simpson")
+
+
+def positions_from_timestamps(timestamps, belt_speed):
+    # Encoder timestamps (s) and belt speed (mm/s) -> position of each cross-section in mm.
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    return (timestamps - timestamps[0]) * belt_speed
+
+
+def slice_thicknesses(positions, n_slices=None):
+    # Thickness of each slice from its position. With one position per slice the last slice
+    # reuses the previous gap; with n_slices + 1 positions they are treated as slice edges.
+    positions = np.asarray(positions, dtype=np.float64)
+    gaps = np.diff(positions)
+    if n_slices is not None and len(positions) == n_slices + 1:
+        return gaps
+    if len(gaps) == 0:
+        raise ValueError("At least two positions are needed to derive slice thickness")
+    return np.append(gaps, gaps[-1])
+
+
+def total_volume(areas, slice_thickness=None, method="trapezoid", positions=None):
+    areas = np.asarray(areas)
+    if method not in INTEGRATION_METHODS:
+        raise ValueError(f"Unknown integration method {method!r}, expected one of {INTEGRATION_METHODS}")
+    n = len(areas)
+    if n == 0:
+        return 0.0
+
+    if positions is None:
+        if method == "rectangle" or n == 1:
+            return float(np.sum(areas, dtype=np.float64) * slice_thickness)
+        if method == "trapezoid":
+            # Same as sum(t / 2 * (a[i] + a[i + 1])) without building the pairwise array.
+            inner = np.sum(areas, dtype=np.float64) - 0.5 * (float(areas[0]) + float(areas[-1]))
+            return float(inner * slice_thickness)
+        return float(_simpson_uniform(areas, slice_thickness))
+
+    positions = np.asarray(positions, dtype=np.float64)
+    if method == "rectangle" or n == 1:
+        return float(np.dot(areas, slice_thicknesses(positions, n)))
+    gaps = np.diff(positions[:n])
+    if method == "trapezoid":
+        return float(np.dot(gaps, 0.5 * (areas[:-1] + areas[1:])))
+    return float(_simpson_nonuniform(areas, gaps))
+
+
+def _simpson_uniform(areas, h):
+    n_gaps = len(areas) - 1
+    even = n_gaps - (n_gaps % 2)
+    volume = 0.0
+    if even:
+        a = areas[:even + 1]
+        volume = h / 3 * (float(a[0]) + float(a[-1])
+                          + 4 * np.sum(a[1:-1:2], dtype=np.float64)
+                          + 2 * np.sum(a[2:-1:2], dtype=np.float64))
+    if n_gaps % 2:
+        volume += h / 2 * (float(areas[-2]) + float(areas[-1]))
+    return volume
+
+
+def _simpson_nonuniform(areas, gaps):
+    # Simpson's rule for uneven spacing, applied to each pair of gaps at once.
+    n_gaps = len(gaps)
+    even = n_gaps - (n_gaps % 2)
+    volume = 0.0
+    if even:
+        h0 = gaps[0:even:2]
+        h1 = gaps[1:even:2]
+        f0 = areas[0:even:2]
+        f1 = areas[1:even:2]
+        f2 = areas[2:even + 1:2]
+        hsum = h0 + h1
+        volume = float(np.sum(hsum / 6 * (f0 * (2 - h1 / h0) + f1 * hsum * hsum / (h0 * h1)
+                                          + f2 * (2 - h0 / h1))))
+    if n_gaps % 2:
+        volume += float(gaps[-1] / 2 * (areas[-2] + areas[-1]))
+    return volume
+
+
+def slice_weights_from_areas(areas, slice_thickness, density, positions=None, dtype=np.float64):
+    # weight[i] = area[i] * thickness[i] * density, written straight into a dtype array.
+    areas = np.asarray(areas)
+    out = np.empty(len(areas), dtype=dtype)
+    if positions is None:
+        np.multiply(areas, slice_thickness * density, out=out, casting="unsafe")
+    else:
+        np.multiply(areas, slice_thicknesses(positions, len(areas)) * density, out=out, casting="unsafe")
+    return out
+
+
+def density_and_slice_weights(areas, total_weight, slice_thickness=None, method="trapezoid",
+                              positions=None, dtype=np.float64):
+    # Returns (total_volume, density, slice_weights) for a loaf of known total weight.
+    volume = total_volume(areas, slice_thickness, method, positions)
+    density = total_weight / volume
+    weights = slice_weights_from_areas(areas, slice_thickness, density, positions, dtype)
+    return volume, density, weights